@@ -0,0 +1,79 @@
+import argparse
+
+from datatrove.executor.base import PipelineExecutor
+from datatrove.executor.local import LocalPipelineExecutor
+from datatrove.pipeline.dedup.exact_dedup import (
+    ExactDedupConfig,
+    ExactDedupFilter,
+    ExactDedupSignature,
+    ExactFindDedups,
+)
+from datatrove.pipeline.readers import JsonlReader
+from datatrove.pipeline.writers.jsonl import JsonlWriter
+
+
+"""
+Example on how to use exact (full document) deduplication.
+Much cheaper than minhash: run it first to remove identical copies before the expensive dedup stages.
+To run exact deduplication we need to run three different pipelines (same as url dedup)
+"""
+
+
+# modify exact dedup hyper params here
+exact_dedup_config = ExactDedupConfig(
+    # this will keep the most recent copy of each document
+    keep="newest",
+    date_key="date",
+)
+
+FINDER_WORKERS = 4  # this will speed up/parallelize step 2
+
+LIMIT = -1  # for testing
+
+
+def run_example(args):
+    pipeline_1 = [
+        JsonlReader(args.input_folder, limit=LIMIT, doc_progress=True),
+        ExactDedupSignature(
+            output_folder=f"{args.sigs_dup_folder}/sigs",
+            config=exact_dedup_config,
+            finder_workers=FINDER_WORKERS,
+        ),
+    ]
+
+    pipeline_2 = [
+        ExactFindDedups(
+            data_folder=f"{args.sigs_dup_folder}/sigs",
+            output_folder=f"{args.sigs_dup_folder}/dups",
+            config=exact_dedup_config,
+        )
+    ]
+
+    pipeline_3 = [
+        JsonlReader(data_folder=args.input_folder, limit=LIMIT, doc_progress=True),
+        ExactDedupFilter(
+            data_folder=f"{args.sigs_dup_folder}/dups",
+            config=exact_dedup_config,
+            exclusion_writer=JsonlWriter(output_folder=f"{args.base_output_folder}/removed"),
+        ),
+        JsonlWriter(output_folder=f"{args.base_output_folder}/output"),
+    ]
+
+    executor_1: PipelineExecutor = LocalPipelineExecutor(pipeline=pipeline_1, tasks=4)
+
+    executor_2: PipelineExecutor = LocalPipelineExecutor(pipeline=pipeline_2, tasks=FINDER_WORKERS)
+
+    executor_3: PipelineExecutor = LocalPipelineExecutor(pipeline=pipeline_3, tasks=4)
+
+    print(executor_1.run())
+    print(executor_2.run())
+    print(executor_3.run())
+
+
+parser = argparse.ArgumentParser(description="Exact Deduplication")
+parser.add_argument("input_folder", help="Input folder path")
+parser.add_argument("base_output_folder", help="Base output folder path")
+parser.add_argument("sigs_dup_folder", help="sigs-dup folder path")
+if __name__ == "__main__":
+    args = parser.parse_args()
+    run_example(args)
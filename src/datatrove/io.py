@@ -1,11 +1,14 @@
+import io
 import os.path
+from collections import OrderedDict
 from glob import has_magic
 from typing import IO, Callable, TypeAlias
 
 from fsspec import AbstractFileSystem
 from fsspec import open as fsspec_open
 from fsspec.callbacks import NoOpCallback, TqdmCallback
-from fsspec.core import get_fs_token_paths, strip_protocol, url_to_fs
+from fsspec.compression import compr
+from fsspec.core import get_compression, get_fs_token_paths, strip_protocol, url_to_fs
 from fsspec.implementations.cached import CachingFileSystem
 from fsspec.implementations.dirfs import DirFileSystem
 from fsspec.implementations.local import LocalFileSystem
@@ -19,17 +22,57 @@ class OutputFileManager:
     """A simple file manager to create/handle/close multiple output files.
         Will keep track of different output files by name and properly cleanup in the end.
 
+        When `max_open_files` is set, the least recently used file is closed whenever a new one has to be opened
+        beyond this limit. If the evicted file is requested again, it is reopened in append mode (new compressed
+        files are simply appended as a new gzip member/zstd frame).
+
     Args:
         fs: the filesystem to use (see fsspec for more details)
         mode: the mode to open the files with
         compression: the compression to use
+        max_open_files: maximum number of simultaneously open files. -1 for unlimited
+        on_evict: called with the filename of a file that is about to be closed to respect `max_open_files`
     """
 
-    def __init__(self, fs, mode: str = "wt", compression: str | None = "infer"):
+    def __init__(
+        self,
+        fs,
+        mode: str = "wt",
+        compression: str | None = "infer",
+        max_open_files: int = -1,
+        on_evict: Callable[[str], None] | None = None,
+    ):
         self.fs = fs
         self.mode = mode
         self.compression = compression
-        self._output_files = {}
+        self.max_open_files = max_open_files
+        self.on_evict = on_evict
+        self._output_files = OrderedDict()
+        self._raw_files = {}
+        self._evicted_files = set()
+
+    def _open(self, filename):
+        """
+            Open the underlying (binary, uncompressed) file and wrap it with the compression and text layers.
+            We keep a reference to the raw file to be able to measure the written (compressed) size and to close it.
+        Args:
+            filename: name of the file to open
+
+        Returns: a file handler we can write to
+
+        """
+        # files that were closed to respect `max_open_files` are appended to
+        mode = self.mode.replace("w", "a") if filename in self._evicted_files else self.mode
+        text_mode = "b" not in mode
+        raw_file = self.fs.open(filename, mode=mode.replace("t", "") + "b" if text_mode else mode)
+        file = raw_file
+        compression = get_compression(filename, self.compression)
+        if compression is not None:
+            file = compr[compression](raw_file, mode=mode[0])
+        if text_mode:
+            file = io.TextIOWrapper(file)
+        self._raw_files[filename] = raw_file
+        return file
 
     def get_file(self, filename):
         """
@@ -41,9 +84,37 @@ class OutputFileManager:
 
         """
         if filename not in self._output_files:
-            self._output_files[filename] = self.fs.open(filename, mode=self.mode, compression=self.compression)
+            if 0 < self.max_open_files <= len(self._output_files):
+                self._evict()
+            self._output_files[filename] = self._open(filename)
+        elif self.max_open_files > 0:
+            self._output_files.move_to_end(filename)
         return self._output_files[filename]
 
+    def _evict(self):
+        """
+        Close the least recently used file. `on_evict` is called before closing it, so that any data still
+        depending on it can be flushed.
+        """
+        filename = next(iter(self._output_files))
+        if self.on_evict:
+            self.on_evict(filename)
+        self.close_file(filename)
+        self._evicted_files.add(filename)
+
+    def get_file_size(self, filename) -> int:
+        """
+            Number of bytes written to the underlying file so far, i.e. after compression. Data still buffered by
+            the compression/text layers is not included.
+        Args:
+          filename: name of the file to open/get if previously opened
+
+        Returns: the size in bytes
+
+        """
+        self.get_file(filename)
+        return self._raw_files[filename].tell()
+
     def get_open_files(self):
         """
         Getter for output files
@@ -60,8 +131,23 @@ class OutputFileManager:
         """
         file = self.get_file(filename)
         self._output_files.pop(filename)
+        self._raw_files.pop(filename)
         return file
 
+    def close_file(self, filename):
+        """
+            Close a single file, as well as the underlying raw file (compression wrappers do not close the file they
+            wrap), and clean up internal references to it.
+        Args:
+            filename: name of the file to close
+        """
+        if filename not in self._output_files:
+            return
+        raw_file = self._raw_files[filename]
+        self.pop(filename).close()
+        if not raw_file.closed:
+            raw_file.close()
+
     def write(self, filename, data):
         """
             Write data to a given file.
@@ -79,9 +165,12 @@ class OutputFileManager:
         """
         Close all currently open output files and clear the list of file.
         """
-        for file in self._output_files.values():
+        for filename, file in self._output_files.items():
             file.close()
+            if not self._raw_files[filename].closed:
+                self._raw_files[filename].close()
         self._output_files.clear()
+        self._raw_files.clear()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
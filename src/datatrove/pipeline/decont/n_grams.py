@@ -4,6 +4,8 @@ First build an index using the tasks we want to use to decontaminate our trainin
 Then read your training data and apply the filter with the index loaded.
 """
 
+import hashlib
+import json
 import os
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
@@ -11,9 +13,10 @@ from dataclasses import dataclass, field
 from typing import Tuple
 
 import numpy as np
+from huggingface_hub import cached_assets_path
 
 from datatrove.data import Document, DocumentsPipeline
-from datatrove.io import DataFolderLike, file_exists, get_datafolder, open_file
+from datatrove.io import DataFolderLike, file_exists, get_datafolder, open_file, safely_create_file
 from datatrove.pipeline.base import PipelineStep
 from datatrove.pipeline.filters.base_filter import BaseFilter
 from datatrove.pipeline.writers.disk_base import DiskWriter
@@ -25,6 +28,10 @@ from datatrove.utils.typeshelper import Languages
 from datatrove.utils.word_tokenizers import load_word_tokenizer
 
 
+# number of hashes written at a time when merging the index files
+INDEX_WRITE_CHUNK_SIZE = 2**24
+
+
 @dataclass
 class NGramsDecontConfig:
     """
@@ -175,6 +182,7 @@ class NGramsDecontFilter(BaseFilter):
 
     type = "🦠 - DECONT"
     name = "💥 N-grams decontaminate"
+    _requires_dependencies = ["fasteners"]
 
     def __init__(
         self,
@@ -189,39 +197,104 @@ class NGramsDecontFilter(BaseFilter):
         self.exclusion_writer = exclusion_writer
         self.language = language
         self._index_hashes = None
+        self._index_task_ids = None
+        self._task_names = None
         self.hash_func = create_hash_func(self.config.hash_config)
         self.tokenizer = load_word_tokenizer(language)
 
-    def load_index_hashes(self):
+    def merge_index_files(self, files: list[str], hashes_path: str, task_ids_path: str):
+        """Merge the index files into a single sorted hash array, with the (index of the) task of each hash, and save
+            both arrays to local files.
+
+        Args:
+            files: the index files, in task order
+            hashes_path: local path of the sorted hashes
+            task_ids_path: local path of the task id of each hash
+        """
+        dtype = np.dtype(self.config.hash_config.np_descr)
+
         def load_index_from_file(file):
+            if self.index_folder.is_local():
+                # memory mapped: the data is only read when concatenating the indexes
+                path = self.index_folder.resolve_paths(file)
+                return np.memmap(path, dtype=dtype, mode="r") if os.path.getsize(path) else np.empty(0, dtype)
             with self.index_folder.open(file, mode="rb") as f:
-                return file, read_np_from_file(
-                    f, np.dtype(self.config.hash_config.np_descr), self.index_folder.is_local()
-                ).tolist()
+                return read_np_from_file(f, dtype, is_local_file=False)
 
         with ThreadPoolExecutor() as pool:
-            hashes = pool.map(load_index_from_file, self.index_folder.list_files(glob_pattern="**/*.index.hashes"))
+            hashes = list(pool.map(load_index_from_file, files))
+        for file, hasharray in zip(files, hashes):
+            logger.info(f"Loading {len(hasharray)} hashes for {file.removesuffix('.index.hashes')}")
+        task_ids = np.repeat(
+            np.arange(len(hashes), dtype=np.min_scalar_type(max(len(hashes) - 1, 0))),
+            [len(hasharray) for hasharray in hashes],
+        )
+        index_hashes = np.concatenate(hashes) if hashes else np.empty(0, dtype=dtype)
+        del hashes
+        # stable: for hashes present in several tasks, the last one is the task of the last file (as listed)
+        order = np.argsort(index_hashes, kind="stable")
+        # written in chunks, so that the sorted copies are never fully in memory
+        for path, array in ((hashes_path, index_hashes), (task_ids_path, task_ids)):
+            with open(path, "wb") as f:
+                for chunk_start in range(0, len(order), INDEX_WRITE_CHUNK_SIZE):
+                    array[order[chunk_start : chunk_start + INDEX_WRITE_CHUNK_SIZE]].tofile(f)
 
-        self._index_hashes = {}
-        for filename, hashlist in hashes:
-            taskname = filename.removesuffix(".index.hashes")
-            logger.info(f"Loading {len(hashlist)} hashes for {taskname}")
-            for hash in hashlist:
-                self._index_hashes[hash] = taskname
+    def load_index_hashes(self):
+        """Load the sorted hashes and task ids of all the index files.
+        They are merged once per machine into a local cache (keyed by the index files and their sizes) and memory
+        mapped, so that every worker shares the same pages instead of holding its own copy.
+        """
+        files = self.index_folder.list_files(glob_pattern="**/*.index.hashes")
+        self._task_names = [filename.removesuffix(".index.hashes") for filename in files]
+        dtype = np.dtype(self.config.hash_config.np_descr)
+        files_info = [self.index_folder.info(file) for file in files]
+        cache_key = hashlib.sha256(
+            json.dumps(
+                [
+                    self.index_folder.path,
+                    dtype.str,
+                    [
+                        (file, info["size"], str(info.get("mtime", info.get("LastModified", ""))))
+                        for file, info in zip(files, files_info)
+                    ],
+                ]
+            ).encode()
+        ).hexdigest()
+        cache_dir = cached_assets_path(library_name="datatrove", namespace="decont", subfolder="ngrams_index")
+        hashes_path = os.path.join(cache_dir, f"{cache_key}.hashes")
+        task_ids_path = os.path.join(cache_dir, f"{cache_key}.task_ids")
+        safely_create_file(
+            os.path.join(cache_dir, cache_key), lambda: self.merge_index_files(files, hashes_path, task_ids_path)
+        )
+
+        task_ids_dtype = np.min_scalar_type(max(len(files) - 1, 0))
+        nb_hashes = os.path.getsize(hashes_path) // dtype.itemsize
+        self._index_hashes, self._index_task_ids = (
+            np.memmap(path, dtype=array_dtype, mode="r", shape=(nb_hashes,))
+            if nb_hashes
+            else np.empty(0, dtype=array_dtype)
+            for path, array_dtype in ((hashes_path, dtype), (task_ids_path, task_ids_dtype))
+        )
 
     def filter(self, doc: Document) -> bool | Tuple[bool, str]:
         if self._index_hashes is None:
             self.load_index_hashes()
 
         text_tokens = self.tokenizer.word_tokenize(simplify_text(doc.text, self.config.norm_config))
-        ngrams_to_compute = list(ngrams(text_tokens, self.config.n_grams))
-        for n_gram in map(" ".join, ngrams_to_compute):
-            task = self._index_hashes.get(self.hash_func(n_gram), None)
-            if task is not None:
-                doc.metadata["contaminated_ngram"] = n_gram
-                doc.metadata["contaminated_task"] = task
-                self.stat_update(f"contaminated_{task}")
-                if ":" in task:
-                    self.stat_update(f"contaminated_tg_{task[: task.index(':')]}")
-                return False, "contaminated"
+        n_grams = [" ".join(n_gram) for n_gram in ngrams(text_tokens, self.config.n_grams)]
+        if not n_grams or not len(self._index_hashes):
+            return True
+        hashes = np.fromiter(map(self.hash_func, n_grams), dtype=self._index_hashes.dtype, count=len(n_grams))
+        positions = np.searchsorted(self._index_hashes, hashes, side="right") - 1
+        found = (positions >= 0) & (self._index_hashes[positions] == hashes)
+        if found.any():
+            # first contaminated n-gram of the document
+            ngram_i = int(np.argmax(found))
+            task = self._task_names[self._index_task_ids[positions[ngram_i]]]
+            doc.metadata["contaminated_ngram"] = n_grams[ngram_i]
+            doc.metadata["contaminated_task"] = task
+            self.stat_update(f"contaminated_{task}")
+            if ":" in task:
+                self.stat_update(f"contaminated_tg_{task[: task.index(':')]}")
+            return False, "contaminated"
         return True
@@ -1,7 +1,9 @@
 from .bloom_filter import SingleBloomFilter
+from .exact_dedup import ExactDedupConfig, ExactDedupFilter, ExactDedupSignature, ExactFindDedups
 from .exact_substrings import ESDatasetToSequence, ESMergeSequences, ESRangeRemover
 from .minhash import (
     MinhashBuildIndex,
+    MinhashCompactIndex,
     MinhashConfig,
     MinhashDedupBuckets,
     MinhashDedupCluster,
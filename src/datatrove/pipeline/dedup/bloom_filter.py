@@ -1,6 +1,8 @@
 import contextlib
 import math
+import os
 from dataclasses import dataclass, field
+from typing import Literal
 
 import numpy as np
 
@@ -8,7 +10,7 @@ from datatrove.data import Document, DocumentsPipeline
 from datatrove.io import DataFolderLike, get_datafolder
 from datatrove.pipeline.base import PipelineStep
 from datatrove.pipeline.writers.disk_base import DiskWriter
-from datatrove.utils.hashing import HashConfig, create_hash_func
+from datatrove.utils.hashing import HashConfig, create_hash_func, hash_char_ngrams
 from datatrove.utils.logging import logger
 from datatrove.utils.text import TextNormConfig, ngrams, simplify_text
 from datatrove.utils.typeshelper import Languages, StatHints
@@ -31,6 +33,9 @@ class BloomFilterConfig:
         duplicated
     n_grams: n_grams to use
     seed: seed
+    tokenization: "word" for n-grams of words (from the language's word tokenizer), "char" for n-grams of
+        characters of the normalized text (ignoring whitespace), without any tokenization. Much cheaper for languages
+        such as Chinese or Japanese. `n_grams` is then a number of characters
     """
 
     m_bytes: int
@@ -39,6 +44,7 @@ class BloomFilterConfig:
     duplicate_threshold: float = 0.8
     n_grams: int = 13
     seed: int = 0
+    tokenization: Literal["word", "char"] = "word"
     norm_config: TextNormConfig = field(default_factory=TextNormConfig)
     hash_config: HashConfig = field(default_factory=lambda: HashConfig(precision=32))
 
@@ -68,8 +74,14 @@ class SingleBloomFilter(PipelineStep):
 
     Args:
         output_folder: output folder: local or on S3
-        save_bloom_filter: if true saves bloom filter for later use
+        save_bloom_filter: if true saves bloom filter for later use. Ignored in shared mode: the file at `shared_path`
+            already holds the complete filter once all the tasks are done
         exclusion_writer: saves duplicated data
+        shared_path: path to a local file holding the bit vector. It is memory-mapped, so that all the tasks (processes)
+            using the same path, for instance the workers of a `LocalPipelineExecutor`, share a single bloom filter
+            and deduplicate documents across each other. An existing file is reused
+        lock_stripes: in shared mode, the bit vector is split into this many stripes, each updated under its own
+            (byte-range) file lock
     """
 
     type = "🫂 - DEDUPS"
@@ -82,12 +94,20 @@ class SingleBloomFilter(PipelineStep):
         save_bloom_filter: bool = False,
         exclusion_writer: DiskWriter = None,
         language: str = Languages.english,
+        shared_path: str | None = None,
+        lock_stripes: int = 64,
     ):
         super().__init__()
         self.output_folder = get_datafolder(output_folder)
         self.tokenizer = load_word_tokenizer(language)
         self.config = config
-        self.bit_vector = bytearray(([0] * self.config.m_bytes))
+        self.shared_path = shared_path
+        self.lock_stripes = lock_stripes
+        self._bit_vector = None
+        self._shared_file = None
+        if save_bloom_filter and shared_path:
+            logger.warning(f"save_bloom_filter is ignored in shared mode: the bloom filter is kept in {shared_path}")
+            save_bloom_filter = False
         self.save_bloom_filter = save_bloom_filter
         self.exclusion_writer = exclusion_writer
         # TODO: Add support for 64-bit
@@ -131,6 +151,10 @@ class SingleBloomFilter(PipelineStep):
         """Get shingles from a string of text
         Shingles are created by hashing n-grams of simplified text (lower cases, whitespace normalized, no punctuation, etc).
         """
+        if self.config.tokenization == "char":
+            return hash_char_ngrams(
+                simplify_text(text, self.config.norm_config), self.config.n_grams, self.config.hash_config.precision
+            ).reshape((-1, 1))
         return np.fromiter(
             [
                 self.hash_fc(" ".join(x))
@@ -141,27 +165,76 @@ class SingleBloomFilter(PipelineStep):
             dtype=np.uint64,
         ).reshape((-1, 1))
 
-    def get_indexes(self, shingles: np.ndarray) -> list[list[int]]:
-        """Get indexes for the shingles with the k hashing functions"""
+    @property
+    def bit_vector(self) -> np.ndarray:
+        """The bit vector, allocated (or memory-mapped, in shared mode) on first use"""
+        if self._bit_vector is None:
+            if self.shared_path:
+                self._bit_vector = self._open_shared_bit_vector()
+            else:
+                self._bit_vector = np.zeros(self.config.m_bytes, dtype=np.uint8)
+        return self._bit_vector
+
+    def _open_shared_bit_vector(self) -> np.ndarray:
+        os.makedirs(os.path.dirname(os.path.abspath(self.shared_path)), exist_ok=True)
+        fd = os.open(self.shared_path, os.O_RDWR | os.O_CREAT)
+        try:
+            # only ever grows the file (with zeros): safe when several tasks open it at the same time
+            if os.fstat(fd).st_size < self.config.m_bytes:
+                os.ftruncate(fd, self.config.m_bytes)
+        finally:
+            os.close(fd)
+        # kept open for the locks
+        self._shared_file = open(self.shared_path, "r+b")
+        return np.memmap(self._shared_file, dtype=np.uint8, mode="r+", shape=(self.config.m_bytes,))
+
+    def _close_bit_vector(self):
+        if self._shared_file is not None:
+            self._bit_vector.flush()
+            self._bit_vector = None
+            self._shared_file.close()
+            self._shared_file = None
+
+    def get_indexes(self, shingles: np.ndarray) -> np.ndarray:
+        """Get indexes for the shingles with the k hashing functions. Returns an array of shape (len(shingles), k)"""
         a, b = self.parameters
-        phv = np.bitwise_and((shingles * a + b) % _mersenne_prime, self.config.m_bytes)
-        return phv.tolist()
+        return np.bitwise_and((shingles * a + b) % _mersenne_prime, self.config.m_bytes)
+
+    @staticmethod
+    def _bytes_and_masks(indexes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        indexes = np.asarray(indexes, dtype=np.uint64)
+        return indexes >> np.uint64(3), np.left_shift(1, indexes & np.uint64(7)).astype(np.uint8)
 
-    def update_bf(self, indexes: list[int]):
+    def update_bf(self, indexes: np.ndarray):
         """Update the bloom filter with the indexes"""
-        for index in indexes:
-            byte_index, bit_index = divmod(index, 8)
-            mask = 1 << bit_index
-            self.bit_vector[byte_index] |= mask
-
-    def query(self, indexes: list[int]) -> bool:
-        """Query the bloom filter with the indexes"""
-        for idx in indexes:
-            byte_index, bit_index = divmod(idx, 8)
-            mask = 1 << bit_index
-            if (self.bit_vector[byte_index] & mask) == 0:
-                return False
-        return True
+        byte_indexes, masks = self._bytes_and_masks(indexes)
+        byte_indexes, masks = byte_indexes.ravel(), masks.ravel()
+        if self._shared_file is None or not byte_indexes.size:
+            np.bitwise_or.at(self.bit_vector, byte_indexes, masks)
+            return
+        import fcntl
+
+        # other tasks write to the same bytes: lock the stripes we touch one at a time, in order (no deadlocks)
+        stripe_size = -(-self.config.m_bytes // self.lock_stripes)
+        stripes = byte_indexes // np.uint64(stripe_size)
+        order = np.argsort(stripes, kind="stable")
+        stripes, byte_indexes, masks = stripes[order], byte_indexes[order], masks[order]
+        bounds = np.flatnonzero(np.diff(stripes)) + 1
+        for stripe, stripe_bytes, stripe_masks in zip(
+            stripes[np.concatenate(([0], bounds))].tolist(), np.split(byte_indexes, bounds), np.split(masks, bounds)
+        ):
+            fcntl.lockf(self._shared_file, fcntl.LOCK_EX, stripe_size, stripe * stripe_size)
+            try:
+                np.bitwise_or.at(self.bit_vector, stripe_bytes, stripe_masks)
+            finally:
+                fcntl.lockf(self._shared_file, fcntl.LOCK_UN, stripe_size, stripe * stripe_size)
+
+    def query(self, indexes: np.ndarray) -> np.ndarray:
+        """Query the bloom filter with the indexes. Returns, for each row of k indexes (one per shingle), whether all
+        of its bits are set
+        """
+        byte_indexes, masks = self._bytes_and_masks(indexes)
+        return np.all(self.bit_vector[byte_indexes] & masks, axis=-1)
 
     def step(self, doc: Document) -> bool:
         """Deduplication step
@@ -173,16 +246,10 @@ class SingleBloomFilter(PipelineStep):
             return True
         shingle_indexes = self.get_indexes(shingles)
 
-        duplicate_shingles = 0
-        indexes_to_update = []
-        for indexes in shingle_indexes:
-            if self.query(indexes):
-                duplicate_shingles += 1
-            else:
-                indexes_to_update.extend(indexes)
-
-        self.update_bf(indexes_to_update)
-        if duplicate_shingles / len(shingles) > self.config.duplicate_threshold:
+        # all shingles are queried before any of them is added
+        is_duplicate = self.query(shingle_indexes)
+        self.update_bf(shingle_indexes[~is_duplicate])
+        if np.count_nonzero(is_duplicate) / len(shingles) > self.config.duplicate_threshold:
             self.stat_update(StatHints.dropped)
             return False
         return True
@@ -201,7 +268,8 @@ class SingleBloomFilter(PipelineStep):
                 yield doc
             if self.save_bloom_filter:
                 with self.output_folder.open("bloom_filter.bloom", mode="wb") as f:
-                    f.write(self.bit_vector)
+                    f.write(memoryview(self.bit_vector))
+            self._close_bit_vector()
 
         logger.info(f"{self.total_shingles=}")
         logger.info(
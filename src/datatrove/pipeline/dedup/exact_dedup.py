@@ -0,0 +1,296 @@
+"""
+Exact (full document) deduplication.
+"""
+
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import BinaryIO, Generator, Literal
+
+import numpy as np
+from fsspec.spec import AbstractBufferedFile
+from tqdm import tqdm
+
+from datatrove.data import Document, DocumentsPipeline
+from datatrove.io import DataFolderLike, get_datafolder
+from datatrove.pipeline.base import PipelineStep
+from datatrove.utils.binaryio import read_np_from_file, read_sorted_blocks
+from datatrove.utils.hashing import HashConfig, create_hash_func
+from datatrove.utils.logging import logger
+from datatrove.utils.text import TextNormConfig, simplify_text
+from datatrove.utils.typeshelper import ExtensionHelperSD, StatHints
+
+from ..writers.disk_base import DiskWriter
+
+
+@dataclass
+class ExactDedupConfig:
+    """
+    Args:
+        keep: which document to keep out of a group of duplicates: "first" (lowest rank, then lowest document index),
+            "longest" (longest text) or "newest" (most recent `metadata[date_key]`). Ties are broken as for "first"
+        date_key: metadata key holding the date of the document for keep="newest": an ISO 8601 string or a unix
+            timestamp. Documents without a (valid) date are considered the oldest
+        norm_config: normalization applied to the text before hashing it. By default only case, whitespace and
+            punctuation are normalized: documents differing in their numbers are kept, and the (slow) unicode
+            normalization is skipped
+        hash_config: hash function used on the normalized text. Keep 64 bits: any collision removes a document
+    """
+
+    keep: Literal["first", "longest", "newest"] = "first"
+    date_key: str = "date"
+    norm_config: TextNormConfig = field(
+        default_factory=lambda: TextNormConfig(norm_numbers=False, norm_unicode_diacritics=False)
+    )
+    hash_config: HashConfig = field(default_factory=HashConfig)
+
+
+def get_sig_dtype(config: HashConfig) -> np.dtype:
+    return np.dtype([("hash", config.np_dtype), ("priority", "<u4"), ("doc", "<u4")])
+
+
+def sort_sigs(sigs: np.ndarray, file_ids: np.ndarray | None = None) -> np.ndarray:
+    """Order of the signatures by (hash, -priority, file id, doc): the document to keep is the first of each hash"""
+    keys = (sigs["doc"],) + ((file_ids,) if file_ids is not None else ()) + (~sigs["priority"], sigs["hash"])
+    return np.lexsort(keys)
+
+
+class ExactDedupSignature(PipelineStep):
+    """ExactDedup: First pipeline step
+        Hashes the normalized text of each document. The (hash, priority, doc id) signatures are sorted and saved,
+        split by hash range into one file per finder worker.
+
+    Args:
+        output_folder: folder where signatures are saved
+        finder_workers: number of workers used in finder stage of deduplication
+        config: configuration for the dedup
+    """
+
+    type = "🫂 - DEDUPS"
+    name = "💥 exact-deduplication stage 1"
+
+    def __init__(
+        self,
+        output_folder: DataFolderLike,
+        finder_workers: int = 1,
+        config: ExactDedupConfig | None = None,
+    ):
+        super().__init__()
+        self.output_folder = get_datafolder(output_folder)
+        if finder_workers <= 0:
+            raise ValueError("finder_workers must be >= 1")
+        elif finder_workers > 1:
+            logger.warning(f"Remember to also set the number of tasks of the finder block to {finder_workers=}!")
+        self.finder_workers = finder_workers
+        self.config = config or ExactDedupConfig()
+        self.hash_fc = create_hash_func(self.config.hash_config)
+
+    def get_priority(self, doc: Document) -> int:
+        """Documents with a higher priority are kept over their duplicates"""
+        if self.config.keep == "longest":
+            return min(len(doc.text), np.iinfo(np.uint32).max)
+        if self.config.keep == "newest":
+            date = doc.metadata.get(self.config.date_key)
+            try:
+                if isinstance(date, str):
+                    date = datetime.fromisoformat(date.replace("Z", "+00:00"))
+                    if date.tzinfo is None:
+                        date = date.replace(tzinfo=timezone.utc)
+                    date = date.timestamp()
+                return int(min(max(float(date), 0), np.iinfo(np.uint32).max))
+            except (TypeError, ValueError):
+                return 0
+        return 0
+
+    def save_hashes(self, rank: int, signatures: np.ndarray):
+        signatures = signatures[sort_sigs(signatures)]
+        # boundaries of the hash range of each finder worker (the last one gets everything left)
+        hashes_per_worker = self.config.hash_config.max // self.finder_workers
+        right_idxs = np.searchsorted(
+            signatures["hash"],
+            np.arange(1, self.finder_workers, dtype=np.uint64) * np.uint64(hashes_per_worker),
+            side="right",
+        ).tolist() + [len(signatures)]
+        left_idx = 0
+        for hash_i, right_idx in enumerate(right_idxs):
+            if right_idx > left_idx:
+                with self.output_folder.open(
+                    f"{hash_i:04d}/{rank:05d}{ExtensionHelperSD.stage_1_signature}", mode="wb"
+                ) as f:
+                    f.write(signatures[left_idx:right_idx].tobytes())
+            left_idx = right_idx
+
+    def run(self, data: DocumentsPipeline, rank: int = 0, world_size: int = 1):
+        signatures = []
+        for doc_idx, doc in enumerate(data):
+            with self.stats.time_stats:
+                self.stat_update(StatHints.total)
+                signatures.append(
+                    (self.hash_fc(simplify_text(doc.text, self.config.norm_config)), self.get_priority(doc), doc_idx)
+                )
+        with self.stats.time_stats:
+            self.save_hashes(rank, np.array(signatures, dtype=get_sig_dtype(self.config.hash_config)))
+
+
+def merge_sig_files(
+    files: list[AbstractBufferedFile], sig_dtype: np.dtype, lines_to_buffer: int = -1
+) -> Generator[tuple[np.ndarray, np.ndarray], None, None]:
+    """Merge sorted signature files, block by block
+
+    Args:
+        files: (opened) signature files, each sorted by hash
+        sig_dtype: dtype of the signatures
+        lines_to_buffer: number of signatures to read from each file at a time. -1 to read everything at once
+
+    Returns: generator of (signatures, file ids) blocks, sorted by (hash, -priority, file id, doc). All the
+        signatures with the same hash are in the same block
+    """
+    for blocks in read_sorted_blocks(files, [sig_dtype] * len(files), lines_to_buffer=lines_to_buffer):
+        file_ids = np.repeat(np.arange(len(blocks)), [len(block) for block in blocks])
+        sigs = np.concatenate(blocks)
+        order = sort_sigs(sigs, file_ids)
+        yield sigs[order], file_ids[order]
+
+
+class ExactFindDedups(PipelineStep):
+    """ExactDedup: Second pipeline step
+        ExactFindDedups merges the sorted signature files from the previous step, block by block, and saves the ids
+        of all the documents sharing their hash with a higher priority document.
+
+    Args:
+        data_folder: data folder where signatures are saved
+        output_folder: folder where duplicates are saved
+        config: configuration for the dedup
+        lines_to_buffer: number of signatures to read from each file at a time. -1 to split `max_memory_size`
+            between the files
+        max_memory_size: approximate amount of memory (in bytes) to use to buffer the signatures. Everything is
+            loaded at once if the signatures fit
+    """
+
+    type = "🫂 - DEDUPS"
+    name = "💥 exact-deduplication stage 2"
+
+    def __init__(
+        self,
+        data_folder: DataFolderLike,
+        output_folder: DataFolderLike,
+        config: ExactDedupConfig | None = None,
+        lines_to_buffer: int = -1,
+        max_memory_size: int = 2**30,
+    ):
+        super().__init__()
+        self.data_folder = get_datafolder(data_folder)
+        self.output_folder = get_datafolder(output_folder)
+        self.config = config or ExactDedupConfig()
+        self.lines_to_buffer = lines_to_buffer
+        self.max_memory_size = max_memory_size
+
+    def run(self, data: DocumentsPipeline = None, rank: int = 0, world_size: int = 1):
+        with self.stats.time_stats:
+            if world_size == 1:
+                # check that there was not a mistake in setting this values
+                sig_files = self.data_folder.list_files(glob_pattern="*/*" + ExtensionHelperSD.stage_1_signature)
+                if any(not sig_file.startswith("0000/") for sig_file in sig_files):
+                    raise ValueError(
+                        f"{world_size=} but found sig files for different hash buckets. Set tasks=finder_workers"
+                    )
+            else:
+                sig_files = self.data_folder.list_files(
+                    subdirectory=f"{rank:04d}",
+                    glob_pattern=ExtensionHelperSD.stage_1_signature,
+                )
+            sig_dtype = get_sig_dtype(self.config.hash_config)
+            file_stems = [Path(file).name.removesuffix(ExtensionHelperSD.stage_1_signature) for file in sig_files]
+            with contextlib.ExitStack() as stack:
+                files = [stack.enter_context(file) for file in self.data_folder.open_files(sig_files)]
+                lines_to_buffer = self.lines_to_buffer
+                if sum(file.size for file in files) <= self.max_memory_size:
+                    lines_to_buffer = -1
+                elif lines_to_buffer == -1:
+                    lines_to_buffer = max(1, self.max_memory_size // (sig_dtype.itemsize * len(files)))
+                logger.info(f"Merging {len(files)} signature files.")
+
+                output_mg = self.output_folder.get_output_file_manager(mode="wb")
+                for sigs, file_ids in merge_sig_files(files, sig_dtype, lines_to_buffer):
+                    self.stat_update("hashes", value=len(sigs))
+                    # the first document of each hash is kept, all the following ones are duplicates
+                    is_dup = np.empty(len(sigs), dtype=bool)
+                    is_dup[0] = False
+                    np.equal(sigs["hash"][1:], sigs["hash"][:-1], out=is_dup[1:])
+                    if not is_dup.any():
+                        continue
+                    self.stat_update("duplicates", value=int(np.count_nonzero(is_dup)))
+                    dup_docs, dup_files = sigs["doc"][is_dup], file_ids[is_dup]
+                    for file_i in np.unique(dup_files).tolist():
+                        output_mg.write(
+                            f"{rank:04d}/{file_stems[file_i]}{ExtensionHelperSD.stage_2_duplicates}",
+                            dup_docs[dup_files == file_i].astype("<u4").tobytes(),
+                        )
+                output_mg.close()
+
+
+class ExactDedupFilter(PipelineStep):
+    """ExactDedup: Third pipeline step
+        ExactDedupFilter reads a DocumentPipeline and removes the duplicated documents found at stage 2
+
+    Args:
+        data_folder: data folder to get duplicate files.
+        config: config for the dedup
+        exclusion_writer: writer to save excluded documents
+    """
+
+    type = "🫂 - DEDUPS"
+    name = "💥 exact-deduplication stage 3"
+
+    def __init__(
+        self,
+        data_folder: DataFolderLike,
+        config: ExactDedupConfig | None = None,
+        exclusion_writer: DiskWriter | None = None,
+    ):
+        super().__init__()
+        self.data_folder = get_datafolder(data_folder)
+        self.config = config or ExactDedupConfig()
+        self.exclusion_writer = exclusion_writer
+
+    def read_duplicates(self, file: BinaryIO) -> np.ndarray:
+        """Helper function to read duplicates from a binary file storing (doc_id) as created by the second stage."""
+        with file as f:
+            return read_np_from_file(f, dtype=np.dtype("<u4"), is_local_file=self.data_folder.is_local())
+
+    def run(self, data: DocumentsPipeline, rank: int = 0, world_size: int = 1):
+        folders = self.data_folder.list_files(include_directories=True, recursive=False)
+        # for performance reasons when having for instance 12k*10k files
+        files = [
+            f
+            for f in [f"{folder}/{rank:05d}{ExtensionHelperSD.stage_2_duplicates}" for folder in folders]
+            if self.data_folder.exists(f)
+        ]
+
+        logger.info(f"Loading duplicate indexes from {len(files)} results files.")
+        all_dups = np.array([], dtype="<u4")
+        if files:
+            with ThreadPoolExecutor() as pool:
+                all_dups = np.concatenate(
+                    list(tqdm(pool.map(self.read_duplicates, self.data_folder.open_files(files)))),
+                    axis=0,
+                )
+            all_dups.sort()
+        logger.info("Loaded duplicate indexes.")
+
+        dups_doc_i = 0
+        with self.exclusion_writer if self.exclusion_writer else contextlib.nullcontext() as writer:
+            for doc_idx, doc in enumerate(data):
+                self.stat_update(StatHints.total)
+                with self.stats.time_stats:
+                    if dups_doc_i < all_dups.shape[0] and all_dups[dups_doc_i] == doc_idx:
+                        if writer:
+                            writer.write(doc, rank=rank)
+                        self.stat_update(StatHints.dropped)
+                        dups_doc_i += 1
+                        continue
+                self.stat_update(StatHints.forwarded)
+                self.update_doc_stats(doc)
+                yield doc
@@ -1,11 +1,12 @@
 import contextlib
-import heapq
+import hashlib
 import os
 import re
 import struct
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Generator
+from typing import Generator, Literal
 
 import numpy as np
 from fsspec.spec import AbstractBufferedFile
@@ -15,9 +16,11 @@ from datatrove.data import DocumentsPipeline
 from datatrove.io import DataFolderLike, get_datafolder
 from datatrove.pipeline.base import PipelineStep
 from datatrove.pipeline.writers.disk_base import DiskWriter
+from datatrove.utils.batching import batched
 from datatrove.utils.binaryio import read_tuples_from_file, seek_to_start
-from datatrove.utils.hashing import HashConfig, create_hash_func
+from datatrove.utils.hashing import HashConfig, create_hash_func, hash_chars, hash_ngrams
 from datatrove.utils.logging import logger
+from datatrove.utils.stats import MetricStats
 from datatrove.utils.text import TextNormConfig, ngrams, simplify_text
 from datatrove.utils.typeshelper import Languages, StatHints
 from datatrove.utils.word_tokenizers import load_word_tokenizer
@@ -34,6 +37,8 @@ probability of inclusion for s=0.8: 1-(1-0.8^8)^14=0.924
 """
 
 SENTINEL = (1 << 32) - 1
+# maximum size of the (shingles x hashes) array hashed at once by get_signatures_batch
+MAX_SIGNATURE_BATCH_BYTES = 64 * 2**20
 
 
 @dataclass
@@ -45,18 +50,33 @@ class MinhashConfig:
         num_buckets: number of buckets to use
         hashes_per_bucket: number of hashes per bucket
         seed: random seed used to generate the hash function parameters. Should be the same on all workers to ensure they all have the same parameters
+        shingle_hashing: how n-grams are hashed. "legacy" hashes the string of each n-gram (joined words).
+            "rolling" hashes each token once and combines the token hashes of all n-grams in a single vectorized
+            operation, which is much faster on long documents. The two produce different signatures: keep "legacy"
+            to stay compatible with existing signatures and indexes
+        tokenization: "word" builds n-grams of the words returned by the language's word tokenizer. "char" builds
+            n-grams of characters of the normalized text (ignoring whitespace) without any tokenization, which is
+            much cheaper and does not depend on word segmentation quality for languages such as Chinese or Japanese.
+            `n_grams` is then a number of characters, and n-grams are always hashed as with `shingle_hashing="rolling"`
     """
 
     n_grams: int = 5
     num_buckets: int = 14
     hashes_per_bucket: int = 8
     seed: int = 1
+    shingle_hashing: Literal["legacy", "rolling"] = "legacy"
+    tokenization: Literal["word", "char"] = "word"
 
     norm_config: TextNormConfig = field(default_factory=TextNormConfig)
     hash_config: HashConfig = field(default_factory=HashConfig)
 
     def __str__(self):
-        return f"{self.n_grams}ng_{self.num_buckets}bs_{self.hashes_per_bucket}hs_{self.hash_config}"
+        shingle_hashing = f"_{self.shingle_hashing}" if self.shingle_hashing != "legacy" else ""
+        tokenization = f"_{self.tokenization}" if self.tokenization != "word" else ""
+        return (
+            f"{self.n_grams}ng_{self.num_buckets}bs_{self.hashes_per_bucket}hs_{self.hash_config}{shingle_hashing}"
+            f"{tokenization}"
+        )
 
 
 @dataclass(order=True)
@@ -120,6 +140,202 @@ def read_sigs(
             )
 
 
+def argsort_sigs(sigs: np.ndarray) -> np.ndarray:
+    """Stable lexicographic argsort of the rows of a 2D array of signatures.
+        Rows are first sorted on their first hash only, and only rows sharing it with another row are then sorted on
+        all their hashes: much faster than a full `np.lexsort`, as most signatures differ on their first hash.
+
+    Args:
+        sigs: array of shape (number of signatures, hashes_per_bucket)
+
+    Returns: the indices that sort `sigs`
+    """
+    perm = np.argsort(sigs[:, 0], kind="stable")
+    first = sigs[perm, 0]
+    tied = np.zeros(len(first), dtype=bool)
+    same_first = first[1:] == first[:-1]
+    tied[1:] |= same_first
+    tied[:-1] |= same_first
+    if tied.any():
+        positions = np.flatnonzero(tied)
+        sub_perm = perm[positions]
+        # both sorts are stable and `positions` is sorted, so rows with the same first hash keep their slots
+        perm[positions] = sub_perm[np.lexsort(sigs[sub_perm].T[::-1])]
+    return perm
+
+
+class SigBlockReader:
+    """Reads a sorted signature (or index) file in blocks of records, as numpy arrays
+
+    Args:
+        file: (opened) file to read from
+        config: minhash configuration (a MinhashConfig object)
+        index_file: is index file (records without document id)
+        min_hash: only read signatures whose first hash is >= min_hash
+        max_hash: only read signatures whose first hash is < max_hash
+        lines_to_buffer: number of records to read at a time. -1 to read everything at once
+    """
+
+    def __init__(
+        self,
+        file: AbstractBufferedFile,
+        config: MinhashConfig,
+        index_file: bool = False,
+        min_hash: int = 0,
+        max_hash: int = _mersenne_prime,
+        lines_to_buffer: int = -1,
+    ):
+        self.file = file
+        self.index_file = index_file
+        self.max_hash = max_hash
+        self.lines_to_buffer = lines_to_buffer
+        self.hashes_per_bucket = config.hashes_per_bucket
+        hash_format = config.hash_config.struct_format
+        # flat fields (can be compared with np.searchsorted) and the same records with all the hashes in a subarray
+        self.dtype = np.dtype(
+            [(f"field{i + 1}", f"<{hash_format}") for i in range(config.hashes_per_bucket)]
+            + ([("doc", "<I")] if not index_file else [])
+        )
+        self.sig_dtype = np.dtype(
+            [("sig", f"<{hash_format}", (config.hashes_per_bucket,))] + ([("doc", "<I")] if not index_file else [])
+        )
+        self.records = np.empty(0, dtype=self.dtype)
+        # number of bytes left to read in the [min_hash, max_hash) range
+        self.remaining_bytes = 0
+        self.exhausted = file.size == 0
+        if not self.exhausted:
+            line_format = f"{config.hashes_per_bucket}{hash_format}{'I' if not index_file else ''}"
+            end = file.size
+            if max_hash != _mersenne_prime:
+                file.seek(0, os.SEEK_SET)
+                seek_to_start(file, max_hash, line_format, hash_format)
+                end = file.tell()
+            file.seek(0, os.SEEK_SET)
+            seek_to_start(file, min_hash, line_format, hash_format)
+            self.remaining_bytes = max(end - file.tell(), 0)
+            self.exhausted = self.remaining_bytes == 0
+
+    def fill(self):
+        """
+        Read the next block of records and append it to the ones not taken yet
+        """
+        if self.exhausted:
+            return
+        # never read past the end of the hash range: with lines_to_buffer=-1, only the range is loaded
+        nbytes = self.remaining_bytes
+        if self.lines_to_buffer != -1:
+            nbytes = min(nbytes, self.lines_to_buffer * self.dtype.itemsize)
+        data = self.file.read(nbytes)
+        assert len(data) % self.dtype.itemsize == 0, "file size not divisible by line size"
+        self.remaining_bytes -= len(data)
+        block = np.frombuffer(data, dtype=self.dtype)
+        if self.remaining_bytes <= 0 or len(data) < nbytes:
+            self.exhausted = True
+        if len(block) and block["field1"][-1] >= self.max_hash:
+            block = block[: np.searchsorted(block["field1"], self.max_hash, side="left")]
+            self.exhausted = True
+        assert len(block) == 0 or (np.diff(block["field1"]) >= 0).all(), "Hash order error"
+        assert len(block) == 0 or len(self.records) == 0 or self.records["field1"][-1] <= block["field1"][0], (
+            "Hash order error"
+        )
+        self.records = np.concatenate((self.records, block)) if len(self.records) else block
+
+    @property
+    def last_sig(self) -> tuple[int] | None:
+        """Signature of the last record read, or None if there are no records left to take"""
+        if len(self.records) == 0:
+            return None
+        return tuple(int(x) for x in self.records[-1])[: self.hashes_per_bucket]
+
+    def take(self, bound: tuple[int] | None = None) -> tuple[np.ndarray, np.ndarray | None]:
+        """
+            Remove and return the records with a signature strictly smaller than `bound`
+        Args:
+            bound: signature to compare to. None to take all the records read so far
+
+        Returns: tuple (signatures of shape (N, hashes_per_bucket), document ids or None for index files)
+        """
+        if bound is None:
+            end = len(self.records)
+        else:
+            end = int(
+                np.searchsorted(
+                    self.records,
+                    np.array([bound + ((0,) if not self.index_file else ())], dtype=self.dtype),
+                    side="left",
+                )[0]
+            )
+        taken = self.records[:end].view(self.sig_dtype)
+        self.records = self.records[end:]
+        return taken["sig"], taken["doc"] if not self.index_file else None
+
+
+def get_lines_to_buffer(
+    files: list[AbstractBufferedFile],
+    config: MinhashConfig,
+    lines_to_buffer: int,
+    max_memory_size: int,
+    parts: int = 1,
+) -> int:
+    """Number of records each SigBlockReader should read at a time
+
+    Args:
+        files: the (opened) signature/index files that will be merged
+        config: minhash configuration (a MinhashConfig object)
+        lines_to_buffer: user setting. -1 to split `max_memory_size` evenly between the files
+        max_memory_size: approximate amount of memory (in bytes) to use for buffers
+        parts: number of workers splitting the hash range of the files. Each SigBlockReader only reads the records
+            of its hash range, so a worker loads about 1/parts of the files
+
+    Returns: -1 (read everything at once) if all the records fit in `max_memory_size`
+    """
+    if sum(file.size for file in files) // parts <= max_memory_size:
+        logger.info("Signatures fit in memory, loading and sorting them at once.")
+        return -1
+    if lines_to_buffer == -1:
+        line_size = struct.calcsize(f"{config.hashes_per_bucket}{config.hash_config.struct_format}I")
+        return max(1, max_memory_size // (line_size * len(files)))
+    return lines_to_buffer
+
+
+def merge_sig_blocks(
+    sig_readers: list[SigBlockReader],
+) -> Generator[tuple[np.ndarray, np.ndarray, np.ndarray], None, None]:
+    """Merge sorted signature (or index) files, block by block
+
+    Args:
+        sig_readers: one SigBlockReader per file
+
+    Returns: generator of (signatures, document ids, reader ids) blocks, sorted by (signature, reader, document id).
+        All the records with the same signature are in the same block. Document ids of index files are 0
+    """
+    while True:
+        for sig_reader in sig_readers:
+            if len(sig_reader.records) == 0:
+                sig_reader.fill()
+        # signatures smaller than the last one read from each (unfinished) file are complete: no other record with
+        # the same signature can be found later on, so they can be merged and processed
+        bound = min((sig_reader.last_sig for sig_reader in sig_readers if not sig_reader.exhausted), default=None)
+        blocks = [sig_reader.take(bound) for sig_reader in sig_readers]
+        reader_ids = np.repeat(np.arange(len(blocks)), [len(sigs) for sigs, _ in blocks])
+        if len(reader_ids):
+            sigs = np.concatenate([sigs for sigs, _ in blocks])
+            doc_ids = np.concatenate(
+                [doc_ids if doc_ids is not None else np.zeros(len(sigs), np.uint32) for sigs, doc_ids in blocks]
+            )
+            if sum(len(sigs) > 0 for sigs, _ in blocks) > 1:
+                # stable sort: (sig, reader, doc_id) order, as each block is sorted by (sig, doc_id)
+                order = argsort_sigs(sigs)
+                sigs, doc_ids, reader_ids = sigs[order], doc_ids[order], reader_ids[order]
+            yield sigs, doc_ids, reader_ids
+        if bound is None:
+            break
+        for sig_reader in sig_readers:
+            # only records equal to `bound` are left: read more
+            if not sig_reader.exhausted and sig_reader.last_sig == bound:
+                sig_reader.fill()
+
+
 class MinhashDedupSignature(PipelineStep):
     """Minhash Deduplication: First Pipeline Step
 
@@ -128,6 +344,11 @@ class MinhashDedupSignature(PipelineStep):
     Args:
         output_folder: output folder
         config: minhash configuration (a MinhashConfig object)
+        language: language used to tokenize the text into words (unused with `tokenization="char"`)
+        skip_existing_sigs: skip computing the signatures if complete signature files already exist for this rank
+        batch_size: number of documents whose shingles and signatures are computed together
+        sig_buffer_docs: number of signatures kept in memory (per bucket) before being written to disk. If all the
+            signatures of a rank fit, they are sorted in memory and each bucket file is written only once
     """
 
     type = "🫂 - DEDUP"
@@ -139,13 +360,19 @@ class MinhashDedupSignature(PipelineStep):
         config: MinhashConfig = None,
         language: str = Languages.english,
         skip_existing_sigs: bool = False,
+        batch_size: int = 64,
+        sig_buffer_docs: int = 100_000,
     ):
         super().__init__()
         self.output_folder = get_datafolder(output_folder)
         self.config = config or MinhashConfig()
+        self.batch_size = batch_size
+        self.sig_buffer_docs = sig_buffer_docs
         self.num_hashes = self.config.num_buckets * self.config.hashes_per_bucket
         self._parameters = None
         self._hash_func = create_hash_func(self.config.hash_config)
+        # tokens are always hashed to 64 bits in "rolling" mode, n-gram hashes are then reduced to the chosen precision
+        self._token_hash_func = create_hash_func(HashConfig(precision=64, hash_fc=self.config.hash_config.hash_fc))
         self.language = language
         self.word_tokenizer = load_word_tokenizer(language)
         self.skip_existing_sigs = skip_existing_sigs
@@ -186,6 +413,37 @@ class MinhashDedupSignature(PipelineStep):
             for x in np.split(np.min(phv, axis=0).astype(self.config.hash_config.np_dtype), self.config.num_buckets)
         ]
 
+    def get_signatures_batch(self, shingles: list[np.ndarray]) -> np.ndarray:
+        """Get the signatures of a batch of documents with vectorized operations, in groups of bounded memory
+
+        Args:
+            shingles: list of non-empty shingle arrays (see `get_shingles`), one per document
+
+        Returns:
+            numpy array of shape (number of documents, num_buckets * hashes_per_bucket) with the same hashes as
+            `get_signature`
+        """
+        sigs = np.empty((len(shingles), self.num_hashes), dtype=self.config.hash_config.np_dtype)
+        if not shingles:
+            return sigs
+        a, b = self.parameters
+        # documents are hashed in groups of at most MAX_SIGNATURE_BATCH_BYTES of hashes (or a single larger document)
+        max_shingles = max(1, MAX_SIGNATURE_BATCH_BYTES // (self.num_hashes * np.dtype(np.uint64).itemsize))
+        doc_ends = np.cumsum([len(x) for x in shingles])
+        start = 0
+        while start < len(shingles):
+            first_shingle = doc_ends[start - 1] if start else 0
+            end = max(start + 1, int(np.searchsorted(doc_ends, first_shingle + max_shingles, side="right")))
+            phv = np.concatenate(shingles[start:end]) * a
+            phv += b
+            phv %= _mersenne_prime
+            if self.config.hash_config.precision == 32:
+                np.bitwise_and(phv, self.config.hash_config.max, out=phv)
+            group_starts = np.concatenate(([0], doc_ends[start : end - 1] - first_shingle))
+            sigs[start:end] = np.minimum.reduceat(phv, group_starts, axis=0)
+            start = end
+        return sigs
+
     def get_shingles(self, text: str) -> np.ndarray:
         """Get shingles (hashed n-grams) from a string of text
 
@@ -197,6 +455,8 @@ class MinhashDedupSignature(PipelineStep):
         Returns:
             numpy array of shingles: dtype = uint64, shape = (number of n_grams in string, 1)
         """
+        if self.config.shingle_hashing == "rolling" or self.config.tokenization == "char":
+            return self.get_shingles_batch([text])[0]
         return np.fromiter(
             [
                 self._hash_func(" ".join(x))
@@ -208,6 +468,44 @@ class MinhashDedupSignature(PipelineStep):
             dtype=np.uint64,
         ).reshape((-1, 1))
 
+    def get_shingles_batch(self, texts: list[str]) -> list[np.ndarray]:
+        """Get shingles (hashed n-grams) for a batch of texts
+
+        With `shingle_hashing="rolling"` or `tokenization="char"`, the tokens (or characters) of all the texts are
+        hashed into a single array and the n-grams of the whole batch are hashed with one vectorized call.
+
+        Args:
+            texts: list of input texts
+
+        Returns:
+            list of numpy arrays of shingles (see `get_shingles`), one per text
+        """
+        if self.config.tokenization == "char":
+            doc_hashes = [hash_chars(simplify_text(text, self.config.norm_config)) for text in texts]
+            doc_lens = np.array([len(hashes) for hashes in doc_hashes], dtype=np.int64)
+            doc_ends = np.cumsum(doc_lens)
+            token_hashes = np.concatenate(doc_hashes) if doc_hashes else np.empty(0, dtype=np.uint64)
+        elif self.config.shingle_hashing == "rolling":
+            doc_tokens = [
+                self.word_tokenizer.word_tokenize(simplify_text(text, self.config.norm_config)) for text in texts
+            ]
+            doc_lens = np.array([len(tokens) for tokens in doc_tokens], dtype=np.int64)
+            doc_ends = np.cumsum(doc_lens)
+            token_hashes = np.fromiter(
+                (self._token_hash_func(token) for tokens in doc_tokens for token in tokens),
+                dtype=np.uint64,
+                count=doc_ends[-1] if len(doc_ends) else 0,
+            )
+        else:
+            return [self.get_shingles(text) for text in texts]
+        # n-grams of the concatenated tokens: the ones spanning 2 documents are dropped below
+        ngram_hashes = hash_ngrams(token_hashes, self.config.n_grams, self.config.hash_config.precision)
+        doc_starts = doc_ends - doc_lens
+        return [
+            ngram_hashes[start : max(start, end - self.config.n_grams + 1)].reshape((-1, 1))
+            for start, end in zip(doc_starts.tolist(), doc_ends.tolist())
+        ]
+
     def check_can_skip_sig_writing(self, rank):
         if not self.skip_existing_sigs:
             return False
@@ -234,49 +532,90 @@ class MinhashDedupSignature(PipelineStep):
         logger.info(f"Found existing sig files with {fsizes[0] // sig_doc_size} entries. Skipping sig writing step.")
         return True
 
+    @property
+    def sig_dtype(self) -> np.dtype:
+        """Numpy dtype of one signature file record: `hashes_per_bucket` hashes followed by the (uint32) document index"""
+        return np.dtype(
+            [
+                (f"field{i + 1}", f"<{self.config.hash_config.struct_format}")
+                for i in range(self.config.hashes_per_bucket)
+            ]
+            + [(f"field{self.config.hashes_per_bucket + 1}", "<I")]
+        )
+
+    def _write_sorted_bucket(self, bucket: int, rank: int, records: np.ndarray):
+        with self.output_folder.open(f"bucket_{bucket:03d}/{rank:05d}.minhash.sig", mode="wb") as fo:
+            fo.write(np.sort(records, order=self.sig_dtype.names).tobytes())
+
     def run(self, data: DocumentsPipeline, rank: int = 0, world_size: int = 1):
         with self.track_time():
+            sorted_in_memory = False
             # check if we can skip the sig writing step
             if not self.check_can_skip_sig_writing(rank):
-                buckets = [
-                    self.output_folder.open(f"bucket_{bi:03d}/{rank:05d}.minhash.sig", mode="wb")
-                    for bi in range(self.config.num_buckets)
-                ]
-                for doc_idx, doc in enumerate(data):
-                    self.stat_update(StatHints.total)
-                    shingles = self.get_shingles(doc.text)
-                    if shingles.size != 0:
-                        sig = self.get_signature(shingles)
-                        for bi, (bucket, bucket_sig) in enumerate(zip(buckets, sig)):
-                            # print(f"{self.hashes_per_bucket=} {bucket_sig=}")
-                            bucket.write(
-                                struct.pack(
-                                    f"<{self.config.hashes_per_bucket}{self.config.hash_config.struct_format}I",
-                                    *bucket_sig,
-                                    doc_idx,
-                                )
-                            )
-                for file in buckets:
-                    file.close()
-
-            logger.info("Sorting buckets...")
-            for bi in range(self.config.num_buckets):
-                # read all records, sort and write back
-                dtype = np.dtype(
-                    [
-                        (f"field{i + 1}", f"<{self.config.hash_config.struct_format}")
-                        for i in range(self.config.hashes_per_bucket)
-                    ]
-                    + [(f"field{self.config.hashes_per_bucket + 1}", "<I")]
+                # one preallocated array of records per bucket. Written to disk (unsorted) whenever full
+                records = np.empty((self.config.num_buckets, self.sig_buffer_docs), dtype=self.sig_dtype)
+                # same memory layout, but with all the hashes in a single subarray field
+                records_view = records.view(
+                    np.dtype(
+                        [
+                            ("sig", f"<{self.config.hash_config.struct_format}", (self.config.hashes_per_bucket,)),
+                            ("doc", "<I"),
+                        ]
+                    )
                 )
-                with self.output_folder.open(f"bucket_{bi:03d}/{rank:05d}.minhash.sig", mode="rb") as fi:
-                    records = np.frombuffer(fi.read(), dtype=dtype)
-
-                indices = np.argsort(records, order=dtype.names)
-
-                with self.output_folder.open(f"bucket_{bi:03d}/{rank:05d}.minhash.sig", mode="wb") as fo:
-                    for idx in indices:
-                        fo.write(records[idx].tobytes())
+                nb_records = 0
+                buckets = None
+
+                def flush_records():
+                    nonlocal buckets
+                    if buckets is None:
+                        buckets = [
+                            self.output_folder.open(f"bucket_{bi:03d}/{rank:05d}.minhash.sig", mode="wb")
+                            for bi in range(self.config.num_buckets)
+                        ]
+                    for bucket, bucket_records in zip(buckets, records):
+                        bucket.write(bucket_records[:nb_records].tobytes())
+
+                doc_idx = 0
+                for batch in batched(data, self.batch_size):
+                    for _ in batch:
+                        self.stat_update(StatHints.total)
+                    shingles = self.get_shingles_batch([doc.text for doc in batch])
+                    doc_ids = np.array([i for i, x in enumerate(shingles) if x.size != 0], dtype=np.uint32)
+                    sigs = self.get_signatures_batch([shingles[i] for i in doc_ids]).reshape(
+                        (len(doc_ids), self.config.num_buckets, self.config.hashes_per_bucket)
+                    )
+                    doc_ids += doc_idx
+                    doc_idx += len(batch)
+                    pos = 0
+                    while pos < len(doc_ids):
+                        take = min(len(doc_ids) - pos, self.sig_buffer_docs - nb_records)
+                        records_view["sig"][:, nb_records : nb_records + take] = sigs[pos : pos + take].swapaxes(0, 1)
+                        records_view["doc"][:, nb_records : nb_records + take] = doc_ids[pos : pos + take]
+                        nb_records += take
+                        pos += take
+                        if nb_records == self.sig_buffer_docs:
+                            flush_records()
+                            nb_records = 0
+                if buckets is None:
+                    # all the signatures fit in memory: sort and write each bucket directly
+                    logger.info("Sorting buckets...")
+                    for bi in range(self.config.num_buckets):
+                        self._write_sorted_bucket(bi, rank, records[bi, :nb_records])
+                    sorted_in_memory = True
+                else:
+                    flush_records()
+                    for file in buckets:
+                        file.close()
+                del records, records_view
+
+            if not sorted_in_memory:
+                logger.info("Sorting buckets...")
+                for bi in range(self.config.num_buckets):
+                    # read all records, sort and write back
+                    with self.output_folder.open(f"bucket_{bi:03d}/{rank:05d}.minhash.sig", mode="rb") as fi:
+                        records = np.frombuffer(fi.read(), dtype=self.sig_dtype)
+                    self._write_sorted_bucket(bi, rank, records)
 
 
 class MinhashDedupBuckets(PipelineStep):
@@ -291,6 +630,10 @@ class MinhashDedupBuckets(PipelineStep):
         config: minhash configuration (a MinhashConfig object)
         only_dedup_in_index: only deduplicate versus index (ignore any matches between 2 documents in our input dataset)
         create_index_name: create index name. If this parameter is set, index files will be created with this name that other datasets can use as a reference for dedup. Set to `None` to disable index file creation.
+        lines_to_buffer: number of signatures read at a time from each file. -1 to split `max_memory_size` evenly
+            between the files
+        max_memory_size: approximate amount of memory (in bytes) used to buffer signatures. If all the signatures
+            processed by this worker fit, they are loaded and sorted at once instead of being merged block by block
     """
 
     type = "🫂 - DEDUP"
@@ -304,7 +647,8 @@ class MinhashDedupBuckets(PipelineStep):
         config: MinhashConfig = None,
         only_dedup_in_index: bool = True,
         create_index_name: str = None,
-        lines_to_buffer: int = 5,
+        lines_to_buffer: int = -1,
+        max_memory_size: int = 2**30,  # 1GB
     ):
         super().__init__()
         self.input_folder = get_datafolder(input_folder)
@@ -314,6 +658,7 @@ class MinhashDedupBuckets(PipelineStep):
         self.only_dedup_in_index = only_dedup_in_index
         self.create_index_name = create_index_name
         self.lines_to_buffer = lines_to_buffer
+        self.max_memory_size = max_memory_size
 
     def get_worker_hash_range(self, sig_files, rank, world_size):
         workers_per_bucket = world_size // self.config.num_buckets
@@ -346,13 +691,19 @@ class MinhashDedupBuckets(PipelineStep):
                     )[0]
         return hash_min, hash_max
 
+    def _update_match_stats(self, matches: int, *labels):
+        # equivalent to calling stat_update(*labels) once per match
+        if matches:
+            for label in labels:
+                self.stats[label] += MetricStats(total=matches, n=matches, mean=1, min=1, max=1)
+
     def run(self, data: DocumentsPipeline = None, rank: int = 0, world_size: int = 1):
         assert data is None, "You should not use an input block before MinhashDedupBuckets"
         assert (world_size % self.config.num_buckets) == 0, "Number of tasks must be divisible by num_buckets"
         workers_per_bucket = world_size // self.config.num_buckets
         bucket, bucket_worker = divmod(rank, workers_per_bucket)
 
-        with self.track_time():
+        with self.track_time(), contextlib.ExitStack() as stack:
             sig_files = self.input_folder.list_files(subdirectory=f"bucket_{bucket:03d}")
             hash_min, hash_max = self.get_worker_hash_range(sig_files, rank, world_size)
 
@@ -361,96 +712,163 @@ class MinhashDedupBuckets(PipelineStep):
                 f"Hash range: {[hash_min, hash_max]}"
             )
 
-            sig_readers = [
-                read_sigs(
-                    file,
-                    file_i,
-                    self.config,
-                    min_hash=hash_min,
-                    max_hash=hash_max,
-                    lines_to_buffer=self.lines_to_buffer,
-                )
-                for file_i, file in enumerate(self.input_folder.open_files(sig_files, mode="rb"))
-            ]
-
             own_index_regex = re.compile(rf"bucket_{bucket:03d}/{self.create_index_name}_\d{{2}}.minhash.index")
             index_files = (
                 [
                     filename
-                    for filename in self.index_folder.list_files(subdirectory=f"bucket_{bucket:03d}")
+                    for filename in self.index_folder.list_files(
+                        subdirectory=f"bucket_{bucket:03d}", glob_pattern="*.minhash.index"
+                    )
                     # exclude "itself" if the index was partially uploaded/ended midway + other workers
                     if not self.create_index_name or not own_index_regex.fullmatch(filename)
                 ]
                 if self.index_folder
-                else None
+                else []
             )
             if index_files:
                 logger.info(f"Found {len(index_files)} index file(s): {', '.join(index_files)}")
-                sig_readers.extend(
-                    [
-                        read_sigs(
-                            file,
-                            len(sig_readers) + file_i,
-                            self.config,
-                            index_file=True,
-                            min_hash=hash_min,
-                            max_hash=hash_max,
-                            lines_to_buffer=self.lines_to_buffer,
-                        )
-                        for file_i, file in enumerate(self.index_folder.open_files(index_files, mode="rb"))
-                    ]
-                )
 
-            pq = [x for x in [next(sig_reader, None) for sig_reader in sig_readers] if x is not None]
-            heapq.heapify(pq)
-            logger.info("Finished initializing signatures priority queue.")
+            files = [
+                stack.enter_context(file)
+                for file in (self.index_folder.open_files(index_files, mode="rb") if index_files else [])
+                + self.input_folder.open_files(sig_files, mode="rb")
+            ]
+            # index entries must come before the documents with the same signature: index readers go first
+            is_index_reader = np.arange(len(files)) < len(index_files)
+            reader_stems = np.array(
+                [SENTINEL] * len(index_files)
+                + [int(Path(filename).name.removesuffix(".minhash.sig")) for filename in sig_files],
+                dtype=np.uint32,
+            )
+            lines_to_buffer = get_lines_to_buffer(
+                files, self.config, self.lines_to_buffer, self.max_memory_size, workers_per_bucket
+            )
+            sig_readers = [
+                SigBlockReader(
+                    file,
+                    self.config,
+                    index_file=is_index,
+                    min_hash=hash_min,
+                    max_hash=hash_max,
+                    lines_to_buffer=lines_to_buffer,
+                )
+                for file, is_index in zip(files, is_index_reader)
+            ]
 
             # out index file
             out_index = None
             if self.index_folder and self.create_index_name:
-                out_index = self.index_folder.open(
-                    f"bucket_{bucket:03d}/{self.create_index_name}_{bucket_worker:02d}.minhash.index", mode="wb"
+                out_index = stack.enter_context(
+                    self.index_folder.open(
+                        f"bucket_{bucket:03d}/{self.create_index_name}_{bucket_worker:02d}.minhash.index", mode="wb"
+                    )
                 )
+            out_f = stack.enter_context(self.output_folder.open(f"{bucket:05d}_{bucket_worker:02d}.dups", mode="wb"))
 
-            with self.output_folder.open(f"{bucket:05d}_{bucket_worker:02d}.dups", mode="wb") as out_f:
-                last: HashSig | None = None
-                while pq:
-                    v: HashSig = heapq.heappop(pq)
-                    assert last is None or v >= last, f"Sig queue sort error. {v=} < {last=}"
-                    if not v.is_from_index():
-                        if last is not None and last.sig == v.sig:
-                            # write (file_id1, doc_id1, file_id2, doc_id2)
-                            if last.is_from_index():
-                                # we can't actually write -1, so we use SENTINEL instead
-                                out_f.write(struct.pack("<4I", SENTINEL, SENTINEL, int(v.file_stem), v.doc_id))
-                                self.stat_update("index_match", "total_matches")
-                            # if there isn't an index, or we are not only deduping in relation to the index
-                            elif not index_files or not self.only_dedup_in_index:
-                                out_f.write(
-                                    struct.pack("<4I", int(last.file_stem), last.doc_id, int(v.file_stem), v.doc_id)
-                                )
-                                self.stat_update("total_matches")
-                        elif out_index:
-                            # new sig that isn't part of any index, save to our new index
-                            out_index.write(
-                                struct.pack(
-                                    f"<%d{self.config.hash_config.struct_format}" % self.config.hashes_per_bucket,
-                                    *v.sig,
-                                )
-                            )
-                    last = v
-                    next_sig = next(sig_readers[v.reader_id], None)
-                    if next_sig:
-                        assert next_sig >= v, f"Next sig sort error. {next_sig=} < {v=}"
-                        heapq.heappush(pq, next_sig)
-                if out_index:
-                    out_index.close()
+            for sigs, doc_ids, reader_ids in merge_sig_blocks(sig_readers):
+                self._process_sorted_sigs(sigs, doc_ids, reader_ids, is_index_reader, reader_stems, out_f, out_index)
+
+    def _process_sorted_sigs(
+        self,
+        sigs: np.ndarray,
+        doc_ids: np.ndarray,
+        reader_ids: np.ndarray,
+        is_index_reader: np.ndarray,
+        reader_stems: np.ndarray,
+        out_f,
+        out_index,
+    ):
+        """
+            Find and write the duplicate pairs among sorted signatures. Each document is paired with the previous one
+            with the same signature, or with SENTINEL if that one comes from an index
+        Args:
+            sigs: sorted signatures, of shape (N, hashes_per_bucket)
+            doc_ids: document id of each signature
+            reader_ids: reader (file) each signature comes from
+            is_index_reader: whether each reader reads an index file
+            reader_stems: file stem (rank) of each reader
+            out_f: .dups file
+            out_index: index file to write new signatures to, or None
+        """
+        is_index = is_index_reader[reader_ids]
+        same_as_prev = np.zeros(len(sigs), dtype=bool)
+        same_as_prev[1:] = (sigs[1:] == sigs[:-1]).all(axis=1)
+        prev_is_index = np.zeros(len(sigs), dtype=bool)
+        prev_is_index[1:] = is_index[:-1]
+        matches = same_as_prev & ~is_index
+        index_matches = matches & prev_is_index
+        # if there isn't an index, or we are not only deduping in relation to the index
+        doc_matches = (
+            matches & ~prev_is_index
+            if not is_index_reader.any() or not self.only_dedup_in_index
+            else np.zeros(len(sigs), dtype=bool)
+        )
+        pair_ends = np.flatnonzero(index_matches | doc_matches)
+        if len(pair_ends):
+            from_index = index_matches[pair_ends]
+            # (file_id1, doc_id1, file_id2, doc_id2). We can't actually write -1, so we use SENTINEL instead
+            pairs = np.empty((len(pair_ends), 4), dtype="<u4")
+            pairs[:, 0] = np.where(from_index, SENTINEL, reader_stems[reader_ids[pair_ends - 1]])
+            pairs[:, 1] = np.where(from_index, SENTINEL, doc_ids[pair_ends - 1])
+            pairs[:, 2] = reader_stems[reader_ids[pair_ends]]
+            pairs[:, 3] = doc_ids[pair_ends]
+            out_f.write(pairs.tobytes())
+        self._update_match_stats(int(index_matches.sum()), "index_match", "total_matches")
+        self._update_match_stats(int(doc_matches.sum()), "total_matches")
+        if out_index:
+            # new sigs that aren't part of any index, save to our new index
+            new_sigs = ~same_as_prev & ~is_index
+            out_index.write(sigs[new_sigs].astype(f"<{self.config.hash_config.struct_format}").tobytes())
+
+
+def connected_components(a: np.ndarray, b: np.ndarray, num_nodes: int) -> np.ndarray:
+    """Array based union-find: find the connected components of a graph over dense integer node ids.
+        Each round hooks the root of the larger node of every edge onto the smaller one and then compresses all the
+        paths (pointer jumping), until no edge connects two different roots.
+
+    Args:
+        a: first node of each edge
+        b: second node of each edge
+        num_nodes: total number of nodes (ids go from 0 to num_nodes - 1)
+
+    Returns: the root of each node, which is the smallest node id of its component
+    """
+    parent = np.arange(num_nodes, dtype=np.int64)
+    while len(a):
+        root_a, root_b = parent[a], parent[b]
+        # edges already inside a single component can be dropped
+        pending = root_a != root_b
+        a, b, root_a, root_b = a[pending], b[pending], root_a[pending], root_b[pending]
+        if not len(a):
+            break
+        # parent[x] <= x always holds, so no cycles can be created
+        np.minimum.at(parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+        # path compression
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+    return parent
 
 
 class MinhashDedupCluster(PipelineStep):
     """Minhash Deduplication: Third Pipeline Step
 
-    Cluster the documents using the previously found duplicate pairs. If A-B and B-C are duplicate pairs, then we will have the A-B-C cluster. Only one document per cluster will be kept after filtering
+    Cluster the documents using the previously found duplicate pairs. If A-B and B-C are duplicate pairs, then we will have the A-B-C cluster. Only one document per cluster will be kept after filtering:
+    the first one (smallest file and document id), or none if the cluster matches an index
+
+    Args:
+        input_folder: input folder containing the duplicate pairs (.dups files) from step 2
+        output_folder: output folder where the documents to remove (and cluster metadata) will be saved
+        config: minhash configuration (a MinhashConfig object)
+        save_cluster_id: also save the cluster id of each duplicated document
+        save_cluster_size: also save the cluster size of each duplicated document
+        ignore_index_matches: ignore matches with an index (only cluster documents from our own dataset)
+        lines_to_buffer: unused, .dups files are read in a single block. Kept for backwards compatibility
+        workers: number of threads loading the .dups files. Each thread reduces the pairs of its share of files to
+            their connected components before these are merged, which also reduces the memory used by redundant
+            pairs (the same duplicates are usually found in several buckets)
     """
 
     type = "🫂 - DEDUP"
@@ -465,6 +883,7 @@ class MinhashDedupCluster(PipelineStep):
         save_cluster_size: bool = False,
         ignore_index_matches: bool = False,
         lines_to_buffer: int = 5,
+        workers: int = 1,
     ):
         super().__init__()
         self.input_folder = get_datafolder(input_folder)
@@ -474,6 +893,34 @@ class MinhashDedupCluster(PipelineStep):
         self.save_cluster_size = save_cluster_size
         self.ignore_index_matches = ignore_index_matches
         self.lines_to_buffer = lines_to_buffer
+        self.workers = workers
+
+    def load_pairs(self, dup_files: list[str], reduce: bool = False) -> tuple[np.ndarray, np.ndarray]:
+        """
+            Load the duplicate pairs from a list of .dups files
+        Args:
+            dup_files: list of .dups files
+            reduce: replace the pairs with an equivalent (same connected components) and usually much smaller set
+                of pairs: one pair (root, node) for each node that isn't the root of its component
+
+        Returns: tuple of arrays of nodes, where each node is encoded as `file_id << 32 | doc_id`
+        """
+        pairs = []
+        for dup_file in tqdm(dup_files, desc="Reading dup files"):
+            with self.input_folder.open(dup_file, "rb") as dupf:
+                pairs.append(np.frombuffer(dupf.read(), dtype="<u4").reshape(-1, 4))
+        pairs = np.concatenate(pairs) if pairs else np.empty((0, 4), dtype="<u4")
+        if self.ignore_index_matches:
+            # if we are skipping matches with the index and "a" is from the index
+            pairs = pairs[(pairs[:, 0] != SENTINEL) | (pairs[:, 1] != SENTINEL)]
+        pairs = pairs.astype(np.uint64)
+        a, b = pairs[:, 0] << np.uint64(32) | pairs[:, 1], pairs[:, 2] << np.uint64(32) | pairs[:, 3]
+        if not reduce:
+            return a, b
+        nodes, node_ids = np.unique(np.concatenate((a, b)), return_inverse=True)
+        roots = connected_components(node_ids[: len(a)], node_ids[len(a) :], len(nodes))
+        non_roots = np.flatnonzero(roots != np.arange(len(nodes)))
+        return nodes[roots[non_roots]], nodes[non_roots]
 
     def run(self, data: DocumentsPipeline = None, _: int = 0, world_size: int = 1):
         dup_files = self.input_folder.list_files(glob_pattern="*.dups")
@@ -481,69 +928,74 @@ class MinhashDedupCluster(PipelineStep):
             "Number of .dups files should be divisible by number of buckets"
         )
         assert world_size == 1, "World size must be 1 for clustering"
-        union_set = {}
-        set_size = {}
-
-        def parent(x):
-            if x not in union_set or union_set[x] == x:
-                union_set[x] = x
-                return x
-            # Path Compression
-            union_set[x] = parent(union_set[x])
-            return union_set[x]
-
-        def union(v_a, v_b):
-            root_a = parent(v_a)
-            root_b = parent(v_b)
-
-            if root_a != root_b:
-                # Union by size
-                size_a = set_size.get(root_a, 1)
-                size_b = set_size.get(root_b, 1)
-                if root_b == (SENTINEL, SENTINEL) or (root_a != (SENTINEL, SENTINEL) and size_a < size_b):
-                    root_a, root_b = root_b, root_a
-                # a is SENTINEL or #a >= #b
-                union_set[root_b] = root_a  # make the smallest one join the biggest one to keep sets shallow
-                set_size[root_a] = size_a + size_b
-                set_size.pop(root_b, None)  # clear up space
 
         with self.track_time():
             logger.info("Loading dup files...")
-            for dup_file in tqdm(dup_files, desc="Reading dup files"):
-                with self.input_folder.open(dup_file, "rb") as dupf:
-                    for f1, d1, f2, d2 in read_tuples_from_file(dupf, "4I", lines_to_buffer=self.lines_to_buffer):
-                        a, b = (f1, d1), (f2, d2)
-                        if self.ignore_index_matches and a == (SENTINEL, SENTINEL):
-                            # if we are skipping matches with the index and "a" is from the index
-                            continue
-                        union(a, b)
-
+            if self.workers > 1:
+                with ThreadPoolExecutor(self.workers) as pool:
+                    partial_pairs = list(
+                        pool.map(
+                            lambda files: self.load_pairs(files, reduce=True),
+                            [dup_files[i :: self.workers] for i in range(self.workers)],
+                        )
+                    )
+                a = np.concatenate([a for a, _ in partial_pairs])
+                b = np.concatenate([b for _, b in partial_pairs])
+                del partial_pairs
+            else:
+                a, b = self.load_pairs(dup_files)
             logger.info("Finished reading dup files.")
-            ci = 0
-            cluster_ids = {}
-            with self.output_folder.get_output_file_manager(mode="wb") as output_mg:
-                for node in sorted(union_set):
-                    self.stat_update("duplicates")
-                    file, doc = node
-                    p = parent(node)
-                    if node != p:
-                        output_mg.write(f"{file:06d}.remove", struct.pack("<I", doc))
-                        self.stat_update("to_remove")
 
+            # dense ids. nodes are sorted by (file, doc), with the index (SENTINEL, SENTINEL) at the end
+            nodes, node_ids = np.unique(np.concatenate((a, b)), return_inverse=True)
+            del a, b
+            nb_edges = len(node_ids) // 2
+            has_index = len(nodes) > 0 and nodes[-1] == np.uint64(SENTINEL << 32 | SENTINEL)
+            if has_index:
+                # the index must be the root of any cluster it belongs to (all the documents are then removed)
+                nodes = np.roll(nodes, 1)
+                node_ids = (node_ids + 1) % len(nodes)
+            roots = connected_components(node_ids[:nb_edges], node_ids[nb_edges:], len(nodes))
+            del node_ids
+            sizes = np.bincount(roots, minlength=len(nodes))
+            if has_index:
+                nodes, roots = nodes[1:], roots[1:]
+            node_range = np.arange(len(roots)) + int(has_index)
+            to_remove = roots != node_range
+            files, docs = (nodes >> np.uint64(32)).astype(np.uint32), (nodes & np.uint64(SENTINEL)).astype(np.uint32)
+
+            # cluster ids: assigned in order of (file, doc) of the first document of each cluster
+            cluster_roots, first_node, cluster_of_node = np.unique(roots, return_index=True, return_inverse=True)
+            cluster_ids = np.argsort(np.argsort(first_node))[cluster_of_node].astype(np.uint32)
+
+            for label, count in (
+                ("duplicates", len(nodes)),
+                ("to_remove", int(to_remove.sum())),
+                ("clusters", len(cluster_roots) if self.save_cluster_id else 0),
+            ):
+                if count:
+                    self.stats[label] += MetricStats(total=count, n=count, mean=1, min=1, max=1)
+            if len(nodes):
+                # one value per cluster
+                self.stats["cluster_size"] += MetricStats.from_values(sizes[sizes > 0], unit="cluster")
+
+            with self.output_folder.get_output_file_manager(mode="wb") as output_mg:
+                file_ids, file_starts = np.unique(files, return_index=True)
+                for file, start, end in zip(file_ids, file_starts, np.append(file_starts[1:], len(files))):
+                    file_docs = docs[start:end]
+                    if to_remove[start:end].any():
+                        output_mg.write(f"{file:06d}.remove", file_docs[to_remove[start:end]].astype("<u4").tobytes())
                     # additional metadata
                     if self.save_cluster_id:
-                        if p not in cluster_ids:
-                            cluster_ids[p] = ci
-                            ci += 1
-                            self.stat_update("clusters")
-                        output_mg.write(f"{file:06d}.clusters", struct.pack("<I", doc))
-                        output_mg.write(f"{file:06d}.clusters", struct.pack("<I", cluster_ids[p]))
-                    if node == p:
-                        # only run once per cluster
-                        self.stat_update("cluster_size", value=set_size[p], unit="cluster")
+                        output_mg.write(
+                            f"{file:06d}.clusters",
+                            np.stack((file_docs, cluster_ids[start:end]), axis=1).astype("<u4").tobytes(),
+                        )
                     if self.save_cluster_size:
-                        output_mg.write(f"{file:06d}.sizes", struct.pack("<I", doc))
-                        output_mg.write(f"{file:06d}.sizes", struct.pack("<I", set_size[p]))
+                        output_mg.write(
+                            f"{file:06d}.sizes",
+                            np.stack((file_docs, sizes[roots[start:end]]), axis=1).astype("<u4").tobytes(),
+                        )
 
 
 class MinhashDedupFilter(PipelineStep):
@@ -638,10 +1090,28 @@ class MinhashDedupFilter(PipelineStep):
                     yield doc
 
 
+def unique_sorted_sigs(sigs: np.ndarray) -> np.ndarray:
+    """Remove repeated signatures (rows) from a sorted 2D array of signatures"""
+    is_new = np.ones(len(sigs), dtype=bool)
+    is_new[1:] = (sigs[1:] != sigs[:-1]).any(axis=1)
+    return sigs[is_new]
+
+
 class MinhashBuildIndex(PipelineStep):
     """Minhash Deduplication
 
-    Only build an index from the signatures, without deduplicating
+    Only build an index from the signatures, without deduplicating.
+    Each index built with a different `index_name` is an additional segment (one sorted file per bucket) of the index
+    folder: use `MinhashCompactIndex` to periodically merge them.
+
+    Args:
+        input_folder: input folder containing the signature from step 1
+        output_folder: index folder
+        index_name: name of the new index files
+        config: minhash configuration (a MinhashConfig object)
+        lines_to_buffer: number of signatures read at a time from each file. -1 to split `max_memory_size` evenly
+            between the files
+        max_memory_size: approximate amount of memory (in bytes) used to buffer signatures
     """
 
     type = "🫂 - DEDUP"
@@ -653,7 +1123,8 @@ class MinhashBuildIndex(PipelineStep):
         output_folder: DataFolderLike,
         index_name: str,
         config: MinhashConfig = None,
-        lines_to_buffer: int = 5,
+        lines_to_buffer: int = -1,
+        max_memory_size: int = 2**30,  # 1GB
     ):
         super().__init__()
         self.input_folder = get_datafolder(input_folder)
@@ -661,34 +1132,148 @@ class MinhashBuildIndex(PipelineStep):
         self.config = config or MinhashConfig()
         self.index_name = index_name
         self.lines_to_buffer = lines_to_buffer
+        self.max_memory_size = max_memory_size
 
     def run(self, data: DocumentsPipeline = None, bucket: int = 0, world_size: int = 1):
         assert data is None, "You should not use an input block before MinhashBuildIndex"
         assert world_size == self.config.num_buckets, "You must run exactly one task per bucket"
-        sig_files = self.input_folder.list_files(subdirectory=f"bucket_{bucket:03d}")
-        sig_readers = [
-            read_sigs(file, file_i, self.config, lines_to_buffer=self.lines_to_buffer)
-            for file_i, file in enumerate(self.input_folder.open_files(sig_files, mode="rb"))
-        ]
+        with self.track_time(), contextlib.ExitStack() as stack:
+            sig_files = self.input_folder.list_files(subdirectory=f"bucket_{bucket:03d}")
+            files = [stack.enter_context(file) for file in self.input_folder.open_files(sig_files, mode="rb")]
+            lines_to_buffer = get_lines_to_buffer(files, self.config, self.lines_to_buffer, self.max_memory_size)
+            sig_readers = [SigBlockReader(file, self.config, lines_to_buffer=lines_to_buffer) for file in files]
+
+            # writes all the sigs for the entire bucket, sequentially
+            with self.output_folder.open(f"bucket_{bucket:03d}/{self.index_name}.minhash.index", mode="wb") as out_f:
+                for sigs, _, _ in merge_sig_blocks(sig_readers):
+                    out_f.write(unique_sorted_sigs(sigs).astype(f"<{self.config.hash_config.struct_format}").tobytes())
+
+
+def plan_index_compaction(segment_sizes: dict[str, int], fanout: int = 4, max_segments: int = 16) -> list:
+    """Size-tiered compaction policy for the segments (index files) of one bucket of a minhash index.
+        Segments are grouped in tiers of similar sizes (within a factor `fanout` of the smallest one of the tier), and
+        tiers with at least `fanout` segments are merged into a single larger segment, until no tier is full. This
+        keeps the number of segments logarithmic in the size of the index while each signature is only rewritten a
+        logarithmic number of times. The smallest segments are then merged if there are still more than
+        `max_segments`.
+
+    Args:
+        segment_sizes: size (number of signatures or bytes) of each segment
+        fanout: number of similar sized segments that are merged together
+        max_segments: maximum number of segments left after compaction
+
+    Returns: list of merges to run in order, as tuples (list of segments, name of the new segment). Segments to merge
+        can be the result of a previous merge
+    """
+    segments = dict(segment_sizes)
+    merges = []
+    while True:
+        ordered = sorted(segments, key=lambda name: (segments[name], name))
+        to_merge = None
+        tier_start = 0
+        while tier_start < len(ordered) and not to_merge:
+            tier_end = tier_start + 1
+            while (
+                tier_end < len(ordered)
+                and segments[ordered[tier_end]] <= max(segments[ordered[tier_start]], 1) * fanout
+            ):
+                tier_end += 1
+            if tier_end - tier_start >= fanout:
+                to_merge = ordered[tier_start:tier_end]
+            tier_start = tier_end
+        if not to_merge and len(segments) > max_segments:
+            to_merge = ordered[: len(segments) - max_segments + 1]
+        if not to_merge:
+            return merges
+        # deterministic name: re-running an interrupted compaction overwrites the same segment
+        merged_name = "compacted_" + hashlib.md5("\n".join(sorted(to_merge)).encode()).hexdigest()[:16]
+        segments[merged_name] = sum(segments.pop(name) for name in to_merge)
+        merges.append((to_merge, merged_name))
+
+
+class MinhashCompactIndex(PipelineStep):
+    """Minhash Deduplication
+
+        Compact a minhash index. Each dataset added to an index (with `MinhashBuildIndex` or `create_index_name` in
+        `MinhashDedupBuckets`) appends one more segment (a sorted file of signatures) to each bucket, and stage 2 has to
+        merge all of them. Similar sized segments are merged here into larger sorted segments (see
+        `plan_index_compaction`), bounding the number of files stage 2 reads per bucket.
+        Run it periodically, for instance after adding a new dataset to the index, with one task per bucket. It should
+        not run at the same time as a stage 2 using (or adding to) the same index.
+
+    Args:
+        index_folder: index folder
+        config: minhash configuration (a MinhashConfig object)
+        fanout: number of similar sized segments that are merged together
+        max_segments: maximum number of segments per bucket after compaction
+        lines_to_buffer: number of signatures read at a time from each file. -1 to split `max_memory_size` evenly
+            between the files
+        max_memory_size: approximate amount of memory (in bytes) used to buffer signatures
+    """
 
-        pq = [next(sig_reader) for sig_reader in sig_readers]
-        heapq.heapify(pq)
+    type = "🫂 - DEDUP"
+    name = "🎯 MinHash compact index"
 
-        # writes all the sigs for the entire bucket, sequentially
-        out_f = self.output_folder.open(f"bucket_{bucket:03d}/{self.index_name}.minhash.index", mode="wb")
+    def __init__(
+        self,
+        index_folder: DataFolderLike,
+        config: MinhashConfig = None,
+        fanout: int = 4,
+        max_segments: int = 16,
+        lines_to_buffer: int = -1,
+        max_memory_size: int = 2**30,  # 1GB
+    ):
+        super().__init__()
+        if fanout < 2:
+            raise ValueError("fanout must be >= 2")
+        if max_segments < 1:
+            raise ValueError("max_segments must be >= 1")
+        self.index_folder = get_datafolder(index_folder)
+        self.config = config or MinhashConfig()
+        self.fanout = fanout
+        self.max_segments = max_segments
+        self.lines_to_buffer = lines_to_buffer
+        self.max_memory_size = max_memory_size
 
-        last: HashSig | None = None
+    def merge_segments(self, bucket: int, segments: list[str], merged_name: str):
+        """
+            Merge some index files of a bucket into a single one, and delete them
+        Args:
+            bucket: bucket number
+            segments: names of the segments to merge
+            merged_name: name of the new segment
+        """
+        segment_files = [f"bucket_{bucket:03d}/{segment}.minhash.index" for segment in segments]
+        merged_file = f"bucket_{bucket:03d}/{merged_name}.minhash.index"
+        with contextlib.ExitStack() as stack:
+            files = [stack.enter_context(file) for file in self.index_folder.open_files(segment_files, mode="rb")]
+            lines_to_buffer = get_lines_to_buffer(files, self.config, self.lines_to_buffer, self.max_memory_size)
+            sig_readers = [
+                SigBlockReader(file, self.config, index_file=True, lines_to_buffer=lines_to_buffer) for file in files
+            ]
+            # not a .minhash.index file until complete, so that it is never read partially written
+            with self.index_folder.open(f"{merged_file}.tmp", mode="wb") as out_f:
+                for sigs, _, _ in merge_sig_blocks(sig_readers):
+                    out_f.write(unique_sorted_sigs(sigs).astype(f"<{self.config.hash_config.struct_format}").tobytes())
+        self.index_folder.mv(f"{merged_file}.tmp", merged_file)
+        for segment_file in segment_files:
+            if segment_file != merged_file:
+                self.index_folder.rm(segment_file)
+        self.stat_update("merged_segments", value=len(segments))
+        self.stat_update("compactions")
+
+    def run(self, data: DocumentsPipeline = None, bucket: int = 0, world_size: int = 1):
+        assert data is None, "You should not use an input block before MinhashCompactIndex"
+        assert world_size == self.config.num_buckets, "You must run exactly one task per bucket"
         with self.track_time():
-            while pq:
-                v: HashSig = heapq.heappop(pq)
-                if not last or last.sig != v.sig:
-                    out_f.write(
-                        struct.pack(
-                            f"<%d{self.config.hash_config.struct_format}" % self.config.hashes_per_bucket, *v.sig
-                        )
-                    )
-                last = v
-                next_sig = next(sig_readers[v.file_id], None)
-                if next_sig:
-                    heapq.heappush(pq, next_sig)
-        out_f.close()
+            index_files = self.index_folder.list_files(
+                subdirectory=f"bucket_{bucket:03d}", glob_pattern="*.minhash.index"
+            )
+            segment_sizes = {
+                Path(index_file).name.removesuffix(".minhash.index"): self.index_folder.size(index_file)
+                for index_file in index_files
+            }
+            merges = plan_index_compaction(segment_sizes, self.fanout, self.max_segments)
+            logger.info(f"Bucket {bucket:03d}: {len(segment_sizes)} segments, {len(merges)} merge(s) to run.")
+            for segments, merged_name in merges:
+                self.merge_segments(bucket, segments, merged_name)
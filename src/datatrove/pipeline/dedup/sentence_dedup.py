@@ -9,21 +9,18 @@ from: https://jmlr.org/papers/volume21/20-074/20-074.pdf (C4)
 
 import contextlib
 import dataclasses
-import heapq
-import struct
 from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import BinaryIO, Generator
+from typing import BinaryIO, Iterable, Literal
 
 import numpy as np
-from fsspec.spec import AbstractBufferedFile
 from tqdm import tqdm
 
 from datatrove.data import Document, DocumentsPipeline
 from datatrove.io import DataFolderLike, get_datafolder
 from datatrove.pipeline.base import PipelineStep
-from datatrove.utils.binaryio import read_np_from_file, read_tuples_from_file
+from datatrove.utils.binaryio import read_np_from_file, read_sorted_blocks
 from datatrove.utils.hashing import HashConfig, create_hash_func
 from datatrove.utils.logging import logger
 from datatrove.utils.text import (
@@ -31,6 +28,7 @@ from datatrove.utils.text import (
     ngrams,
     simplify_text,
     split_into_sentences,
+    split_sentence_spans,
 )
 from datatrove.utils.typeshelper import ExtensionHelperSD, Languages, StatHints
 
@@ -46,33 +44,32 @@ class SentDedupConfig:
     min_doc_words: int = 50
     min_num_sentences: int = 3  # remove docs that end up with fewer than 3 sentences
     min_words_to_remove_span: int = 0
+    # "char": tokenizer-free mode (e.g. for Chinese or Japanese). Sentences are split on punctuation instead of with
+    # the language's tokenizer, and min_doc_words/min_words_to_remove_span count (non whitespace) characters
+    tokenization: Literal["word", "char"] = "word"
     norm_config: TextNormConfig = field(default_factory=TextNormConfig)
     hash_config: HashConfig = field(default_factory=HashConfig)
 
 
-@dataclass(order=True)
-class HashSig:
-    # this also determines the sorting order
-    # hash_value needs to come first as that's what we match on
-    # file_id should come after doc_id so that hashes from the index (sent_id=doc_id=-1) come up first
-    hash_value: int
-    doc_id: int
-    file_id: int = None
-    sent_id: int = None
-    file_stem: str = None
-
-    def is_from_index(self):
-        return self.doc_id == self.sent_id == -1
+def get_sig_dtype(config: HashConfig) -> np.dtype:
+    # explicitly define little endianness
+    return np.dtype([("hash", config.np_descr), ("doc", "<u4"), ("sent", "<u2")])
 
 
 class SentenceDedupSignature(PipelineStep):
     """SentenceDedup: First pipeline step
 
-        Creates a signature for each sentence in each document. Each HashSig has n hash, the doc id and the sentence idx. Before saving
-        them the hashes are sorted.
+        Creates a signature for each sentence in each document: the hash of the n-gram of sentences starting at it,
+        the doc id and the sentence idx. Before saving them the signatures are sorted. Memory usage is bounded: once
+        `sig_buffer_size` signatures are accumulated, they are sorted and written to disk as a temporary run, and all
+        the runs are merged at the end.
 
     Args:
         output_folder: folder where signatures are saved
+        finder_workers: number of workers used in finder stage of deduplication
+        config: configuration for the dedup
+        language: language of the sentence/word tokenizers
+        sig_buffer_size: maximum number of signatures kept in memory
     """
 
     type = "🫂 - DEDUPS"
@@ -84,6 +81,7 @@ class SentenceDedupSignature(PipelineStep):
         finder_workers: int = 1,
         config: SentDedupConfig = None,
         language: str = Languages.english,
+        sig_buffer_size: int = 50_000_000,
     ):
         super().__init__()
         self.output_folder = get_datafolder(output_folder)
@@ -93,45 +91,61 @@ class SentenceDedupSignature(PipelineStep):
             logger.warning(f"Remember to also set the name of tasks of the finder block to {finder_workers=}!")
         self.finder_workers = finder_workers
         self.config = config or SentDedupConfig()
-        self.hash_fc = create_hash_func(config.hash_config)
+        self.hash_fc = create_hash_func(self.config.hash_config)
         self.language = language
         self.tokenizer = load_word_tokenizer(language)
+        self.sig_buffer_size = sig_buffer_size
 
-    def save_hashes(self, rank: int, signatures):
-        # explicitly define little endianness
-        signatures = np.array(
-            signatures, dtype=[("hash", self.config.hash_config.np_descr), ("doc", "<u4"), ("sent", "<u2")]
+    def write_sorted_signatures(self, rank: int, blocks: Iterable[np.ndarray]):
+        """
+            Write sorted signatures to the file of the finder worker responsible for their hash range
+        Args:
+            rank: rank of this task
+            blocks: blocks of sorted signatures, in increasing hash order
+        """
+        hashes_per_worker = self.config.hash_config.max // self.finder_workers
+        # last bucket needs to have everything
+        right_hashes = np.array(
+            [(hash_i + 1) * hashes_per_worker for hash_i in range(self.finder_workers - 1)]
+            + [self.config.hash_config.max],
+            dtype=np.uint64,
         )
-        signatures.sort(axis=0)
+        file_hash_i, f = None, None
+        try:
+            for block in blocks:
+                # signatures['hash'][right_idx - 1] <= right_hash < signatures['hash'][right_idx]
+                right_idxs = np.searchsorted(block["hash"], right_hashes, side="right").tolist()
+                left_idx = 0
+                for hash_i, right_idx in enumerate(right_idxs):
+                    if right_idx > left_idx:
+                        if hash_i != file_hash_i:
+                            if f is not None:
+                                f.close()
+                            f = self.output_folder.open(
+                                f"{hash_i:04d}/{rank:05d}{ExtensionHelperSD.stage_1_signature}", mode="wb"
+                            )
+                            file_hash_i = hash_i
+                        if self.output_folder.is_local():
+                            block[left_idx:right_idx].tofile(f)
+                        else:
+                            f.write(block[left_idx:right_idx].tobytes())
+                    left_idx = right_idx
+        finally:
+            if f is not None:
+                f.close()
 
-        hashes_per_worker = self.config.hash_config.max // self.finder_workers
-        left_idx = 0
-        for hash_i in range(self.finder_workers):
-            with self.output_folder.open(
-                f"{hash_i:04d}/{rank:05d}{ExtensionHelperSD.stage_1_signature}", mode="wb"
-            ) as f:
-                # last bucket needs to have everything
-                right_hash = (
-                    (hash_i + 1) * hashes_per_worker
-                    if hash_i != self.finder_workers - 1
-                    else self.config.hash_config.max
-                )
-                # find last hash that goes in this bucket. This obeys the following rule:
-                # signatures['hash'][right_idx - 1] <= right_hash <= signatures['hash'][right_idx]
-                right_idx = left_idx + signatures["hash"][left_idx:].searchsorted(right_hash, side="right")
-                # save to file
-                if right_idx > left_idx:
-                    if self.output_folder.is_local():
-                        signatures[left_idx:right_idx].tofile(f)
-                    else:
-                        f.write(signatures[left_idx:right_idx].tobytes())
-                left_idx = right_idx
-                # we've reached the end of our data
-                if right_idx >= len(signatures):
-                    break
+    def save_hashes(self, rank: int, signatures):
+        signatures = np.array(signatures, dtype=get_sig_dtype(self.config.hash_config))
+        signatures.sort(axis=0)
+        self.write_sorted_signatures(rank, [signatures])
 
     def get_hashes(self, doc: Document, doc_idx: int) -> list[None] | list[tuple[int, int, int]]:
-        sentences = self.tokenizer.sent_tokenize(doc.text) if self.config.split_sentences else doc.text.splitlines()
+        if not self.config.split_sentences:
+            sentences = doc.text.splitlines()
+        elif self.config.tokenization == "char":
+            sentences = [doc.text[start:end] for start, end in split_sentence_spans(doc.text)]
+        else:
+            sentences = self.tokenizer.sent_tokenize(doc.text)
         if len(sentences) < self.config.n_sentences:
             return []
 
@@ -153,50 +167,98 @@ class SentenceDedupSignature(PipelineStep):
 
         Returns:
 
-        SentenceDedupSignature creates a signature for each document. Each HashSig has n hash, the doc id and the
+        SentenceDedupSignature creates a signature for each document. Each signature has n hash, the doc id and the
         sentence idx. Before saving them the hashes are sorted.
 
         """
-        signatures = []
+        sig_dtype = get_sig_dtype(self.config.hash_config)
+        # growable array of signatures, sorted and spilled to disk as a run once it reaches sig_buffer_size
+        signatures = np.empty(min(self.sig_buffer_size, 2**16), dtype=sig_dtype)
+        nb_sigs = 0
+        runs = []
+        doc_hashes = []
+
+        def spill_run():
+            nonlocal nb_sigs
+            run_file = f"runs/{rank:05d}_{len(runs):04d}{ExtensionHelperSD.stage_1_signature}.tmp"
+            with self.output_folder.open(run_file, mode="wb") as f:
+                f.write(np.sort(signatures[:nb_sigs]).tobytes())
+            runs.append(run_file)
+            nb_sigs = 0
+
+        def add_doc_hashes():
+            nonlocal signatures, nb_sigs
+            new_sigs = np.array(doc_hashes, dtype=sig_dtype)
+            doc_hashes.clear()
+            pos = 0
+            while pos < len(new_sigs):
+                if nb_sigs == len(signatures):
+                    if len(signatures) < self.sig_buffer_size:
+                        grown = np.empty(min(2 * len(signatures), self.sig_buffer_size), dtype=sig_dtype)
+                        grown[:nb_sigs] = signatures[:nb_sigs]
+                        signatures = grown
+                    else:
+                        spill_run()
+                take = min(len(new_sigs) - pos, len(signatures) - nb_sigs)
+                signatures[nb_sigs : nb_sigs + take] = new_sigs[pos : pos + take]
+                nb_sigs += take
+                pos += take
+
         for doc_idx, doc in enumerate(data):
             with self.stats.time_stats:
                 self.stat_update(StatHints.total)
-                signatures.extend(self.get_hashes(doc, doc_idx))
-        self.save_hashes(rank, signatures)
-
-
-def read_sigs(
-    file: AbstractBufferedFile,
-    file_id: int,
-    config: SentDedupConfig,
-    index_file: bool = False,
-    lines_to_buffer: int = 5,
-) -> Generator[HashSig, None, None]:
-    line_format = f"{config.hash_config.struct_format}IH" if not index_file else config.hash_config.struct_format
-    file_stem = Path(file.path).name.removesuffix(ExtensionHelperSD.stage_1_signature)
-    last = None
-    with file as f:
-        for data in read_tuples_from_file(f, line_format, lines_to_buffer=lines_to_buffer):
-            assert last is None or data[0] >= last, f"Hash order error. {f.tell()=}, {data[0]=}, {last=}"
-            last = data[0]
-            yield (
-                HashSig(hash_value=data[0], doc_id=-1, file_id=file_id, sent_id=-1, file_stem=file_stem)
-                if index_file
-                else HashSig(file_id=file_id, hash_value=data[0], doc_id=data[1], sent_id=data[2], file_stem=file_stem)
-            )
+                doc_hashes.extend(self.get_hashes(doc, doc_idx))
+                if len(doc_hashes) >= 2**16:
+                    add_doc_hashes()
+        with self.stats.time_stats:
+            add_doc_hashes()
+            if not runs:
+                self.save_hashes(rank, signatures[:nb_sigs])
+                return
+            # merge the sorted runs
+            spill_run()
+            signatures = None
+            with contextlib.ExitStack() as stack:
+                files = [stack.enter_context(file) for file in self.output_folder.open_files(runs)]
+                self.write_sorted_signatures(
+                    rank,
+                    (
+                        np.sort(np.concatenate(blocks))
+                        for blocks in read_sorted_blocks(
+                            files,
+                            [sig_dtype] * len(runs),
+                            lines_to_buffer=max(1, self.sig_buffer_size // len(runs)),
+                        )
+                    ),
+                )
+            for run_file in runs:
+                self.output_folder.rm(run_file)
+
+
+def get_lines_to_buffer(files: list, sig_dtype: np.dtype, lines_to_buffer: int, max_memory_size: int) -> int:
+    """Number of signatures to read from each file at a time. -1 (everything at once) if they fit in memory"""
+    if sum(file.size for file in files) <= max_memory_size:
+        return -1
+    if lines_to_buffer == -1:
+        return max(1, max_memory_size // (sig_dtype.itemsize * len(files)))
+    return lines_to_buffer
 
 
 class SentenceFindDedups(PipelineStep):
     """SentenceDedup: Second pipeline step
 
-        SentenceFindDedups runs on a single worker. It reads all the signatures from the previous step and loads them
-        in a priority queue to check for duplicates. If a duplicate is found its document id and sentence id are saved.
+        SentenceFindDedups reads all the signatures from the previous step (for its hash range) and merges them, block
+        by block, to check for duplicates. If a duplicate is found its document id and sentence id are saved.
 
     Args:
         data_folder: data folder where signatures are saved
         output_folder: folder where duplicates are saved
         index_folder: folder where index files are saved
-        only_dedup_in_index: only dedup in index
+        config: configuration for the dedup
+        lines_to_buffer: number of signatures to read from each file at a time. -1 to split `max_memory_size`
+            between the files
+        max_memory_size: approximate amount of memory (in bytes) to use to buffer the signatures. Everything is
+            loaded at once if the signatures fit
     """
 
     type = "🫂 - DEDUPS"
@@ -208,7 +270,8 @@ class SentenceFindDedups(PipelineStep):
         output_folder: DataFolderLike,
         index_folder: DataFolderLike = None,
         config: SentDedupConfig = None,
-        lines_to_buffer: int = 5,
+        lines_to_buffer: int = -1,
+        max_memory_size: int = 2**30,
     ):
         super().__init__()
         self.data_folder = get_datafolder(data_folder)
@@ -216,6 +279,7 @@ class SentenceFindDedups(PipelineStep):
         self.index_folder = get_datafolder(index_folder) if index_folder else None
         self.config = config or SentDedupConfig()
         self.lines_to_buffer = lines_to_buffer
+        self.max_memory_size = max_memory_size
 
     def run(self, data: DocumentsPipeline = None, rank: int = 0, world_size: int = 1):
         with self.stats.time_stats:
@@ -230,65 +294,51 @@ class SentenceFindDedups(PipelineStep):
                 sig_files = self.data_folder.list_files(
                     subdirectory=f"{rank:04d}", glob_pattern=ExtensionHelperSD.stage_1_signature
                 )
-            sig_readers = [
-                read_sigs(file, file_i, config=self.config, lines_to_buffer=self.lines_to_buffer)
-                for file_i, file in enumerate(self.data_folder.open_files(sig_files))
-            ]
-            index_files = self.index_folder.list_files() if self.index_folder else None
-            if index_files:
-                logger.info(f"Found index file(s): {', '.join(index_files)}")
-                sig_readers.extend(
-                    [
-                        read_sigs(
-                            file,
-                            len(sig_readers) + file_i,
-                            config=self.config,
-                            index_file=True,
-                            lines_to_buffer=self.lines_to_buffer,
+            file_stems = [Path(file).name.removesuffix(ExtensionHelperSD.stage_1_signature) for file in sig_files]
+            index_files = self.index_folder.list_files() if self.index_folder else []
+            sig_dtype = get_sig_dtype(self.config.hash_config)
+            index_dtype = np.dtype([("hash", self.config.hash_config.np_descr)])
+            # duplicates of the main dataset itself (and not only of the index) are removed
+            dedup_in_data = not index_files or not self.config.only_dedup_in_index
+            with contextlib.ExitStack() as stack:
+                files = [stack.enter_context(file) for file in self.data_folder.open_files(sig_files)]
+                if index_files:
+                    logger.info(f"Found index file(s): {', '.join(index_files)}")
+                    files.extend(stack.enter_context(file) for file in self.index_folder.open_files(index_files))
+                lines_to_buffer = get_lines_to_buffer(files, sig_dtype, self.lines_to_buffer, self.max_memory_size)
+                logger.info(f"Merging {len(files)} files.")
+
+                output_mg = self.output_folder.get_output_file_manager(mode="wb")
+                for blocks in read_sorted_blocks(
+                    files,
+                    [sig_dtype] * len(sig_files) + [index_dtype] * len(index_files),
+                    lines_to_buffer=lines_to_buffer,
+                ):
+                    sig_blocks = blocks[: len(sig_files)]
+                    file_ids = np.repeat(np.arange(len(sig_blocks)), [len(block) for block in sig_blocks])
+                    if not len(file_ids):
+                        continue
+                    sigs = np.concatenate(sig_blocks)
+                    # (hash, doc, file, sent) order: the first signature of each hash is the one that is kept
+                    order = np.lexsort((sigs["sent"], file_ids, sigs["doc"], sigs["hash"]))
+                    sigs, file_ids = sigs[order], file_ids[order]
+                    is_dup = np.zeros(len(sigs), dtype=bool)
+                    if dedup_in_data:
+                        np.equal(sigs["hash"][1:], sigs["hash"][:-1], out=is_dup[1:])
+                    if index_files:
+                        # we never want to match samples from the index itself
+                        index_hashes = np.concatenate([block["hash"] for block in blocks[len(sig_files) :]])
+                        is_dup |= np.isin(sigs["hash"], index_hashes)
+                    if not is_dup.any():
+                        continue
+                    dups = np.empty(np.count_nonzero(is_dup), dtype=[("doc", "<u4"), ("sent", "<u2")])
+                    dups["doc"], dups["sent"], dup_files = sigs["doc"][is_dup], sigs["sent"][is_dup], file_ids[is_dup]
+                    for file_i in np.unique(dup_files).tolist():
+                        output_mg.write(
+                            f"{rank:04d}/{file_stems[file_i]}{ExtensionHelperSD.stage_2_duplicates}",
+                            dups[dup_files == file_i].tobytes(),
                         )
-                        for file_i, file in enumerate(self.index_folder.open_files(index_files))
-                    ]
-                )
-
-            logger.info(f"Initializing pq with {len(sig_readers)} files.")
-            with ThreadPoolExecutor() as executor:
-                pq = [
-                    x
-                    for x in tqdm(
-                        executor.map(lambda x: next(x, None), sig_readers),
-                        total=len(sig_readers),
-                        desc="Initializing pq...",
-                    )
-                    if x
-                ]
-            heapq.heapify(pq)
-            logger.info("PQ initialized.")
-
-            output_mg = self.output_folder.get_output_file_manager(mode="wb")
-
-            packer = struct.Struct("<IH")
-
-            last: HashSig | None = None
-            while pq:
-                v: HashSig = heapq.heappop(pq)
-                if (
-                    last and last.hash_value == v.hash_value and not v.is_from_index()
-                ):  # we never want to match samples from the index itself
-                    out_filename = f"{rank:04d}/{v.file_stem}{ExtensionHelperSD.stage_2_duplicates}"
-                    # the previous one we are matching against is part of the index
-                    # OR there are no index files
-                    # OR we are also matching within the main dataset
-                    if last.is_from_index() or not index_files or not self.config.only_dedup_in_index:
-                        output_mg.write(out_filename, packer.pack(v.doc_id, v.sent_id))
-
-                if not last or last.hash_value != v.hash_value or not last.is_from_index():
-                    last = v
-                new_v = next(sig_readers[v.file_id], None)
-
-                if new_v:
-                    heapq.heappush(pq, new_v)
-
-        output_mg.close()
+                output_mg.close()
 
 
 class SentenceDedupFilter(PipelineStep):
@@ -326,10 +376,23 @@ class SentenceDedupFilter(PipelineStep):
             file, dtype=np.dtype([("doc", "<u4"), ("sent", "<u2")]), is_local_file=self.data_folder.is_local()
         )
 
+    def count_words(self, text: str) -> int:
+        if self.config.tokenization == "char":
+            return len("".join(text.split()))
+        return len(self.tokenizer.word_tokenize(text))
+
+    def count_sentences(self, text: str) -> int:
+        if self.config.tokenization == "char":
+            return len(split_sentence_spans(text))
+        return len(split_into_sentences(text, self.language))
+
     def remove_dup_sentences(self, doc: Document, du_lines: np.ndarray) -> tuple[str, str]:
-        sentence_spans = (
-            list(self.tokenizer.span_tokenize(doc.text)) if self.config.split_sentences else doc.text.splitlines()
-        )
+        if not self.config.split_sentences:
+            sentence_spans = doc.text.splitlines()
+        elif self.config.tokenization == "char":
+            sentence_spans = split_sentence_spans(doc.text)
+        else:
+            sentence_spans = list(self.tokenizer.span_tokenize(doc.text))
         kept_sentences = []
         original_formatted = []
         last_s = 0
@@ -352,8 +415,7 @@ class SentenceDedupFilter(PipelineStep):
                     original_formatted.append("<<<")
                     if (
                         self.config.min_words_to_remove_span > 0
-                        and len(self.tokenizer.word_tokenize("\n".join(removed_span)))
-                        < self.config.min_words_to_remove_span
+                        and self.count_words("\n".join(removed_span)) < self.config.min_words_to_remove_span
                     ):
                         kept_sentences.extend(removed_span)
                     removed_span.clear()
@@ -368,7 +430,7 @@ class SentenceDedupFilter(PipelineStep):
             original_formatted.append("<<<")
             if (
                 self.config.min_words_to_remove_span > 0
-                and len(self.tokenizer.word_tokenize("\n".join(removed_span))) < self.config.min_words_to_remove_span
+                and self.count_words("\n".join(removed_span)) < self.config.min_words_to_remove_span
             ):
                 kept_sentences.extend(removed_span)
         if len(kept_sentences) < len(sentence_spans):
@@ -429,13 +491,12 @@ class SentenceDedupFilter(PipelineStep):
                             (
                                 # min doc words
                                 self.config.min_doc_words <= 0
-                                or len(self.tokenizer.word_tokenize(filtered_text)) >= self.config.min_doc_words
+                                or self.count_words(filtered_text) >= self.config.min_doc_words
                             )
                             and (
                                 # min num sentences
                                 self.config.min_num_sentences <= 0
-                                or len(split_into_sentences(filtered_text, self.language))
-                                >= self.config.min_num_sentences
+                                or self.count_sentences(filtered_text) >= self.config.min_num_sentences
                             )
                         )
                     )
@@ -458,6 +519,10 @@ class SentenceDedupBuildIndex(PipelineStep):
         data_folder: data folder to get signature files.
         output_folder: folder where index is saved
         index_name: name of the index
+        config: configuration for the dedup
+        lines_to_buffer: number of signatures to read from each file at a time. -1 to split `max_memory_size`
+            between the files
+        max_memory_size: approximate amount of memory (in bytes) to use to buffer the signatures
     """
 
     type = "🫂 - DEDUP"
@@ -469,35 +534,25 @@ class SentenceDedupBuildIndex(PipelineStep):
         output_folder: DataFolderLike,
         index_name: str,
         config: SentDedupConfig = None,
-        lines_to_buffer: int = 5,
+        lines_to_buffer: int = -1,
+        max_memory_size: int = 2**30,
     ):
         super().__init__()
         self.data_folder = get_datafolder(data_folder)
         self.output_folder = get_datafolder(output_folder)
         self.index_name = index_name
         self.lines_to_buffer = lines_to_buffer
+        self.max_memory_size = max_memory_size
         self.config = config or SentDedupConfig()
 
     def run(self, data: DocumentsPipeline = None, rank: int = 0, world_size: int = 1):
         assert world_size == 1, "SentenceDedupBuildIndex can only run on a single worker."
         with self.stats.time_stats:
             sig_files = self.data_folder.list_files(glob_pattern="*/*" + ExtensionHelperSD.stage_1_signature)
-            sig_readers = [
-                read_sigs(file, file_i, self.config, lines_to_buffer=self.lines_to_buffer)
-                for file_i, file in enumerate(self.data_folder.open_files(sig_files))
-            ]
-
-            pq = [next(sig_reader) for sig_reader in sig_readers]
-            heapq.heapify(pq)
-
-            with self.output_folder.open(f"{self.index_name}.{ExtensionHelperSD.index}", mode="wb") as out_f:
-                last = None
-                while pq:
-                    v: HashSig = heapq.heappop(pq)
-                    if last != v.hash_value:
-                        out_f.write(struct.pack(f"<{self.config.hash_config.struct_format}", v.hash_value))
-                    last = v.hash_value
-                    new_v = next(sig_readers[v.file_id], None)
-
-                    if new_v:
-                        heapq.heappush(pq, new_v)
+            sig_dtype = get_sig_dtype(self.config.hash_config)
+            with contextlib.ExitStack() as stack:
+                files = [stack.enter_context(file) for file in self.data_folder.open_files(sig_files)]
+                lines_to_buffer = get_lines_to_buffer(files, sig_dtype, self.lines_to_buffer, self.max_memory_size)
+                with self.output_folder.open(f"{self.index_name}.{ExtensionHelperSD.index}", mode="wb") as out_f:
+                    for blocks in read_sorted_blocks(files, [sig_dtype] * len(files), lines_to_buffer=lines_to_buffer):
+                        out_f.write(np.unique(np.concatenate([block["hash"] for block in blocks])).tobytes())
@@ -68,6 +68,13 @@ class IpcReader(BaseDiskReader):
     def _iter_file_batches(self, filepath: str):
         import pyarrow as pa
 
+        if self.data_folder.is_local():
+            # memory map local files: uncompressed batches are then read without any copy
+            with pa.memory_map(self.data_folder.resolve_paths(filepath), "rb") as f:
+                with pa.ipc.open_file(f) as ipc_reader:
+                    for i in range(ipc_reader.num_record_batches):
+                        yield ipc_reader.get_batch(i)
+            return
         with self.data_folder.open(filepath, "rb") as f:
             with pa.ipc.open_file(f) as ipc_reader:
                 for i in range(ipc_reader.num_record_batches):
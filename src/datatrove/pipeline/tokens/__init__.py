@@ -2,4 +2,6 @@ from .context_shuffler import DocumentTokenizerContextShuffler
 from .counter import LengthCounter, TokensCounter
 from .megatron_tokenizer import MegatronDocumentTokenizer
 from .merger import DocumentTokenizerMerger
+from .mixer import DocumentTokenizerMixer
+from .packer import DocumentTokenizerPacker
 from .tokenizer import DocumentTokenizer
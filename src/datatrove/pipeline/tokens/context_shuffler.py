@@ -1,5 +1,3 @@
-import mmap
-
 import numpy as np
 from numpy.random import default_rng
 
@@ -7,11 +5,15 @@ from datatrove.data import DocumentsPipeline
 from datatrove.io import DataFolderLike, get_datafolder
 from datatrove.pipeline.base import PipelineStep
 from datatrove.pipeline.tokens.merger import load_doc_ends
+from datatrove.pipeline.tokens.tokenizer import SHUFFLING_CACHE_TYPE, read_documents
 from datatrove.utils.logging import logger
 
 
 class DocumentTokenizerContextShuffler(PipelineStep):
     """Shuffles a .ds file on the context length level. This block will move around windows of `window_size` tokens.
+        Windows are read in chunks (memory mapped for local files, or with a few large reads sorted by position for
+        remote ones) and each chunk is written with a single write, so this works on local and remote folders alike.
+        Each chunk reads at most twice its size from remote files, however large the file is.
 
     Args:
         input_folder: the input folder to read the tokenized documents from
@@ -70,14 +72,17 @@ class DocumentTokenizerContextShuffler(PipelineStep):
             total_len = load_doc_ends(self.input_folder.open(index, "rb"))[-1]
             nr_windows = total_len // self.window_size
             ordering = self.rand.permutation(np.arange(0, nr_windows, dtype=int))
-            with self.output_folder.open(datafile, "wb") as fout:
-                with self.input_folder.open(datafile, "rb") as f:
-                    # TODO: replace mmap implementation which only works locally
-                    with mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as unshuf:
-                        with self.track_time():
-                            for windowi in ordering:
-                                start, end = (
-                                    windowi * self.window_size * self.token_size,
-                                    (windowi + 1) * self.window_size * self.token_size,
-                                )
-                                fout.write(unshuf[start:end])
+            window_starts = ordering * self.window_size
+            with (
+                self.output_folder.open(datafile, "wb") as fout,
+                self.input_folder.open(datafile, "rb", cache_type=SHUFFLING_CACHE_TYPE) as f,
+                self.track_time(),
+            ):
+                for windows, _ in read_documents(
+                    [f],
+                    np.zeros(nr_windows, dtype=np.int64),
+                    window_starts,
+                    window_starts + self.window_size,
+                    item_size=self.token_size,
+                ):
+                    fout.write(windows)
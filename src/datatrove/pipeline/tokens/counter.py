@@ -1,18 +1,80 @@
-from datatrove.data import DocumentsPipeline
+from typing import Literal
+
+import numpy as np
+
+from datatrove.data import Document, DocumentsPipeline
 from datatrove.pipeline.base import PipelineStep
 from datatrove.utils.batching import batched
+from datatrove.utils.logging import logger
 from datatrove.utils.tokenization import PipelineStepWithTokenizer
 
 
+class TokenRatio:
+    """Running ratio estimate of the number of tokens per unit of text (characters or bytes) of a set of documents.
+    Only keeps sums, so it can be updated in O(1) per document.
+
+    The standard error of the ratio estimator is sum((tokens - ratio * lengths) ** 2) / (n * (n - 1) * mean(lengths) ** 2),
+    and `relative_error` is the half-width of its 95% confidence interval, relative to the ratio. This is the
+    expected relative error on the total token count of a large number of documents.
+    """
+
+    def __init__(self):
+        self.nb_documents = 0
+        self.lengths = 0
+        self.tokens = 0
+        self.lengths_squared = 0
+        self.products = 0
+        self.tokens_squared = 0
+
+    def update(self, lengths: np.ndarray, tokens: np.ndarray):
+        lengths, tokens = lengths.astype(np.float64), tokens.astype(np.float64)
+        self.nb_documents += len(lengths)
+        self.lengths += lengths.sum()
+        self.tokens += tokens.sum()
+        self.lengths_squared += (lengths * lengths).sum()
+        self.products += (lengths * tokens).sum()
+        self.tokens_squared += (tokens * tokens).sum()
+
+    @property
+    def ratio(self) -> float:
+        return self.tokens / self.lengths if self.lengths else 0.0
+
+    @property
+    def relative_error(self) -> float:
+        if self.nb_documents < 2 or not self.tokens:
+            return float("inf")
+        ratio = self.ratio
+        # sum of the squared residuals, expanded so that only the running sums are needed
+        residuals = self.tokens_squared - 2 * ratio * self.products + ratio * ratio * self.lengths_squared
+        mean_length = self.lengths / self.nb_documents
+        standard_error = np.sqrt(max(residuals, 0.0) / (self.nb_documents * (self.nb_documents - 1))) / mean_length
+        return 1.96 * standard_error / ratio
+
+
 class TokensCounter(PipelineStepWithTokenizer):
     """Count the number of tokens in each document.
         This pipeline step uses the HuggingFace fast tokenizers library to count the number of tokens in each document.
         It doesn't save the tokenized documents, only the token count.
 
+        With `estimate=True`, documents are only tokenized until the ratio of tokens per character (or byte) of their
+        language is known within `max_relative_error`: the count of the following documents of that language is
+        estimated from their length. Each rank fits its own ratios. The ratio and error of each language are reported
+        in the stats (`{language}_tokens_per_{unit}` and `{language}_relative_error`), and the documents whose count is
+        estimated have `token_count_estimated` set in their metadata.
+
     Args:
         tokenizer_name_or_path (str): the name or path of the tokenizer to use, from the HuggingFace tokenizers library or a local file.
         count_eos_token (bool): whether to count the EOS token on each document. (basically +1 per document)
         batch_size: batch size for tokenization
+        estimate (bool): estimate the token counts from the document lengths instead of tokenizing every document
+        estimation_unit (str): "chars" or "bytes" (of the utf-8 encoded text), the length used for the estimation
+        language_key (str | None): metadata key of the document language. A ratio is fitted for each language. None to
+            fit a single ratio
+        max_relative_error (float): stop tokenizing the documents of a language once the 95% confidence interval of
+            its ratio is within this relative error
+        min_calibration_docs (int): minimum number of documents tokenized for each language
+        max_calibration_docs (int): maximum number of documents tokenized for each language, even if the error bound
+            has not been reached. -1 for no limit
     """
 
     name = "📊 Counter"
@@ -23,10 +85,76 @@ class TokensCounter(PipelineStepWithTokenizer):
         tokenizer_name_or_path: str = "gpt2",  # tokenizer to use, from HF or a local file path
         count_eos_token: bool = False,  # whether to count the EOS token on each document
         batch_size: int = 10000,  # batch size for tokenization
+        estimate: bool = False,
+        estimation_unit: Literal["chars", "bytes"] = "chars",
+        language_key: str | None = "language",
+        max_relative_error: float = 0.01,
+        min_calibration_docs: int = 100,
+        max_calibration_docs: int = 10000,
     ):
         super().__init__(tokenizer_name_or_path)
+        if estimation_unit not in ("chars", "bytes"):
+            raise ValueError(f"Invalid estimation_unit {estimation_unit}. Use 'chars' or 'bytes'.")
         self.count_eos_token = count_eos_token
         self.batch_size = batch_size
+        self.estimate = estimate
+        self.estimation_unit = estimation_unit
+        self.language_key = language_key
+        self.max_relative_error = max_relative_error
+        self.min_calibration_docs = min_calibration_docs
+        self.max_calibration_docs = max_calibration_docs
+
+    def count_tokens(self, documents: list[Document]) -> list[int]:
+        """Tokenize the documents and return their number of tokens (without the EOS token)"""
+        from tokenizers import Encoding
+
+        encoded_batch: list[Encoding] = self.tokenizer.encode_batch([document.text for document in documents])
+        return [len(encoded.ids) for encoded in encoded_batch]
+
+    def is_calibrated(self, ratio: TokenRatio) -> bool:
+        if ratio.nb_documents < self.min_calibration_docs:
+            return False
+        if 0 <= self.max_calibration_docs <= ratio.nb_documents:
+            return True
+        return ratio.relative_error <= self.max_relative_error
+
+    def estimate_tokens(self, batch: list[Document], ratios: dict[str, TokenRatio]) -> list[int]:
+        """Count the tokens of a batch of documents: documents of languages whose ratio is not calibrated yet are
+            tokenized (and used to fit the ratio), the count of the others is estimated from their length.
+
+        Args:
+            batch (list[Document]): the documents
+            ratios (dict[str, TokenRatio]): the ratio of each language, updated in place
+
+        Returns:
+            list[int]: the token count of each document
+        """
+        languages = [
+            document.metadata.get(self.language_key, "unknown") if self.language_key else "all" for document in batch
+        ]
+        lengths = np.array(
+            [
+                len(document.text) if self.estimation_unit == "chars" else len(document.text.encode("utf-8"))
+                for document in batch
+            ],
+            dtype=np.int64,
+        )
+        counts = np.empty(len(batch), dtype=np.int64)
+        estimated = np.array(
+            [language in ratios and self.is_calibrated(ratios[language]) for language in languages], dtype=bool
+        )
+        # tokenize the documents of languages that are still being calibrated
+        calibration = np.flatnonzero(~estimated)
+        if len(calibration):
+            counts[calibration] = self.count_tokens([batch[i] for i in calibration])
+            for language in {languages[i] for i in calibration}:
+                in_language = calibration[[languages[i] == language for i in calibration]]
+                ratios.setdefault(language, TokenRatio()).update(lengths[in_language], counts[in_language])
+            self.stat_update("calibration_documents", value=len(calibration))
+        for i in np.flatnonzero(estimated):
+            counts[i] = round(lengths[i] * ratios[languages[i]].ratio)
+            batch[i].metadata["token_count_estimated"] = True
+        return counts.tolist()
 
     def run(self, data: DocumentsPipeline, rank: int = 0, world_size: int = 1) -> DocumentsPipeline:
         """
@@ -40,19 +168,25 @@ class TokensCounter(PipelineStepWithTokenizer):
           DocumentsPipeline: The pipeline with updated documents, each having a new or updated `token_count` in its metadata.
 
         """
-        from tokenizers import Encoding
-
+        ratios = {}
         # tokenize document's text in batches to go faster
         for batch in batched(data, self.batch_size):
             with self.track_time(unit="batch"):
-                encoded_batch: list[Encoding] = self.tokenizer.encode_batch([document.text for document in batch])
-            for document, encoded in zip(batch, encoded_batch):
-                count = len(encoded.ids)
+                counts = self.estimate_tokens(batch, ratios) if self.estimate else self.count_tokens(batch)
+            for document, count in zip(batch, counts):
                 if self.count_eos_token:
                     count += 1
                 document.metadata["token_count"] = count
                 self.stat_update("tokens", value=count)
                 yield document
+        for language, ratio in ratios.items():
+            self.stats[f"{language}_tokens_per_{self.estimation_unit}"].update(ratio.ratio)
+            self.stats[f"{language}_relative_error"].update(ratio.relative_error)
+            if not self.is_calibrated(ratio):
+                logger.warning(
+                    f"Token counts of {language} documents were not estimated: the error bound was not reached after "
+                    f"{ratio.nb_documents} documents."
+                )
 
 
 class LengthCounter(PipelineStep):
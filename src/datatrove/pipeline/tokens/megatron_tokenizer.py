@@ -1,5 +1,6 @@
 import struct
-from typing import List
+import tempfile
+from itertools import chain
 
 import numpy as np
 
@@ -7,6 +8,7 @@ from datatrove.data import DocumentsPipeline
 from datatrove.io import DataFolderLike, get_datafolder
 from datatrove.utils.batching import batched
 from datatrove.utils.logging import logger
+from datatrove.utils.stats import MetricStats
 from datatrove.utils.tokenization import PipelineStepWithTokenizer
 
 
@@ -19,11 +21,15 @@ class MegatronTokenizedFile:
 
         Inspired by https://github.com/NVIDIA/NeMo/blob/062532770dbe790e73637dcd0926d964628cbaa5/nemo/collections/nlp/data/language_modeling/megatron/indexed_dataset.py#L380-L591
 
+        Sequence lengths are accumulated in a fixed size array. Full chunks are spilled to a local temporary file, so
+        that memory usage does not grow with the number of documents, and the index is written chunk by chunk at close.
+
     Args:
         output_folder (DataFolderLike): the output folder where to save the tokenized documents
         filename (str): the filename to use
         upload_block_size (int): the fsspec size of the upload block for remote filesystems (S3)
         token_size (int): size of each token, in bytes
+        index_chunk_size (int): number of sequence lengths kept in memory before spilling them to disk
 
     """
 
@@ -33,9 +39,9 @@ class MegatronTokenizedFile:
         filename: str,
         upload_block_size: int | None = None,
         token_size: int = 2,
+        index_chunk_size: int = 2**20,
     ):
         self.output_folder = get_datafolder(output_folder)
-        self.sequence_lengths = []
         self.filename = filename
         self.upload_block_size = upload_block_size
         self.token_size = token_size
@@ -43,12 +49,44 @@ class MegatronTokenizedFile:
         self.token_dtype_code = (
             4 if token_size == 4 else 8
         )  # NOTE(tj.solergibert) Megatron needs this dtype code in the .idx file | https://github.com/NVIDIA/Megatron-LM/blob/64cbae55ac85cd73fbadbc3c0d715c8123c5e13b/megatron/core/datasets/indexed_dataset.py#L41
-        self.document_indices = [0]  # NOTE(tj.solergibert) Megatron needs this document_indices field
+        # lengths of the sequences not spilled yet. Only the first `_nb_buffered` entries are valid
+        self._sequence_lengths = np.empty(index_chunk_size, dtype=np.int32)
+        self._nb_buffered = 0
+        self._spill_file = None
+        self.nb_sequences = 0
+        self.nb_tokens = 0
 
         self.bin_file = self.output_folder.open(f"{self.filename}.bin", mode="wb", block_size=upload_block_size)
 
     def __len__(self):
-        return sum(self.sequence_lengths) if self.sequence_lengths else 0
+        return self.nb_tokens
+
+    def _add_sequence_lengths(self, sequence_lengths: np.ndarray):
+        """Append sequence lengths to the index, spilling full chunks to disk.
+
+        Args:
+            sequence_lengths (np.ndarray): the lengths to append
+        """
+        self.nb_sequences += len(sequence_lengths)
+        self.nb_tokens += int(sequence_lengths.sum(dtype=np.int64))
+        while len(sequence_lengths):
+            nb_added = min(len(sequence_lengths), len(self._sequence_lengths) - self._nb_buffered)
+            self._sequence_lengths[self._nb_buffered : self._nb_buffered + nb_added] = sequence_lengths[:nb_added]
+            self._nb_buffered += nb_added
+            sequence_lengths = sequence_lengths[nb_added:]
+            if self._nb_buffered == len(self._sequence_lengths):
+                if self._spill_file is None:
+                    self._spill_file = tempfile.TemporaryFile()
+                self._spill_file.write(self._sequence_lengths.tobytes())
+                self._nb_buffered = 0
+
+    def _iter_sequence_lengths(self):
+        """Iterate over the sequence lengths, one chunk at a time: the spilled chunks first, then the buffered ones"""
+        if self._spill_file is not None:
+            self._spill_file.seek(0)
+            while chunk := self._spill_file.read(self._sequence_lengths.nbytes):
+                yield np.frombuffer(chunk, dtype=np.int32)
+        yield self._sequence_lengths[: self._nb_buffered]
 
     def close(self):
         """Close the files and save the .bin & .idx files"""
@@ -78,48 +116,52 @@ class MegatronTokenizedFile:
         # Numeric code for the DType
         self.idx_file.write(struct.pack("<B", self.token_dtype_code))
 
-        sequence_pointers = self._sequence_pointers(self.sequence_lengths)
-
         # Number of sequences in the dataset
-        sequence_count = len(self.sequence_lengths)
-        self.idx_file.write(struct.pack("<Q", sequence_count))
+        self.idx_file.write(struct.pack("<Q", self.nb_sequences))
 
         # Number of documents in the dataset
-        document_count = len(self.document_indices)
-        self.idx_file.write(struct.pack("<Q", document_count))
+        # NOTE(tj.solergibert) Megatron needs this document_indices field
+        self.idx_file.write(struct.pack("<Q", self.nb_sequences + 1))
 
         # Number of tokens per sequence
-        sequence_lengths = np.array(self.sequence_lengths, dtype=np.int32)
-        self.idx_file.write(sequence_lengths.tobytes(order="C"))
-        del sequence_lengths
+        for sequence_lengths in self._iter_sequence_lengths():
+            self.idx_file.write(sequence_lengths.tobytes(order="C"))
 
         # Byte offsets for all sequences
-        sequence_pointers = np.array(sequence_pointers, dtype=np.int64)
-        self.idx_file.write(sequence_pointers.tobytes(order="C"))
-        del sequence_pointers
-
-        # Sequence indices marking the end of each document
-        document_indices = np.array(self.document_indices, dtype=np.int64)
-        self.idx_file.write(document_indices.tobytes(order="C"))
+        offset = 0
+        for sequence_lengths in self._iter_sequence_lengths():
+            sequence_pointers = self._sequence_pointers(sequence_lengths, offset)
+            self.idx_file.write(sequence_pointers.tobytes(order="C"))
+            if len(sequence_lengths):
+                offset = int(sequence_pointers[-1]) + int(sequence_lengths[-1]) * self.token_size
+
+        # Sequence indices marking the end of each document: each sequence is a document
+        for start in range(0, self.nb_sequences + 1, len(self._sequence_lengths)):
+            document_indices = np.arange(start, min(start + len(self._sequence_lengths), self.nb_sequences + 1))
+            self.idx_file.write(document_indices.astype(np.int64).tobytes(order="C"))
 
         # Close
         self.idx_file.close()
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
 
-    def _sequence_pointers(self, sequence_lengths: List[int]) -> List[int]:
+    def _sequence_pointers(self, sequence_lengths: np.ndarray, offset: int = 0) -> np.ndarray:
         """Build the sequence pointers per the sequence lengths and dtype size
 
         Args:
-            sequence_lengths (List[int]): The length of each sequence
+            sequence_lengths (np.ndarray): The length of each sequence
+            offset (int): The pointer to the beginning of the first sequence
 
         Returns:
-            List[int]: The pointer to the beginning of each sequence
+            np.ndarray: The pointer to the beginning of each sequence
         """
-        curr_ptr = 0
-        list_ptr = []
-        for length in sequence_lengths:
-            list_ptr.append(curr_ptr)
-            curr_ptr += length * self.token_size
-        return list_ptr
+        sequence_pointers = np.empty(len(sequence_lengths), dtype=np.int64)
+        sequence_pointers[:1] = offset
+        np.cumsum(sequence_lengths[:-1], dtype=np.int64, out=sequence_pointers[1:])
+        sequence_pointers[1:] *= self.token_size
+        sequence_pointers[1:] += offset
+        return sequence_pointers
 
     def write(self, tokens: list[int]):
         """Write tokens to the files.
@@ -128,12 +170,25 @@ class MegatronTokenizedFile:
             tokens (list[int]): the tokens to write
         """
 
-        np_array = np.array(tokens, dtype=self.token_dtype)
+        np_array = np.asarray(tokens, dtype=self.token_dtype)
         self.bin_file.write(np_array.tobytes(order="C"))
-        self.sequence_lengths.append(np_array.size)
-        self.document_indices.append(
-            len(self.sequence_lengths)
-        )  # NOTE(tj.solergibert) Megatron needs this document_indices field
+        self._add_sequence_lengths(np.array([np_array.size], dtype=np.int32))
+
+    def write_batch(self, tokens: list[list[int]]):
+        """Write several documents at once: their tokens are packed into a single preallocated array and written
+            with a single call.
+
+        Args:
+            tokens (list[list[int]]): the tokens of each document
+        """
+        if not tokens:
+            return
+        sequence_lengths = np.fromiter(map(len, tokens), dtype=np.int32, count=len(tokens))
+        tokens_array = np.fromiter(
+            chain.from_iterable(tokens), dtype=self.token_dtype, count=int(sequence_lengths.sum(dtype=np.int64))
+        )
+        self.bin_file.write(tokens_array.tobytes(order="C"))
+        self._add_sequence_lengths(sequence_lengths)
 
 
 def get_output_filename(save_filename, rank: int, name: str, sub_rank: int = None):
@@ -196,12 +251,11 @@ class MegatronDocumentTokenizer(PipelineStepWithTokenizer):
         for batch in batched(data, self.batch_size):
             with self.track_time(unit="batch"):
                 encoded_batch: list[Encoding] = self.tokenizer.encode_batch([document.text for document in batch])
-                for encoded in encoded_batch:
-                    tokens = encoded.ids
-                    # Write bytes to disk
-                    unshuff.write(tokens)
-                    # Save stats
-                    self.stat_update("tokens", value=len(tokens))
+                tokens = [encoded.ids for encoded in encoded_batch]
+                # Write bytes to disk
+                unshuff.write_batch(tokens)
+                # Save stats
+                self.stats["tokens"] += MetricStats.from_values(np.array([len(doc_tokens) for doc_tokens in tokens]))
         unshuff.close()
         return unshuff
 
@@ -1,4 +1,4 @@
-from functools import partial
+from contextlib import ExitStack
 from typing import BinaryIO, Generator
 
 import numpy as np
@@ -6,9 +6,16 @@ from numpy.random import default_rng
 from tqdm import tqdm
 
 from datatrove.data import DocumentsPipeline
-from datatrove.io import DataFolderLike, get_datafolder
+from datatrove.io import DataFolder, DataFolderLike, get_datafolder
 from datatrove.pipeline.base import PipelineStep
-from datatrove.pipeline.tokens.tokenizer import TokenizedFile
+from datatrove.pipeline.tokens.tokenizer import (
+    SHUFFLING_CACHE_TYPE,
+    TokenizedFile,
+    get_document_bounds,
+    read_documents,
+)
+from datatrove.utils.logging import logger
+from datatrove.utils.stats import MetricStats
 
 
 class DocumentTokenizerMerger(PipelineStep):
@@ -17,10 +24,16 @@ class DocumentTokenizerMerger(PipelineStep):
 
         WARNING: This pipeline step involves accessing multiple files in random order on the filesystem, which can be
         slow on some filesystems (e.g. S3). It is recommended to use a local filesystem for the input and output folders.
+        To limit the number of reads, documents are processed in chunks: the documents of each input file needed for a
+        chunk are fetched with a single read, and the shuffled order is then restored in memory.
 
         Documents are typically shuffled inside each separate files during the first step. In this second step, we shuffle
         again the order of the documents.
 
+        This step can be run with several tasks: each one computes the same global ordering (a `seed` is then required
+        when shuffling) and writes a subset of the output files (file i is written by rank i % world_size), so that the
+        number of output files, which depends on `max_tokens_per_file`, should be at least the number of tasks.
+
     Args:
         input_folder (DataFolderLike): the input folder containing the tokenized documents
         output_folder (DataFolderLike): the output folder where to save the merged tokenized documents
@@ -62,6 +75,7 @@ class DocumentTokenizerMerger(PipelineStep):
         self.max_tokens = max_tokens
         self.shuffle = shuffle
         self.save_loss_metadata = save_loss_metadata
+        self.seed = seed
         self.rand = default_rng(seed)
         self.save_final_metadata = save_final_metadata
         self.upload_block_size = upload_block_size
@@ -79,71 +93,136 @@ class DocumentTokenizerMerger(PipelineStep):
         doc_ids = np.concatenate([np.ones(len(doc_ends), dtype=int) * i for i, doc_ends in enumerate(all_doc_ends)])
         return doc_ids if not self.shuffle else self.rand.permutation(doc_ids)
 
-    def run(self, data: DocumentsPipeline = None, rank: int = 0, world_size: int = 1) -> DocumentsPipeline:
-        """Main method to run the merging of files.
-            The world_size must be 1 for this pipeline step merging the results of the previous parallel step.
+    def get_input_files(self, input_folder: DataFolder) -> list[str]:
+        """List the tokenized files of `input_folder` and check that their index (and loss) files are present.
 
         Args:
-            data: DocumentsPipeline
-                The data to be processed as a Generator typically created by a Reader initial pipeline step
-            rank: int
-                The rank of the process
-            world_size: int
-                The total number of processes
+            input_folder: DataFolder
+                The folder containing the tokenized documents
+
+        Returns:
+            list[str]
+                The tokenized files (.ds)
         """
-        assert world_size == 1, "world_size must be 1 for DocumentTokenizerMerger"
-        datafiles = self.input_folder.list_files(glob_pattern="*.ds")
-        datafiles_index = self.input_folder.list_files(glob_pattern="*.ds.index")
+        datafiles = input_folder.list_files(glob_pattern="*.ds")
+        datafiles_index = input_folder.list_files(glob_pattern="*.ds.index")
         datafiles_loss = (
-            self.input_folder.list_files(glob_pattern="*.ds.loss")
-            if self.save_loss_metadata
-            else ([None] * len(datafiles))
+            input_folder.list_files(glob_pattern="*.ds.loss") if self.save_loss_metadata else ([None] * len(datafiles))
         )
         assert len(datafiles) == len(datafiles_index) == len(datafiles_loss), (
             f"Mismatch between number of .ds, "
             ".ds.index and/or .ds.loss files"
             f"({len(datafiles)} vs {len(datafiles_index)} vs {len(datafiles_loss)})"
         )
+        return datafiles
+
+    def get_tokenizer_metadata(self, input_folder: DataFolder, datafile: str) -> tuple[str | None, int]:
+        """Read the tokenizer name and the token size from the metadata file of `datafile`, if present.
 
+        Args:
+            input_folder: DataFolder
+                The folder containing `datafile`
+            datafile: str
+                A tokenized file
+
+        Returns:
+            tuple[str | None, int]
+                The tokenizer name or path and the size of each token, in bytes
+        """
         tokenizer_name_or_path, token_size = None, 2
         if self.save_final_metadata:
-            if self.input_folder.isfile(f"{datafiles[0]}.metadata"):
-                with self.input_folder.open(f"{datafiles[0]}.metadata", "rt") as f:
+            if input_folder.isfile(f"{datafile}.metadata"):
+                with input_folder.open(f"{datafile}.metadata", "rt") as f:
                     tokenizer_name_or_path = f.read().splitlines()[0]
                     if "|" in tokenizer_name_or_path:
                         tokenizer_name_or_path, token_size = tokenizer_name_or_path.split("|")
                         token_size = int(token_size)
+        return tokenizer_name_or_path, token_size
 
-        doc_ends = [load_doc_ends(self.input_folder.open(file, "rb")) for file in datafiles_index]
-        token_inputs = list(
-            map(partial(get_data_reader, nb_bytes=token_size), self.input_folder.open_files(datafiles), doc_ends)
-        )
-        loss_inputs = (
-            list(map(partial(get_data_reader, nb_bytes=1), self.input_folder.open_files(datafiles_loss), doc_ends))
-            if self.save_loss_metadata
-            else None
-        )
+    def get_documents(self) -> tuple[list[tuple[DataFolder, str]], np.ndarray, np.ndarray, np.ndarray]:
+        """Select the documents to write, in their final order.
 
+        Returns:
+            tuple[list[tuple[DataFolder, str]], np.ndarray, np.ndarray, np.ndarray]
+                The input files (folder and path) and, for each document to write: its input file, start and end
+                (in tokens)
+        """
+        datafiles = self.get_input_files(self.input_folder)
+        doc_ends = [load_doc_ends(self.input_folder.open(f"{file}.index", "rb")) for file in datafiles]
         ordering = self.get_ordering(doc_ends)
-
-        file_ct = 0
-        output_file = TokenizedFile(
-            output_folder=self.output_folder,
-            filename=f"{file_ct:03d}_{self.save_filename}.ds",
-            save_loss_metadata=self.save_loss_metadata,
-            upload_block_size=self.upload_block_size,
-            tokenizer_name_or_path=tokenizer_name_or_path,
-            save_final_metadata=self.save_final_metadata,
-            token_size=token_size,
+        # the documents of each file are taken in order
+        # (group the positions by file, and number them within each group)
+        counts = np.bincount(ordering, minlength=len(doc_ends))
+        doc_ids = np.empty_like(ordering)
+        doc_ids[np.argsort(ordering, kind="stable")] = np.arange(len(ordering)) - np.repeat(
+            np.cumsum(counts) - counts, counts
         )
-        for input_file_id in tqdm(
-            ordering, desc="Merging documents", unit="documents", total=len(ordering), disable=not self.progress
+        starts, ends = get_document_bounds(doc_ends, ordering, doc_ids)
+
+        # stop once max_tokens is reached
+        nb_docs = len(ordering)
+        if self.max_tokens > 0:
+            lengths = ends - starts
+            nb_docs = int(np.searchsorted(np.cumsum(lengths) - lengths, self.max_tokens, side="left"))
+        return [(self.input_folder, file) for file in datafiles], ordering[:nb_docs], starts[:nb_docs], ends[:nb_docs]
+
+    def run(self, data: DocumentsPipeline = None, rank: int = 0, world_size: int = 1) -> DocumentsPipeline:
+        """Main method to run the merging of files.
+            All ranks compute the same ordering and each one writes the output files i such that i % world_size == rank.
+
+        Args:
+            data: DocumentsPipeline
+                The data to be processed as a Generator typically created by a Reader initial pipeline step
+            rank: int
+                The rank of the process
+            world_size: int
+                The total number of processes
+        """
+        if world_size > 1 and self.shuffle and self.seed is None:
+            raise ValueError(
+                "A seed is required to shuffle with more than one task, so that all ranks agree on the order"
+            )
+        input_files, file_ids, starts, ends = self.get_documents()
+        tokenizer_name_or_path, token_size = self.get_tokenizer_metadata(*input_files[0])
+        lengths = ends - starts
+
+        # split into several files: a new one is started once max_tokens_per_file is reached
+        splits, file_tokens = [0], 0
+        for i, length in enumerate(lengths.tolist()):
+            if 0 < self.max_tokens_per_file <= file_tokens:
+                splits.append(i)
+                file_tokens = 0
+            file_tokens += length
+        splits.append(len(lengths))
+        # the output files written by this rank
+        file_cts = list(range(rank, len(splits) - 1, world_size))
+        if not file_cts:
+            logger.warning(f"No output file to write for rank {rank} ({len(splits) - 1} files in total).")
+            return
+
+        with (
+            ExitStack() as stack,
+            tqdm(
+                desc="Merging documents",
+                unit="documents",
+                total=sum(splits[file_ct + 1] - splits[file_ct] for file_ct in file_cts),
+                disable=not self.progress,
+            ) as pbar,
         ):
-            if 0 < self.max_tokens <= self.stats["tokens"].total:
-                break
-            if 0 < self.max_tokens_per_file <= len(output_file):
-                output_file.close()
-                file_ct += 1
+            token_inputs = [
+                stack.enter_context(folder.open(file, "rb", cache_type=SHUFFLING_CACHE_TYPE))
+                for folder, file in input_files
+            ]
+            loss_inputs = (
+                [
+                    stack.enter_context(folder.open(f"{file}.loss", "rb", cache_type=SHUFFLING_CACHE_TYPE))
+                    for folder, file in input_files
+                ]
+                if self.save_loss_metadata
+                else None
+            )
+            for file_ct in file_cts:
+                split_start, split_end = splits[file_ct], splits[file_ct + 1]
                 output_file = TokenizedFile(
                     output_folder=self.output_folder,
                     filename=f"{file_ct:03d}_{self.save_filename}.ds",
@@ -153,17 +232,23 @@ class DocumentTokenizerMerger(PipelineStep):
                     save_final_metadata=self.save_final_metadata,
                     token_size=token_size,
                 )
-            # copy tokens and loss
-            tokens = next(token_inputs[input_file_id])
-            output_file.write_bytes(tokens)
-            if loss_inputs:
-                output_file.write_loss_bytes(next(loss_inputs[input_file_id]))
-            self.stat_update("tokens", value=len(tokens) // token_size)
-        # cleanup
-        output_file.close()
-        if self.save_final_metadata:
+                split_args = (
+                    file_ids[split_start:split_end],
+                    starts[split_start:split_end],
+                    ends[split_start:split_end],
+                )
+                # copy tokens and loss
+                for tokens, chunk_doc_ends in read_documents(token_inputs, *split_args, item_size=token_size):
+                    output_file.write_bytes(tokens, chunk_doc_ends)
+                    pbar.update(len(chunk_doc_ends))
+                if loss_inputs:
+                    for loss_values, _ in read_documents(loss_inputs, *split_args):
+                        output_file.write_loss_bytes(loss_values)
+                output_file.close()
+                self.stats["tokens"] += MetricStats.from_values(lengths[split_start:split_end])
+        if self.save_final_metadata and rank == 0:
             # save final total metadata file
-            output_file.write_final_metadata(self.stats["tokens"].total, filename=f"{self.save_filename}.ds")
+            output_file.write_final_metadata(int(lengths.sum()), filename=f"{self.save_filename}.ds")
 
 
 def load_doc_ends(file: BinaryIO) -> np.ndarray:
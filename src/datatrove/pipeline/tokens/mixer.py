@@ -0,0 +1,170 @@
+import numpy as np
+
+from datatrove.io import DataFolder, DataFolderLike, get_datafolder
+from datatrove.pipeline.tokens.merger import DocumentTokenizerMerger, load_doc_ends
+from datatrove.pipeline.tokens.tokenizer import get_document_bounds
+from datatrove.utils.logging import logger
+
+
+class DocumentTokenizerMixer(DocumentTokenizerMerger):
+    """Mix several tokenized datasets into a sequence of files, with an exact number of tokens taken from each source.
+        Each input folder is the output of a DocumentTokenizer (or DocumentTokenizerMerger) step. Documents are copied
+        directly from the tokenized files, so changing the mixture does not require tokenizing the sources again.
+
+        The number of tokens taken from each source follows `weights`. Sources can be upsampled: their documents are
+        then repeated, up to `epochs` times (each repetition in a new random order when shuffling). To get an exact
+        number of tokens, the last document taken from each source is cropped. The documents of all sources are then
+        shuffled together (or written source after source if shuffle=False).
+
+        Like DocumentTokenizerMerger, this step can be run with several tasks, each one writing a subset of the output files.
+
+    Args:
+        input_folders (list[DataFolderLike]): the input folders, one per source
+        output_folder (DataFolderLike): the output folder where to save the mixed tokenized documents
+        save_filename (str): the filename to use for the mixed tokenized documents
+        weights (list[float] | None): the share of tokens of each source. Default: the size of each source (times its epochs)
+        epochs (list[float] | None): the maximum number of passes over each source. Default: 1 for every source
+        max_tokens (int): the total number of tokens of the mixture. Default: -1, the largest mixture with the given
+            weights that does not exceed the epochs of any source
+        max_tokens_per_file (int): the maximum number of tokens per file. Default: 100GT
+        shuffle (bool): whether to shuffle the documents of the mixture. Default: True
+        upload_block_size (int): the upload block size to use when saving the tokenized files (used in fsspec with remote filesystems).
+            Default: 20MB
+        seed (int): the seed to use for the random number generator. Default: None
+        save_loss_metadata (bool): whether to save the loss metadata. Default: False
+        save_final_metadata (bool): whether to save the final metadata. Default: True
+    """
+
+    name = "🍹 Document Mixer"
+    type = "🔢 - TOKENIZER"
+
+    def __init__(
+        self,
+        input_folders: list[DataFolderLike],
+        output_folder: DataFolderLike,
+        save_filename: str,
+        weights: list[float] | None = None,
+        epochs: list[float] | None = None,
+        max_tokens: int = -1,  # total number of tokens of the mixture
+        max_tokens_per_file: int = 100e9,  # max number of tokens per file. default: 100GT
+        shuffle: bool = True,  # whether to shuffle documents in the mixture
+        upload_block_size: int = 20 * 2**20,  # 20MB
+        seed: int = None,
+        save_loss_metadata: bool = False,
+        save_final_metadata: bool = True,
+        progress: bool = True,
+    ):
+        self.input_folders = [get_datafolder(input_folder) for input_folder in input_folders]
+        super().__init__(
+            self.input_folders[0],
+            output_folder,
+            save_filename,
+            max_tokens_per_file=max_tokens_per_file,
+            max_tokens=max_tokens,
+            shuffle=shuffle,
+            upload_block_size=upload_block_size,
+            seed=seed,
+            save_loss_metadata=save_loss_metadata,
+            save_final_metadata=save_final_metadata,
+            progress=progress,
+        )
+        if weights is not None and len(weights) != len(self.input_folders):
+            raise ValueError(f"Expected {len(self.input_folders)} weights, got {len(weights)}")
+        if epochs is not None and len(epochs) != len(self.input_folders):
+            raise ValueError(f"Expected {len(self.input_folders)} epochs, got {len(epochs)}")
+        self.weights = weights
+        self.epochs = epochs
+
+    def get_budgets(self, sizes: np.ndarray) -> np.ndarray:
+        """Get the number of tokens to take from each source.
+
+        Args:
+            sizes: np.ndarray
+                The number of tokens of each source
+
+        Returns:
+            np.ndarray
+                The number of tokens to take from each source
+        """
+        epochs = np.ones(len(sizes)) if self.epochs is None else np.asarray(self.epochs, dtype=np.float64)
+        available = np.floor(sizes * epochs).astype(np.int64)
+        weights = available.astype(np.float64) if self.weights is None else np.asarray(self.weights, dtype=np.float64)
+        shares = weights / weights.sum()
+        if self.max_tokens > 0:
+            total = self.max_tokens
+        else:
+            # the largest mixture that does not take more than the available tokens of any source
+            total = min(available[i] / shares[i] for i in range(len(shares)) if shares[i] > 0)
+        budgets = total * shares
+        rounded_budgets = np.floor(budgets).astype(np.int64)
+        if self.max_tokens > 0:
+            # distribute the rounding remainder so that the total is exact
+            remainder = self.max_tokens - rounded_budgets.sum()
+            rounded_budgets[np.argsort(rounded_budgets - budgets, kind="stable")[:remainder]] += 1
+            if np.any(rounded_budgets > available):
+                raise ValueError(
+                    f"Not enough tokens for a mixture of {self.max_tokens} tokens: sources have {available.tolist()} "
+                    f"tokens available (with their epochs) and would need {rounded_budgets.tolist()}. "
+                    f"Increase their epochs or reduce max_tokens."
+                )
+        return np.minimum(rounded_budgets, available)
+
+    def get_documents(self) -> tuple[list[tuple[DataFolder, str]], np.ndarray, np.ndarray, np.ndarray]:
+        """Select the documents of each source up to its budget, and shuffle them together.
+
+        Returns:
+            tuple[list[tuple[DataFolder, str]], np.ndarray, np.ndarray, np.ndarray]
+                The input files (folder and path) and, for each document to write: its input file, start and end
+                (in tokens)
+        """
+        input_files, sources = [], []
+        token_size = None
+        for input_folder in self.input_folders:
+            datafiles = self.get_input_files(input_folder)
+            if not datafiles:
+                raise ValueError(f"No tokenized files found in {input_folder.path}")
+            source_token_size = self.get_tokenizer_metadata(input_folder, datafiles[0])[1]
+            if token_size is not None and source_token_size != token_size:
+                raise ValueError(f"Token size of {input_folder.path} ({source_token_size}) differs from {token_size}")
+            token_size = source_token_size
+            doc_ends = [load_doc_ends(input_folder.open(f"{file}.index", "rb")) for file in datafiles]
+            # all the documents of this source, in file order
+            file_ids = np.repeat(np.arange(len(doc_ends)), [len(file_doc_ends) for file_doc_ends in doc_ends])
+            doc_ids = np.concatenate([np.arange(len(file_doc_ends)) for file_doc_ends in doc_ends])
+            starts, ends = get_document_bounds(doc_ends, file_ids, doc_ids)
+            sources.append((file_ids + len(input_files), starts, ends))
+            input_files.extend((input_folder, file) for file in datafiles)
+
+        sizes = np.array([(ends - starts).sum() for _, starts, ends in sources], dtype=np.int64)
+        budgets = self.get_budgets(sizes)
+        all_file_ids, all_starts, all_ends = [], [], []
+        for input_folder, (file_ids, starts, ends), size, budget in zip(self.input_folders, sources, sizes, budgets):
+            logger.info(f"Taking {budget} tokens ({budget / max(size, 1):.2f} epochs) from {input_folder.path}")
+            if budget == 0:
+                continue
+            # repeat the documents (in a new order for each pass) until the budget is reached
+            nb_epochs = -(-budget // size)
+            order = np.concatenate(
+                [
+                    self.rand.permutation(len(starts)) if self.shuffle else np.arange(len(starts))
+                    for _ in range(nb_epochs)
+                ]
+            )
+            lengths = ends[order] - starts[order]
+            nb_docs = int(np.searchsorted(np.cumsum(lengths), budget, side="left")) + 1
+            order = order[:nb_docs]
+            source_ends = ends[order]
+            # crop the last document to take exactly `budget` tokens
+            source_ends[-1] -= lengths[:nb_docs].sum() - budget
+            all_file_ids.append(file_ids[order])
+            all_starts.append(starts[order])
+            all_ends.append(source_ends)
+
+        file_ids, starts, ends = (
+            np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+            for arrays in (all_file_ids, all_starts, all_ends)
+        )
+        if self.shuffle:
+            ordering = self.rand.permutation(len(file_ids))
+            file_ids, starts, ends = file_ids[ordering], starts[ordering], ends[ordering]
+        return input_files, file_ids, starts, ends
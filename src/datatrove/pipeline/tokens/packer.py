@@ -0,0 +1,208 @@
+import io
+
+import numpy as np
+from numpy.random import default_rng
+
+from datatrove.data import DocumentsPipeline
+from datatrove.io import DataFolderLike, get_datafolder
+from datatrove.pipeline.base import PipelineStep
+from datatrove.pipeline.tokens.merger import load_doc_ends
+from datatrove.pipeline.tokens.tokenizer import SHUFFLING_CACHE_TYPE, TokenizedFile, read_documents
+from datatrove.utils.logging import logger
+
+
+def best_fit_decreasing(lengths: np.ndarray, capacity: int) -> np.ndarray:
+    """Pack items into bins of a given capacity: items are taken from the longest to the shortest and each one is
+        put in the open bin with the least remaining space that can still hold it (or in a new bin).
+
+    Args:
+        lengths (np.ndarray): the length of each item. Must not exceed `capacity`
+        capacity (int): the capacity of each bin
+
+    Returns:
+        np.ndarray: the bin of each item. Bins are numbered in order of creation
+    """
+    bin_ids = np.empty(len(lengths), dtype=np.int64)
+    # open bins by remaining space, and a fenwick tree on their counts to find the best fit in O(log(capacity))
+    bins_by_space = [[] for _ in range(capacity + 1)]
+    tree = [0] * (capacity + 1)
+    top_bit = 1 << capacity.bit_length()
+
+    def update(space: int, delta: int):
+        while space <= capacity:
+            tree[space] += delta
+            space += space & -space
+
+    def prefix_count(space: int) -> int:
+        count = 0
+        while space > 0:
+            count += tree[space]
+            space -= space & -space
+        return count
+
+    def smallest_space_above(count: int) -> int:
+        # smallest space s such that prefix_count(s) > count
+        space, step = 0, top_bit
+        while step:
+            if space + step <= capacity and tree[space + step] <= count:
+                space += step
+                count -= tree[space]
+            step >>= 1
+        return space + 1
+
+    nb_bins = 0
+    for item in np.argsort(-lengths, kind="stable").tolist():
+        length = int(lengths[item])
+        space = smallest_space_above(prefix_count(length - 1)) if length > 0 else capacity + 1
+        if space > capacity:
+            # no open bin can hold this item
+            bin_id, space = nb_bins, capacity
+            nb_bins += 1
+        else:
+            bin_id = bins_by_space[space].pop()
+            update(space, -1)
+        bin_ids[item] = bin_id
+        space -= length
+        if space > 0:
+            bins_by_space[space].append(bin_id)
+            update(space, 1)
+    return bin_ids
+
+
+class DocumentTokenizerPacker(PipelineStep):
+    """Packs the documents of each .ds file into sequences of exactly `sequence_length` tokens.
+        Documents that fit in a sequence are never cut: they are arranged with a best-fit decreasing bin packer and the
+        remaining space of each sequence is filled with `pad_token_id` (with a loss of 0 when loss metadata is saved).
+        Longer documents are split into full sequences, and their last part is packed with the other documents.
+
+        The index (.ds.index) of each packed file lists the document boundaries inside each sequence: every sequence
+        ends on a document boundary, and its padding is counted as part of its last document. Sequence i spans tokens
+        [i * sequence_length, (i + 1) * sequence_length), so that data loaders can read whole sequences without
+        runtime packing, and mask attention across documents if needed.
+
+    Args:
+        input_folder: the input folder to read the tokenized documents from
+        output_folder: the output folder to write the packed documents to
+        sequence_length: the number of tokens of each sequence (default: 2048 + 1)
+        pad_token_id: the token used to fill the end of the sequences. Using the EOS token keeps the dataset checkable
+            by `check_dataset` (default: 0)
+        shuffle: whether to shuffle the order of the sequences (default: True)
+        seed: the seed for the random number generator (default: None)
+        save_loss_metadata: whether to also pack the loss metadata (default: False)
+        token_size (int): size of each token, in bytes
+    """
+
+    name = "📦 Sequence Packer"
+    type = "🔢 - TOKENIZER"
+
+    def __init__(
+        self,
+        input_folder: DataFolderLike,
+        output_folder: DataFolderLike,
+        sequence_length: int = 2048 + 1,
+        pad_token_id: int = 0,
+        shuffle: bool = True,
+        seed: int = None,
+        save_loss_metadata: bool = False,
+        token_size: int = 2,
+    ):
+        super().__init__()
+        self.input_folder = get_datafolder(input_folder)
+        self.output_folder = get_datafolder(output_folder)
+        self.sequence_length = sequence_length
+        self.pad_token_id = pad_token_id
+        self.shuffle = shuffle
+        self.save_loss_metadata = save_loss_metadata
+        self.token_size = token_size
+        self.rand = default_rng(seed)
+
+    def pack(self, doc_ends: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Arrange the documents of a file into sequences.
+
+        Args:
+            doc_ends (np.ndarray): the document ends of the file
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: the start and end (in tokens) of the document parts in their packed
+                order, and whether each one is the padding at the end of a sequence (in which case its start and end
+                are 0 and the padding length)
+        """
+        doc_starts = np.concatenate(([0], doc_ends))[:-1]
+        lengths = doc_ends - doc_starts
+        # split the longer documents: full sequences, and a shorter last part
+        nb_full = lengths // self.sequence_length
+        full_starts = np.repeat(doc_starts, nb_full) + self.sequence_length * (
+            np.arange(nb_full.sum()) - np.repeat(np.cumsum(nb_full) - nb_full, nb_full)
+        )
+        has_rest = lengths % self.sequence_length > 0
+        rest_starts, rest_ends = (doc_starts + nb_full * self.sequence_length)[has_rest], doc_ends[has_rest]
+
+        bin_ids = best_fit_decreasing(rest_ends - rest_starts, self.sequence_length)
+        nb_bins = int(bin_ids.max()) + 1 if len(bin_ids) else 0
+        padding = self.sequence_length - np.bincount(
+            bin_ids, weights=rest_ends - rest_starts, minlength=nb_bins
+        ).astype(np.int64)
+        padded_bins = np.flatnonzero(padding)
+
+        # all the parts: full sequences, packed documents and the padding at the end of packed sequences
+        nb_sequences = len(full_starts) + nb_bins
+        sequence_ids = np.concatenate(
+            (np.arange(len(full_starts)), len(full_starts) + bin_ids, len(full_starts) + padded_bins)
+        )
+        starts = np.concatenate((full_starts, rest_starts, np.zeros(len(padded_bins), dtype=np.int64)))
+        ends = np.concatenate((full_starts + self.sequence_length, rest_ends, padding[padded_bins]))
+        is_padding = np.arange(len(starts)) >= len(starts) - len(padded_bins)
+        sequence_positions = self.rand.permutation(nb_sequences) if self.shuffle else np.arange(nb_sequences)
+        # documents of each sequence are kept in their original order, followed by the padding
+        order = np.lexsort((is_padding, sequence_positions[sequence_ids]))
+
+        self.stat_update("split_documents", value=int(np.count_nonzero(nb_full)))
+        self.stat_update("sequences", value=nb_sequences)
+        self.stat_update("padding_tokens", value=int(padding.sum()))
+        return starts[order], ends[order], is_padding[order]
+
+    def run(self, data: DocumentsPipeline = None, rank: int = 0, world_size: int = 1) -> DocumentsPipeline:
+        """
+
+        Args:
+          data: DocumentsPipeline:  (Default value = None)
+          rank: int:  (Default value = 0)
+          world_size: int:  (Default value = 1)
+
+        Returns:
+
+        """
+        datafiles = self.input_folder.get_shard(rank, world_size, glob_pattern="*.ds")
+        for datafile in datafiles:
+            logger.info(f"Packing {datafile} into sequences of {self.sequence_length} tokens")
+            with self.track_time():
+                doc_ends = load_doc_ends(self.input_folder.open(f"{datafile}.index", "rb"))
+                starts, ends, is_padding = self.pack(doc_ends)
+                # padding is read from a second, in memory, "file"
+                file_ids = is_padding.astype(np.int64)
+                # the padding is part of the last document of each sequence
+                keep_end = np.append(~is_padding[1:], True)
+                output_file = TokenizedFile(
+                    self.output_folder,
+                    datafile,
+                    save_loss_metadata=self.save_loss_metadata,
+                    token_size=self.token_size,
+                )
+                token_dtype = np.dtype("<u4" if self.token_size == 4 else "<u2")
+                with self.input_folder.open(datafile, "rb", cache_type=SHUFFLING_CACHE_TYPE) as f:
+                    padding = io.BytesIO(np.full(self.sequence_length, self.pad_token_id, dtype=token_dtype).tobytes())
+                    nb_parts = 0
+                    for tokens, chunk_doc_ends in read_documents(
+                        [f, padding], file_ids, starts, ends, item_size=self.token_size
+                    ):
+                        output_file.write_bytes(
+                            tokens, chunk_doc_ends[keep_end[nb_parts : nb_parts + len(chunk_doc_ends)]]
+                        )
+                        nb_parts += len(chunk_doc_ends)
+                if self.save_loss_metadata:
+                    with self.input_folder.open(f"{datafile}.loss", "rb", cache_type=SHUFFLING_CACHE_TYPE) as f:
+                        padding = io.BytesIO(bytes(self.sequence_length))
+                        for loss_values, _ in read_documents([f, padding], file_ids, starts, ends):
+                            output_file.write_loss_bytes(loss_values)
+                output_file.close()
+            self.stat_update("tokens", value=len(output_file))
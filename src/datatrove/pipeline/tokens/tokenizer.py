@@ -1,5 +1,8 @@
-import struct
-from typing import TYPE_CHECKING
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import TYPE_CHECKING, BinaryIO, Callable, Generator, Iterator
 
 import humanize
 import numpy as np
@@ -7,14 +10,18 @@ from numpy.random import default_rng
 
 from datatrove.data import Document, DocumentsPipeline
 from datatrove.io import DataFolder, DataFolderLike, get_datafolder
+from datatrove.utils.background import BackgroundWorker
 from datatrove.utils.batching import batched
 from datatrove.utils.logging import logger
 from datatrove.utils.tokenization import PipelineStepWithTokenizer
 
 
-SHUFFLING_READ_BLOCK_SIZE = 50000  # read 50kb at a time only (~mean + 2sigmas for final filtered common crawl docs)
-# at a time to avoid reading a lot of data into cache and then not using it when jumping again
-SHUFFLING_CACHE_TYPE = "none"  # do not cache as we are only jumping around and not reading sequentially
+SHUFFLING_CHUNK_SIZE = 256 * 2**20  # the shuffled order is restored in memory, in chunks of (up to) 256MB
+SHUFFLING_MAX_READ_GAP = 2**20  # documents less than 1MB apart are fetched with a single read
+SHUFFLING_CACHE_TYPE = "none"  # do not cache as each read is already large and only done once
+
+# whether a batch was encoded in this process: the tokenizers thread pool is then running and its size is fixed
+_batch_encoded_in_process = False
 
 if TYPE_CHECKING:
     from tokenizers import Encoding
@@ -54,7 +61,10 @@ class TokenizedFile:
         self.write_idx = 0
         self.token_size = token_size
         self.token_format = "I" if self.token_size == 4 else "H"
-        self.doc_ends = []
+        self.token_dtype = np.dtype("<u4" if self.token_size == 4 else "<u2")
+        # document ends (in tokens). Grown by doubling its capacity, only the first `_nb_docs` entries are valid
+        self._doc_ends = np.empty(1024, dtype=np.int64)
+        self._nb_docs = 0
         self.tokenizer_name_or_path = tokenizer_name_or_path
         self.save_final_metadata = save_final_metadata
 
@@ -63,8 +73,27 @@ class TokenizedFile:
         if self.save_loss_metadata:
             self.loss_file = self.output_folder.open(f"{self.filename}.loss", mode="wb", block_size=upload_block_size)
 
+    @property
+    def doc_ends(self) -> np.ndarray:
+        """Document ends (in tokens) of the documents written so far."""
+        return self._doc_ends[: self._nb_docs]
+
+    def _add_doc_ends(self, doc_ends: np.ndarray):
+        """Append document ends to the index, growing its buffer if needed.
+
+        Args:
+            doc_ends (np.ndarray): absolute document ends (in tokens)
+        """
+        new_nb_docs = self._nb_docs + len(doc_ends)
+        if new_nb_docs > len(self._doc_ends):
+            new_doc_ends = np.empty(max(new_nb_docs, 2 * len(self._doc_ends)), dtype=np.int64)
+            new_doc_ends[: self._nb_docs] = self.doc_ends
+            self._doc_ends = new_doc_ends
+        self._doc_ends[self._nb_docs : new_nb_docs] = doc_ends
+        self._nb_docs = new_nb_docs
+
     def __len__(self):
-        return self.doc_ends[-1] if self.doc_ends else 0
+        return int(self.doc_ends[-1]) if self._nb_docs else 0
 
     def close(self):
         """Close the files and save the index."""
@@ -78,7 +107,7 @@ class TokenizedFile:
             # save total number of documents
             # index_file.file_handler.write(struct.pack('<I', len(self.doc_ends)))
             # save document boundaries - uint64
-            index_file.write(struct.pack("<%sQ" % len(self.doc_ends), *self.doc_ends))
+            index_file.write(self.doc_ends.astype("<u8").tobytes())
             index_file.close()
 
         if self.save_final_metadata:
@@ -86,32 +115,33 @@ class TokenizedFile:
 
     def cleanup(self):
         """Remove the files and the index."""
-        self.doc_ends = []
+        self._nb_docs = 0
         self.output_folder.rm_file(self.filename)
         if self.loss_file:
             self.output_folder.rm_file(f"{self.filename}.loss")
         if self.save_final_metadata and self.output_folder.exists(f"{self.filename}.metadata"):
             self.output_folder.rm_file(f"{self.filename}.metadata")
 
-    def write_bytes(self, tk_bytes: bytes, doc_ends: list[int] = None):
+    def write_bytes(self, tk_bytes: bytes, doc_ends: list[int] | np.ndarray = None):
         """Write tk_bytes to the tokens file and update the document boundaries with a new document end (in tokens).
 
         Args:
           tk_bytes: bytes:
-          doc_ends: list[int]  (Default value = None): optional list of document ends (in tokens) if writing several documents at once
+          doc_ends: list[int] | np.ndarray  (Default value = None): optional list of document ends (in tokens, relative to
+            the start of tk_bytes) if writing several documents at once
 
         Returns:
         """
         self.tokens_file.write(tk_bytes)
         if doc_ends is not None:
             # We've written several documents at once
-            self.doc_ends.extend([d + self.write_idx for d in doc_ends])
+            self._add_doc_ends(np.asarray(doc_ends, dtype=np.int64) + self.write_idx)
             self.write_idx += len(tk_bytes) // self.token_size
         else:
             # We've written a single document
             self.write_idx += len(tk_bytes) // self.token_size
             # save each document's boundary
-            self.doc_ends.append(self.write_idx)
+            self._add_doc_ends((self.write_idx,))
 
     def write_loss_bytes(self, l_bytes: bytes):
         """Write loss mask to the loss file.
@@ -133,9 +163,25 @@ class TokenizedFile:
             loss_values (np.ndarray | None): optional loss values to write
         """
         # get the bytes
-        self.write_bytes(struct.pack(f"<%s{self.token_format}" % len(tokens), *tokens))
+        self.write_bytes(np.asarray(tokens, dtype=self.token_dtype).tobytes())
+        if loss_values is not None:
+            self.write_loss_bytes(np.asarray(loss_values, dtype=bool).tobytes())
+
+    def write_batch(self, tokens: list[list[int]], loss_values: list[np.ndarray] | None = None):
+        """Write several documents at once: their tokens are packed into a single preallocated array and written
+            with a single call.
+
+        Args:
+            tokens (list[list[int]]): the tokens of each document
+            loss_values (list[np.ndarray] | None): optional loss values of each document
+        """
+        if not tokens:
+            return
+        doc_ends = np.cumsum([len(doc_tokens) for doc_tokens in tokens], dtype=np.int64)
+        tokens_array = np.fromiter(chain.from_iterable(tokens), dtype=self.token_dtype, count=int(doc_ends[-1]))
+        self.write_bytes(tokens_array.tobytes(), doc_ends=doc_ends)
         if loss_values is not None:
-            self.write_loss_bytes(struct.pack("<%s?" % len(loss_values), *loss_values))
+            self.write_loss_bytes(np.concatenate(loss_values, dtype=bool, casting="unsafe").tobytes())
 
     def copy(
         self,
@@ -156,64 +202,50 @@ class TokenizedFile:
         Returns:
             TokenizedFile: the new tokenized file
         """
+        ordering = np.asarray(ordering, dtype=np.int64)
+        starts, ends = get_document_bounds([self.doc_ends], np.zeros_like(ordering), ordering)
+        # split into several files: a new one is started when max_tokens_per_file is exceeded
+        splits, total_tokens_written = [0], 0
+        for i, length in enumerate((ends - starts).tolist()):
+            total_tokens_written += length
+            if max_tokens_per_file and total_tokens_written > max_tokens_per_file:
+                splits.append(i + 1)
+                total_tokens_written = 0
+        splits.append(len(ordering))
+
         # open original file in read mode
-        with self.output_folder.open(
-            self.filename, mode="rb", cache_type=SHUFFLING_CACHE_TYPE, block_size=SHUFFLING_READ_BLOCK_SIZE
-        ) as tokens_file:
+        with self.output_folder.open(self.filename, mode="rb", cache_type=SHUFFLING_CACHE_TYPE) as tokens_file:
             loss_file = (
                 None
                 if not self.loss_file
-                else self.output_folder.open(
-                    f"{self.filename}.loss",
-                    mode="rb",
-                    cache_type=SHUFFLING_CACHE_TYPE,
-                    block_size=SHUFFLING_READ_BLOCK_SIZE // 2,  # this one is half the size
-                )
+                else self.output_folder.open(f"{self.filename}.loss", mode="rb", cache_type=SHUFFLING_CACHE_TYPE)
             )
-            sub_rank = 0
-            destination = get_output_filename(save_filename, rank, "shuffled", sub_rank)
-
-            new_file = TokenizedFile(
-                self.output_folder if not new_output_folder else new_output_folder,
-                destination,
-                save_loss_metadata=self.save_loss_metadata,
-                upload_block_size=self.upload_block_size,
-                tokenizer_name_or_path=self.tokenizer_name_or_path,
-                save_final_metadata=self.save_final_metadata,
-                token_size=self.token_size,
-            )
-            logger.info(f"Shuffling in {destination}...")
-            # shuffle doc_id
-            total_tokens_written = 0
-            for doc_id in ordering:
-                # get start and end from the boundaries
-                start, end = self.doc_ends[doc_id - 1] if doc_id > 0 else 0, self.doc_ends[doc_id]
+            for sub_rank, (split_start, split_end) in enumerate(zip(splits[:-1], splits[1:])):
+                destination = get_output_filename(save_filename, rank, "shuffled", sub_rank)
+                new_file = TokenizedFile(
+                    self.output_folder if not new_output_folder else new_output_folder,
+                    destination,
+                    save_loss_metadata=self.save_loss_metadata,
+                    upload_block_size=self.upload_block_size,
+                    tokenizer_name_or_path=self.tokenizer_name_or_path,
+                    save_final_metadata=self.save_final_metadata,
+                    token_size=self.token_size,
+                )
+                logger.info(f"Shuffling in {destination}...")
+                file_ids = np.zeros(split_end - split_start, dtype=np.int64)
+                split_starts, split_ends = starts[split_start:split_end], ends[split_start:split_end]
                 # copy the bytes. each token is token_size bytes
-                tokens_file.seek(start * self.token_size)
-                new_file.write_bytes(tokens_file.read((end - start) * self.token_size))
+                for tokens, doc_ends in read_documents(
+                    [tokens_file], file_ids, split_starts, split_ends, item_size=self.token_size
+                ):
+                    new_file.write_bytes(tokens, doc_ends)
                 # copy loss values (1 byte per token)
                 if loss_file:
-                    loss_file.seek(start)
-                    new_file.write_loss_bytes(loss_file.read(end - start))
-                total_tokens_written += end - start
-                if max_tokens_per_file and total_tokens_written > max_tokens_per_file:
-                    new_file.close()
-                    sub_rank += 1
-                    destination = get_output_filename(save_filename, rank, "shuffled", sub_rank)
-                    new_file = TokenizedFile(
-                        self.output_folder if not new_output_folder else new_output_folder,
-                        destination,
-                        save_loss_metadata=self.save_loss_metadata,
-                        upload_block_size=self.upload_block_size,
-                        tokenizer_name_or_path=self.tokenizer_name_or_path,
-                        save_final_metadata=self.save_final_metadata,
-                        token_size=self.token_size,
-                    )
-                    logger.info(f"Shuffling in {destination}...")
-                    total_tokens_written = 0
+                    for loss_values, _ in read_documents([loss_file], file_ids, split_starts, split_ends):
+                        new_file.write_loss_bytes(loss_values)
+                new_file.close()
             if loss_file:
                 loss_file.close()
-            new_file.close()
             return new_file
 
     def write_final_metadata(self, token_count: int = -1, filename: str = None):
@@ -243,6 +275,136 @@ class TokenizedFile:
             )
 
 
+def get_document_bounds(
+    doc_ends: list[np.ndarray], file_ids: np.ndarray, doc_ids: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Get the start and end (in tokens) of documents `doc_ids[i]` of files `file_ids[i]`.
+
+    Args:
+        doc_ends (list[np.ndarray]): the document ends of each file
+        file_ids (np.ndarray): the file of each document
+        doc_ids (np.ndarray): the index of each document in its file
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the starts and ends of the documents
+    """
+    # the document ends of all files, and the position of the first document of each file
+    all_doc_ends = np.concatenate([np.asarray(file_doc_ends, dtype=np.int64) for file_doc_ends in doc_ends] + [[0]])
+    file_offsets = np.cumsum([0] + [len(file_doc_ends) for file_doc_ends in doc_ends])
+    positions = file_offsets[np.asarray(file_ids, dtype=np.int64)] + doc_ids
+    ends = all_doc_ends[positions]
+    # the start of the first document of a file is 0 (the ends of the previous file are never used)
+    starts = np.where(doc_ids > 0, all_doc_ends[positions - 1], 0)
+    return starts, ends
+
+
+def read_documents(
+    files: list[BinaryIO],
+    file_ids: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    item_size: int = 1,
+    chunk_size: int = SHUFFLING_CHUNK_SIZE,
+    max_read_gap: int = SHUFFLING_MAX_READ_GAP,
+) -> Generator[tuple[bytes, np.ndarray], None, None]:
+    """Read the documents spanning `starts[i]:ends[i]` of `files[file_ids[i]]`, in this order.
+        Instead of a seek and a small read per document, documents are processed in chunks of (up to) `chunk_size`
+        bytes: the documents of each chunk are sorted by position, documents of the same file less than
+        `max_read_gap` bytes apart are fetched with a single read, and the requested order is then restored in memory.
+        Random access is thus turned into few, large and mostly sequential reads. The smallest gaps are merged first,
+        and at most as many gap bytes as requested bytes are read per chunk: each chunk reads (and buffers) at most
+        twice its size, however sparse its documents are. Local files are memory mapped instead: only the bytes of the
+        requested documents are then copied.
+
+    Args:
+        files (list[BinaryIO]): the (seekable) files to read from
+        file_ids (np.ndarray): the file of each document
+        starts (np.ndarray): the start of each document (in items)
+        ends (np.ndarray): the end of each document (in items)
+        item_size (int): the size of each item, in bytes
+        chunk_size (int): the maximum size of each chunk, in bytes. Chunks always contain at least one document
+        max_read_gap (int): documents separated by less than this number of bytes can be read together
+    Yields:
+        tuple[bytes, np.ndarray]: the data of each chunk and its document ends (in items, relative to the chunk)
+    """
+    mapped_files = [_mmap_file(file) for file in files]
+    views = [memoryview(mapped_file) if mapped_file is not None else None for mapped_file in mapped_files]
+    # no need to read the gaps between documents of memory mapped files
+    max_read_gaps = np.array([0 if view is not None else max_read_gap for view in views], dtype=np.int64)
+    try:
+        yield from _read_document_chunks(files, views, max_read_gaps, file_ids, starts, ends, item_size, chunk_size)
+    finally:
+        for view, mapped_file in zip(views, mapped_files):
+            if mapped_file is not None:
+                view.release()
+                mapped_file.close()
+
+
+def _mmap_file(file: BinaryIO) -> mmap.mmap | None:
+    """Memory map `file` if it is a (non-empty) local file, else return None."""
+    try:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _read_document_chunks(
+    files: list[BinaryIO],
+    views: list[memoryview | None],
+    max_read_gaps: np.ndarray,
+    file_ids: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    item_size: int,
+    chunk_size: int,
+) -> Generator[tuple[bytes, np.ndarray], None, None]:
+    lengths = ends - starts
+    chunk_ends = np.cumsum(lengths * item_size)
+    chunk_start = 0
+    while chunk_start < len(lengths):
+        offset = chunk_ends[chunk_start - 1] if chunk_start > 0 else 0
+        chunk_end = max(int(np.searchsorted(chunk_ends, offset + chunk_size, side="right")), chunk_start + 1)
+        c_file_ids = file_ids[chunk_start:chunk_end]
+        c_starts, c_ends = starts[chunk_start:chunk_end], ends[chunk_start:chunk_end]
+        chunk_start = chunk_end
+
+        c_lengths = c_ends - c_starts
+        # group the documents of each file that are close to each other into read windows
+        order = np.lexsort((c_starts, c_file_ids))
+        s_file_ids, s_starts, s_ends = c_file_ids[order], c_starts[order], c_ends[order]
+        gaps = (s_starts[1:] - s_ends[:-1]) * item_size
+        mergeable = np.flatnonzero((s_file_ids[1:] == s_file_ids[:-1]) & (gaps <= max_read_gaps[s_file_ids[1:]]))
+        # merge the smallest gaps first, reading at most as many gap bytes as requested bytes
+        mergeable = mergeable[np.argsort(gaps[mergeable], kind="stable")]
+        gap_bytes = np.cumsum(np.maximum(gaps[mergeable], 0))
+        new_window = np.ones(len(order), dtype=bool)
+        new_window[1:][mergeable[gap_bytes <= c_lengths.sum() * item_size]] = False
+        window_firsts = np.flatnonzero(new_window)
+        window_ids = np.cumsum(new_window) - 1
+        window_starts = s_starts[window_firsts]
+        window_ends = np.maximum.reduceat(s_ends, window_firsts)
+        window_offsets = np.cumsum(window_ends - window_starts) - (window_ends - window_starts)
+        buffer = memoryview(bytearray(int(window_offsets[-1] + window_ends[-1] - window_starts[-1]) * item_size))
+        for file_id, window_start, window_end, window_offset in zip(
+            s_file_ids[window_firsts].tolist(), window_starts.tolist(), window_ends.tolist(), window_offsets.tolist()
+        ):
+            nb_bytes = (window_end - window_start) * item_size
+            if views[file_id] is not None:
+                window_data = views[file_id][window_start * item_size : window_start * item_size + nb_bytes]
+            else:
+                files[file_id].seek(window_start * item_size)
+                window_data = files[file_id].read(nb_bytes)
+            buffer[window_offset * item_size : window_offset * item_size + nb_bytes] = window_data
+
+        # restore the requested order
+        positions = np.empty(len(order), dtype=np.int64)
+        positions[order] = window_offsets[window_ids] + s_starts - window_starts[window_ids]
+        data, write_pos = bytearray(int(c_lengths.sum()) * item_size), 0
+        for position, length in zip((positions * item_size).tolist(), (c_lengths * item_size).tolist()):
+            data[write_pos : write_pos + length] = buffer[position : position + length]
+            write_pos += length
+        yield data, np.cumsum(c_lengths)
+
+
 def get_output_filename(save_filename, rank: int, name: str, sub_rank: int = None):
     """Get an output filename for the rank and a sub-step name (unshuffled/shuffled)."""
     if sub_rank is not None:
@@ -271,6 +433,13 @@ class DocumentTokenizer(PipelineStepWithTokenizer):
         upload_block_size (int | None): the fsspec size of the upload block for remote filesystems (S3)
             You can set this if your s3 uploads are failing because of "Part number must be an integer between 1 and 10000, inclusive".
             Example: 20 * 2**20 (20MB)
+        pipelined (bool): overlap reading the next batch, encoding the current one (in a background thread) and writing
+            the previous one (in another background thread), instead of running these sequentially (default: False)
+        tokenizer_threads (int | None): number of threads used by the tokenizers library to encode each batch. Sets
+            RAYON_NUM_THREADS for the whole worker process, before the first batch is encoded. It can not take effect
+            (and a warning is logged) if the process already encoded a batch or RAYON_NUM_THREADS is already set to
+            another value: set RAYON_NUM_THREADS in the environment of the executor in that case. Match it to the
+            cpus given to each task. None to keep the library default (all available cores)
     """
 
     name = "✍️ Writer"
@@ -292,6 +461,8 @@ class DocumentTokenizer(PipelineStepWithTokenizer):
         upload_block_size: int | None = None,
         # you can set this if your s3 uploads are failing because of "Part
         # number must be an integer between 1 and 10000, inclusive". Example: 20 * 2**20 (20MB)
+        pipelined: bool = False,
+        tokenizer_threads: int | None = None,
     ):
         super().__init__(tokenizer_name_or_path, eos_token)
         self.output_folder = get_datafolder(output_folder)
@@ -310,6 +481,51 @@ class DocumentTokenizer(PipelineStepWithTokenizer):
         self.save_final_metadata = save_final_metadata
         self.upload_block_size = upload_block_size
         self.max_tokens_per_file = max_tokens_per_file
+        self.pipelined = pipelined
+        self.tokenizer_threads = tokenizer_threads
+
+    def set_tokenizer_threads(self):
+        """Set the size of the tokenizers thread pool, if it is not running yet. Logs a warning otherwise."""
+        current = os.environ.get("RAYON_NUM_THREADS")
+        if current == str(self.tokenizer_threads):
+            return
+        if current is not None or _batch_encoded_in_process:
+            logger.warning(
+                f"tokenizer_threads={self.tokenizer_threads} can not take effect: "
+                + (
+                    f"RAYON_NUM_THREADS is already set to {current}."
+                    if current is not None
+                    else "a batch was already encoded in this process."
+                )
+                + " Set RAYON_NUM_THREADS in the environment of the executor instead."
+            )
+            return
+        os.environ["RAYON_NUM_THREADS"] = str(self.tokenizer_threads)
+
+    def encode_batches(self, data: DocumentsPipeline) -> Iterator[tuple[list[Document], Callable]]:
+        """Split the documents in batches and encode them.
+            Yields each batch with a function returning its encodings. When pipelined, the next batch is already
+            being encoded in a background thread (the tokenizers library releases the GIL) while the current one is
+            processed, and reading the following batch from the pipeline overlaps with it as well.
+
+        Args:
+            data (DocumentsPipeline): the documents to process
+        """
+        global _batch_encoded_in_process
+        _batch_encoded_in_process = True
+        if not self.pipelined:
+            for batch in batched(data, self.batch_size):
+                yield batch, lambda batch=batch: self.tokenizer.encode_batch([document.text for document in batch])
+            return
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = None
+            for batch in batched(data, self.batch_size):
+                future = executor.submit(self.tokenizer.encode_batch, [document.text for document in batch])
+                if pending:
+                    yield pending
+                pending = (batch, future.result)
+            if pending:
+                yield pending
 
     def get_loss_values(self, document: Document, encoded: "Encoding"):
         """Get the loss mask for the document, if needed.
@@ -353,20 +569,33 @@ class DocumentTokenizer(PipelineStepWithTokenizer):
             save_final_metadata=self.save_final_metadata,
             token_size=self.token_size,
         )
+        # writes are done in order by a background thread when pipelined
+        writer = BackgroundWorker(max_pending=2) if self.pipelined else None
         # tokenize document's text in batches to go faster – we compute loss values independently if needed
-        for batch in batched(data, self.batch_size):
-            with self.track_time(unit="batch"):
-                encoded_batch: list[Encoding] = self.tokenizer.encode_batch([document.text for document in batch])
-                for document, encoded in zip(batch, encoded_batch):
-                    tokens = encoded.ids
-                    loss_values = self.get_loss_values(document, encoded)
-                    if loss_values is not None and len(loss_values) < len(tokens):
-                        # crop final section without loss
-                        tokens = tokens[: len(loss_values)]
-                    # write bytes to disk
-                    unshuff.write(tokens, loss_values)
-                    # save stats
-                    self.stat_update("tokens", value=len(tokens))
+        try:
+            for batch, get_encoded_batch in self.encode_batches(data):
+                with self.track_time(unit="batch"):
+                    encoded_batch: list[Encoding] = get_encoded_batch()
+                    batch_tokens, batch_loss_values = [], [] if self.save_loss_metadata else None
+                    for document, encoded in zip(batch, encoded_batch):
+                        tokens = encoded.ids
+                        loss_values = self.get_loss_values(document, encoded)
+                        if loss_values is not None and len(loss_values) < len(tokens):
+                            # crop final section without loss
+                            tokens = tokens[: len(loss_values)]
+                        batch_tokens.append(tokens)
+                        if batch_loss_values is not None:
+                            batch_loss_values.append(loss_values)
+                        # save stats
+                        self.stat_update("tokens", value=len(tokens))
+                    # write the whole batch to disk at once
+                    if writer:
+                        writer.submit(unshuff.write_batch, batch_tokens, batch_loss_values)
+                    else:
+                        unshuff.write_batch(batch_tokens, batch_loss_values)
+        finally:
+            if writer:
+                writer.shutdown()
         unshuff.close()
         return unshuff
 
@@ -383,6 +612,8 @@ class DocumentTokenizer(PipelineStepWithTokenizer):
             world_size: int
                 The total number of processes
         """
+        if self.tokenizer_threads:
+            self.set_tokenizer_threads()
         unshuf_filename = get_output_filename(self.save_filename, rank, "unshuffled")
         logger.info(f'Tokenizing in "{unshuf_filename}"...')
         outputfile: TokenizedFile = self.write_unshuffled(data, unshuf_filename)
@@ -1,3 +1,4 @@
+from .ipc import IpcWriter
 from .jsonl import JsonlWriter
 from .parquet import ParquetWriter
 
@@ -21,10 +21,22 @@ class DiskWriter(PipelineStep, ABC):
         output_filename: the filename to use when saving data, including extension. Can contain placeholders such as `${rank}` or metadata tags `${tag}`
         compression: if any compression scheme should be used. By default, "infer" - will be guessed from the filename
         adapter: a custom function to "adapt" the Document format to the desired output format
+        mode: the mode to open the output files with ("wt" or "wb")
+        expand_metadata: save each metadata entry in a different column instead of as a dictionary
+        max_file_size: will create a new file when this size (in bytes, after compression) is exceeded. -1 for no limit.
+            Filenames will have a number prepended (000_..., 001_..., etc)
+        max_file_docs: will create a new file when this number of documents has been written to the current one.
+            -1 for no limit. Can be combined with `max_file_size`
+        max_open_files: maximum number of output files kept open at the same time, useful when `output_filename`
+            fans out over many metadata values. The least recently used file is closed when this limit is reached and
+            reopened in append mode if needed (the filesystem must support appending). Writers whose format can not
+            be appended to continue in a new file instead (000_..., 001_..., etc). -1 for unlimited
     """
 
     default_output_filename: str = None
     type = "💽 - WRITER"
+    # whether a closed output file can be reopened in append mode
+    _appendable: bool = True
 
     def __init__(
         self,
@@ -35,6 +47,8 @@ class DiskWriter(PipelineStep, ABC):
         mode: str = "wt",
         expand_metadata: bool = False,
         max_file_size: int = -1,  # in bytes. -1 for unlimited
+        max_file_docs: int = -1,  # -1 for unlimited
+        max_open_files: int = -1,  # -1 for unlimited
     ):
         super().__init__()
         self.compression = compression
@@ -45,11 +59,15 @@ class DiskWriter(PipelineStep, ABC):
         elif self.compression == "zstd" and not output_filename.endswith(".zst"):
             output_filename += ".zst"
         self.max_file_size = max_file_size
+        self.max_file_docs = max_file_docs
         self.file_id_counter = Counter()
-        if self.max_file_size > 0 and mode != "wb":
-            raise ValueError("Can only specify `max_file_size` when writing in binary mode!")
+        self.file_doc_counter = Counter()
+        self.max_open_files = max_open_files
+        self._original_names = {}
         self.output_filename = Template(output_filename)
-        self.output_mg = self.output_folder.get_output_file_manager(mode=mode, compression=compression)
+        self.output_mg = self.output_folder.get_output_file_manager(
+            mode=mode, compression=compression, max_open_files=max_open_files, on_evict=self._evict_file
+        )
         self.adapter = MethodType(adapter, self) if adapter else self._default_adapter
         self.expand_metadata = expand_metadata
 
@@ -120,7 +138,22 @@ class DiskWriter(PipelineStep, ABC):
             _new_filename: new full filename
 
         """
-        self.output_mg.pop(old_filename).close()
+        self._original_names.pop(old_filename, None)
+        self.output_mg.close_file(old_filename)
+
+    def _on_file_evicted(self, original_name, filename):
+        """
+            Called before `filename` is closed to respect `max_open_files`. Writers keeping any state or buffered
+            data tied to this file should flush it here. If the writer is not `_appendable`, we move on to a new file.
+        Args:
+            original_name: name without file counter
+            filename: full filename of the file being closed
+        """
+        if not self._appendable:
+            self.file_id_counter[original_name] += 1
+
+    def _evict_file(self, filename):
+        self._on_file_evicted(self._original_names.pop(filename), filename)
 
     def _get_filename_with_file_id(self, filename):
         """
@@ -135,6 +168,61 @@ class DiskWriter(PipelineStep, ABC):
             return f"{os.path.dirname(filename)}/{self.file_id_counter[filename]:03d}_{os.path.basename(filename)}"
         return f"{self.file_id_counter[filename]:03d}_{os.path.basename(filename)}"
 
+    def _uses_file_ids(self) -> bool:
+        """Whether filenames have a file id prepended (000_..., 001_..., etc)"""
+        return self.max_file_size > 0 or self.max_file_docs > 0 or (self.max_open_files > 0 and not self._appendable)
+
+    def _get_current_filename(self, original_name: str) -> str:
+        """
+            Full filename of the file currently being written to for `original_name`
+        Args:
+            original_name: name without file counter
+
+        Returns: the filename, including the file id if needed
+        """
+        return self._get_filename_with_file_id(original_name) if self._uses_file_ids() else original_name
+
+    def _get_file_handler(self, output_filename: str) -> IO | None:
+        """
+            File handler passed to `_write`. Writers that buffer documents and open their files themselves (when
+            they actually have data to write) can return None
+        Args:
+            output_filename: full filename, including the file id
+
+        Returns: the (opened) file handler
+        """
+        return self.output_mg.get_file(output_filename)
+
+    def _get_file_size(self, original_name: str, output_filename: str) -> int:
+        """
+            Size of `output_filename` used to respect `max_file_size`: the compressed bytes already written. Writers
+            that write from a background thread should return a size tracked on the main thread instead, so that
+            the decision to switch files does not depend on the progress of the background thread
+        Args:
+            original_name: name without file counter
+            output_filename: full filename, including the file id
+
+        Returns: the size of the file, in bytes
+        """
+        return self.output_mg.get_file_size(output_filename)
+
+    def _is_file_full(self, original_name: str, output_filename: str) -> bool:
+        """
+            Check if `output_filename` reached `max_file_size` (see `_get_file_size`) or `max_file_docs`
+        Args:
+            original_name: name without file counter
+            output_filename: full filename, including the file id
+
+        Returns: True if we should switch to a new file
+
+        """
+        if not self.file_doc_counter[output_filename]:
+            # never switch away from an empty file (compression headers may already have been written)
+            return False
+        if self.max_file_docs > 0 and self.file_doc_counter[output_filename] >= self.max_file_docs:
+            return True
+        return self.max_file_size > 0 and self._get_file_size(original_name, output_filename) >= self.max_file_size
+
     def write(self, document: Document, rank: int = 0, **kwargs):
         """
         Top level method to write a `Document` to disk. Will compute its output filename, adapt it to desired output format, write it and save stats.
@@ -148,17 +236,19 @@ class DiskWriter(PipelineStep, ABC):
         """
         original_name = output_filename = self._get_output_filename(document, rank, **kwargs)
         # we possibly have to change file
-        if self.max_file_size > 0:
-            # get size of current file
+        if self._uses_file_ids():
             output_filename = self._get_filename_with_file_id(original_name)
             # we have to switch file!
-            if self.output_mg.get_file(output_filename).tell() >= self.max_file_size:
+            if self._is_file_full(original_name, output_filename):
                 self.file_id_counter[original_name] += 1
                 new_output_filename = self._get_filename_with_file_id(original_name)
                 self._on_file_switch(original_name, output_filename, new_output_filename)
                 output_filename = new_output_filename
+            self.file_doc_counter[output_filename] += 1
+        if self.max_open_files > 0:
+            self._original_names[output_filename] = original_name
         # actually write
-        self._write(self.adapter(document), self.output_mg.get_file(output_filename), original_name)
+        self._write(self.adapter(document), self._get_file_handler(output_filename), original_name)
         self.stat_update(self._get_output_filename(document, "XXXXX", **kwargs))
         self.stat_update(StatHints.total)
         self.update_doc_stats(document)
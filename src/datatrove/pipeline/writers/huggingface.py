@@ -99,6 +99,8 @@ class HuggingFaceDatasetWriter(ParquetWriter):
         self.operations.extend(additions)
 
     def close(self, rank: int = 0):
+        # files are only opened when data is written to them: write out everything pending first
+        self._flush()
         filelist = list(self.output_mg.get_open_files().keys())
         super().close()
         if filelist:
@@ -0,0 +1,157 @@
+from collections import defaultdict
+from typing import IO, Any, Callable, Literal
+
+from datatrove.io import DataFolderLike
+from datatrove.pipeline.writers.disk_base import DiskWriter
+
+
+class IpcWriter(DiskWriter):
+    """Write data to datafolder (local or remote) in Apache Arrow IPC (Feather v2) format.
+        Meant for fast intermediate hand-off between stages: record batches are written as-is, without the encoding
+        step of parquet. Files written without compression can be memory-mapped (zero-copy) by `IpcReader`.
+
+    Args:
+        output_folder: a str, tuple or DataFolder where data should be saved
+        output_filename: the filename to use when saving data, including extension. Can contain placeholders such as `${rank}` or metadata tags `${tag}`
+        compression: optional arrow buffer compression ("lz4" or "zstd"). Compressed buffers can not be read zero-copy
+        adapter: a custom function to "adapt" the Document format to the desired output format
+        batch_size: number of documents in each record batch
+        expand_metadata: save each metadata entry in a different column instead of as a dictionary
+        max_file_size: will create a new file when this size is exceeded (in bytes). -1 for no limit.
+            Filenames will have a number prepended (000_..., 001_..., etc)
+        max_file_docs: will create a new file when this number of documents has been written to the current one.
+            -1 for no limit
+        max_open_files: maximum number of files kept open at the same time. When reached, the least recently used
+            file is finalized and following batches for it go to a new file. Pending documents are kept in memory and
+            files are only opened to write full batches, so each file holds at least one. -1 for unlimited
+        schema: arrow schema to use. By default, inferred from the first document
+        stream: write the streaming format instead of the (random access) file format. Read with `IpcReader(stream=True)`
+    """
+
+    default_output_filename: str = "${rank}.arrow"
+    name = "🪶 Ipc"
+    _requires_dependencies = ["pyarrow"]
+    _appendable = False
+
+    def __init__(
+        self,
+        output_folder: DataFolderLike,
+        output_filename: str = None,
+        compression: Literal["lz4", "zstd"] | None = None,
+        adapter: Callable = None,
+        batch_size: int = 1000,
+        expand_metadata: bool = False,
+        max_file_size: int = -1,  # in bytes. -1 for unlimited
+        max_file_docs: int = -1,  # -1 for unlimited
+        max_open_files: int = -1,  # -1 for unlimited
+        schema: Any = None,
+        stream: bool = False,
+    ):
+        if compression not in {"lz4", "zstd", None}:
+            raise ValueError("Invalid compression type. Allowed types are 'lz4', 'zstd', or None.")
+
+        super().__init__(
+            output_folder,
+            output_filename,
+            compression=None,  # compression is applied by arrow to each buffer
+            adapter=adapter,
+            mode="wb",
+            expand_metadata=expand_metadata,
+            max_file_size=max_file_size,
+            max_file_docs=max_file_docs,
+            max_open_files=max_open_files,
+        )
+        self._writers = {}
+        self._schemas = {}
+        self._batches = defaultdict(list)
+        self.compression = compression
+        self.batch_size = batch_size
+        self.schema = schema
+        self.stream = stream
+
+    def _on_file_switch(self, original_name, old_filename, new_filename):
+        """
+            Called when we are switching file from "old_filename" to "new_filename" (original_name is the filename
+            without 000_, 001_, etc): the pending batch is written to the old file
+        Args:
+            original_name: name without file counter
+            old_filename: old full filename
+            new_filename: new full filename
+        """
+        self._write_batch(original_name, output_filename=old_filename)
+        if original_name in self._writers:
+            self._writers.pop(original_name).close()
+            self._schemas.pop(original_name)
+        super()._on_file_switch(original_name, old_filename, new_filename)
+
+    def _on_file_evicted(self, original_name, filename):
+        """
+            Called before `filename` is closed to respect `max_open_files`: the file is finalized with the batches
+            written so far. Pending documents are kept in memory, and will go to a new file once they make a full
+            batch (or when the writer is closed). As a file is only opened to write a full batch, each file holds at
+            least one, even if many more partitions than `max_open_files` are interleaved
+        Args:
+            original_name: name without file counter
+            filename: full filename of the file being closed
+        """
+        if original_name in self._writers:
+            self._writers.pop(original_name).close()
+            self._schemas.pop(original_name)
+        super()._on_file_evicted(original_name, filename)
+        # the pending documents now belong to the next file
+        self.file_doc_counter[self._get_current_filename(original_name)] += len(self._batches[original_name])
+
+    def _get_file_handler(self, output_filename: str):
+        # files are opened in `_write_batch`, when a batch is ready to be written
+        return None
+
+    def _get_file_size(self, original_name: str, output_filename: str) -> int:
+        if original_name not in self._writers:
+            # nothing written to this file yet
+            return 0
+        return super()._get_file_size(original_name, output_filename)
+
+    def _write_batch(self, filename, output_filename: str | None = None):
+        """
+            Write the pending documents of `filename` as a record batch. The file is opened if needed
+        Args:
+            filename: name without file counter
+            output_filename: full filename to write to. Defaults to the current file of `filename`
+        """
+        if not self._batches[filename]:
+            return
+        import pyarrow as pa
+
+        documents = self._batches.pop(filename)
+        output_filename = output_filename or self._get_current_filename(filename)
+        if self.max_open_files > 0:
+            # pending documents can be written to a file that no new document was assigned to
+            self._original_names[output_filename] = filename
+        # opens the file if needed, and marks it as recently used
+        file_handler = self.output_mg.get_file(output_filename)
+        if filename not in self._writers:
+            schema = self.schema if self.schema is not None else pa.RecordBatch.from_pylist(documents[:1]).schema
+            new_writer = pa.ipc.new_stream if self.stream else pa.ipc.new_file
+            self._writers[filename] = new_writer(
+                file_handler, schema, options=pa.ipc.IpcWriteOptions(compression=self.compression)
+            )
+            self._schemas[filename] = schema
+        # prepare batch
+        batch = pa.RecordBatch.from_pylist(documents, schema=self._schemas[filename])
+        # write batch
+        self._writers[filename].write_batch(batch)
+
+    def _write(self, document: dict, file_handler: IO, filename: str):
+        self._batches[filename].append(document)
+        if len(self._batches[filename]) == self.batch_size:
+            self._write_batch(filename)
+
+    def close(self):
+        for filename in list(self._batches.keys()):
+            self._write_batch(filename)
+        for writer in self._writers.values():
+            writer.close()
+        self._batches.clear()
+        self._writers.clear()
+        self._schemas.clear()
+        super().close()
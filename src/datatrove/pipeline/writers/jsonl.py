@@ -1,7 +1,9 @@
+from collections import Counter
 from typing import IO, Callable
 
 from datatrove.io import DataFolderLike
 from datatrove.pipeline.writers.disk_base import DiskWriter
+from datatrove.utils.background import BackgroundWorker
 
 
 class JsonlWriter(DiskWriter):
@@ -13,6 +15,21 @@ class JsonlWriter(DiskWriter):
         compression: if any compression scheme should be used. By default, "infer" - will be guessed from the filename
         adapter: a custom function to "adapt" the Document format to the desired output format
         expand_metadata: save each metadata entry in a different column instead of as a dictionary
+        max_file_size: will create a new file when this size (in bytes) is exceeded. -1 for no limit. Counts the bytes
+            written after compression, except when `buffered=True`: the uncompressed size of the documents is counted
+            instead, so compressed files are then several times smaller than `max_file_size` (scale it by the expected
+            compression ratio to get files of similar sizes). Filenames will have a number prepended (000_..., etc)
+        max_file_docs: will create a new file when this number of documents has been written to the current one.
+            -1 for no limit
+        max_open_files: maximum number of files kept open at the same time. When reached, the least recently used
+            file is closed, and reopened in append mode if needed. -1 for unlimited
+        buffered: serialize documents into large in-memory chunks and compress/write them from a background thread
+            instead of compressing each document in the pipeline thread. Only "gzip", "zstd" or no compression are
+            supported in this mode. `max_file_size` then applies to the uncompressed size of the documents (see
+            above), so that files are switched at the same document regardless of the progress of the background thread
+        buffer_size: size (in bytes) of the serialized chunks handed to the background thread when `buffered=True`
+        compression_level: compression level to use when `buffered=True`. Defaults to 9 for gzip and 3 for zstd
+        compression_threads: number of zstd compression threads when `buffered=True` (-1 for one per cpu core)
     """
 
     default_output_filename: str = "${rank}.jsonl"
@@ -27,6 +44,12 @@ class JsonlWriter(DiskWriter):
         adapter: Callable = None,
         expand_metadata: bool = False,
         max_file_size: int = -1,  # in bytes. -1 for unlimited
+        max_file_docs: int = -1,  # -1 for unlimited
+        max_open_files: int = -1,  # -1 for unlimited
+        buffered: bool = False,
+        buffer_size: int = 8 * 2**20,  # 8MB
+        compression_level: int | None = None,
+        compression_threads: int = 0,
     ):
         super().__init__(
             output_folder,
@@ -36,9 +59,128 @@ class JsonlWriter(DiskWriter):
             expand_metadata=expand_metadata,
             mode="wb",
             max_file_size=max_file_size,
+            max_file_docs=max_file_docs,
+            max_open_files=max_open_files,
         )
+        self.buffered = buffered
+        self.buffer_size = buffer_size
+        self.compression_level = compression_level
+        self.compression_threads = compression_threads
+        if self.buffered:
+            if self.compression == "infer":
+                from fsspec.utils import infer_compression
 
-    def _write(self, document: dict, file_handler: IO, _filename: str):
+                self.compression = infer_compression(self.output_filename.template)
+            if self.compression not in {"gzip", "zstd", None}:
+                raise ValueError("Only 'gzip', 'zstd' or no compression are supported when `buffered=True`.")
+            # we compress the data ourselves
+            self.output_mg = self.output_folder.get_output_file_manager(
+                mode="wb", compression=None, max_open_files=max_open_files, on_evict=self._evict_file
+            )
+        self._buffers = {}
+        self._compressors = {}
+        # uncompressed bytes written to the current file of each filename (without file id), when buffered
+        self._file_sizes = Counter()
+        self._worker = None
+
+    def _get_compressor(self):
+        if self.compression == "gzip":
+            import zlib
+
+            # wbits=31: gzip header and trailer
+            return zlib.compressobj(9 if self.compression_level is None else self.compression_level, zlib.DEFLATED, 31)
+        if self.compression == "zstd":
+            import zstandard
+
+            return zstandard.ZstdCompressor(
+                level=3 if self.compression_level is None else self.compression_level,
+                threads=self.compression_threads,
+            ).compressobj()
+        return None
+
+    @staticmethod
+    def _compress_and_write(compressor, data: bytes, file_handler: IO, finish: bool = False):
+        if compressor is not None:
+            data = compressor.compress(data)
+            if finish:
+                data += compressor.flush()
+        if data:
+            file_handler.write(data)
+
+    def _submit(self, fn: Callable, *args):
+        # the worker is created lazily so that the writer can still be pickled before running
+        if self._worker is None:
+            self._worker = BackgroundWorker()
+        self._worker.submit(fn, *args)
+
+    def _flush_buffer(self, filename: str, finish: bool = False):
+        """
+            Hand the buffered data of `filename` to the background thread.
+        Args:
+            filename: filename (without file id) whose buffer should be flushed
+            finish: also terminate the compressed stream. The next write to `filename` will start a new one
+        """
+        if filename not in self._compressors:
+            return
+        compressor, file_handler = self._compressors.pop(filename) if finish else self._compressors[filename]
+        self._submit(
+            self._compress_and_write, compressor, bytes(self._buffers.pop(filename, b"")), file_handler, finish
+        )
+
+    def _on_file_switch(self, original_name, old_filename, new_filename):
+        """
+            Called when we are switching file from "old_filename" to "new_filename" (original_name is the filename
+            without 000_, 001_, etc)
+        Args:
+            original_name: name without file counter
+            old_filename: old full filename
+            new_filename: new full filename
+        """
+        if not self.buffered:
+            return super()._on_file_switch(original_name, old_filename, new_filename)
+        self._flush_buffer(original_name, finish=True)
+        self._file_sizes.pop(original_name, None)
+        self._original_names.pop(old_filename, None)
+        # close the old file only once all its pending data has been written
+        self._submit(self.output_mg.pop(old_filename).close)
+
+    def _on_file_evicted(self, original_name, filename):
+        """
+            Called before `filename` is closed to respect `max_open_files`: write out its buffered data
+        Args:
+            original_name: name without file counter
+            filename: full filename of the file being closed
+        """
+        if self.buffered and original_name in self._compressors:
+            self._flush_buffer(original_name, finish=True)
+            self._worker.wait()
+        super()._on_file_evicted(original_name, filename)
+
+    def _get_file_size(self, original_name: str, output_filename: str) -> int:
+        if self.buffered:
+            return self._file_sizes[original_name]
+        return super()._get_file_size(original_name, output_filename)
+
+    def _write(self, document: dict, file_handler: IO, filename: str):
         import orjson
 
-        file_handler.write(orjson.dumps(document, option=orjson.OPT_APPEND_NEWLINE))
+        data = orjson.dumps(document, option=orjson.OPT_APPEND_NEWLINE)
+        if not self.buffered:
+            file_handler.write(data)
+            return
+        if filename not in self._compressors:
+            self._compressors[filename] = (self._get_compressor(), file_handler)
+        buffer = self._buffers.setdefault(filename, bytearray())
+        buffer += data
+        self._file_sizes[filename] += len(data)
+        if len(buffer) >= self.buffer_size:
+            self._flush_buffer(filename)
+
+    def close(self):
+        if self.buffered:
+            for filename in list(self._compressors.keys()):
+                self._flush_buffer(filename, finish=True)
+            if self._worker is not None:
+                self._worker.shutdown()
+                self._worker = None
+        super().close()
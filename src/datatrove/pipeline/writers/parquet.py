@@ -3,12 +3,47 @@ from typing import IO, Any, Callable, Literal
 
 from datatrove.io import DataFolderLike
 from datatrove.pipeline.writers.disk_base import DiskWriter
+from datatrove.utils.background import BackgroundWorker
 
 
 class ParquetWriter(DiskWriter):
+    """Write data to datafolder (local or remote) in Parquet format
+
+    Args:
+        output_folder: a str, tuple or DataFolder where data should be saved
+        output_filename: the filename to use when saving data, including extension. Can contain placeholders such as `${rank}` or metadata tags `${tag}`
+        compression: parquet compression codec
+        adapter: a custom function to "adapt" the Document format to the desired output format
+        batch_size: number of documents converted to arrow at once
+        expand_metadata: save each metadata entry in a different column instead of as a dictionary
+        max_file_size: will create a new file when this size is exceeded (in bytes). -1 for no limit. Counts the bytes
+            written to the file (after encoding and compression), except when `async_write=True`: the in-memory arrow
+            size of the converted batches is counted instead, so files are then usually several times smaller than
+            `max_file_size` (scale it by the expected compression ratio to get files of similar sizes). Filenames will
+            have a number prepended (000_..., 001_..., etc)
+        max_file_docs: will create a new file when this number of documents has been written to the current one.
+            -1 for no limit
+        max_open_files: maximum number of files kept open at the same time. When reached, the least recently used
+            file is finalized and following row groups for it go to a new file. Pending documents are kept in memory
+            and files are only opened to write full row groups, so each file holds at least one. -1 for unlimited
+        schema: arrow schema to use. By default, inferred from the first document
+        row_group_bytes: accumulate batches until they reach this (uncompressed, in memory) size and write them as a
+            single row group. -1 to write each batch of `batch_size` documents as its own row group
+        use_dictionary: dictionary encode all columns (True), none (False) or only the given list of columns.
+            Useful for low cardinality metadata columns
+        write_statistics: write min/max statistics for all columns (True), none (False) or only the given list of
+            columns. Statistics allow readers to skip row groups when filtering
+        write_page_index: write the page index (column/offset indexes), allowing readers to skip individual pages
+        async_write: compress and write batches from a background thread instead of the pipeline thread. Documents
+            are still converted to arrow in the pipeline thread, and `max_file_size` then applies to the (uncompressed)
+            size of the converted batches (see above), so that files are switched at the same documents regardless of
+            the progress of the background thread
+    """
+
     default_output_filename: str = "${rank}.parquet"
     name = "📒 Parquet"
     _requires_dependencies = ["pyarrow"]
+    _appendable = False
 
     def __init__(
         self,
@@ -19,7 +54,14 @@ class ParquetWriter(DiskWriter):
         batch_size: int = 1000,
         expand_metadata: bool = False,
         max_file_size: int = 5 * 2**30,  # 5GB
+        max_file_docs: int = -1,  # -1 for unlimited
+        max_open_files: int = -1,  # -1 for unlimited
         schema: Any = None,
+        row_group_bytes: int = -1,  # -1 for one row group per batch
+        use_dictionary: bool | list[str] = True,
+        write_statistics: bool | list[str] = True,
+        write_page_index: bool = False,
+        async_write: bool = False,
     ):
         # Validate the compression setting
         if compression not in {"snappy", "gzip", "brotli", "lz4", "zstd", None}:
@@ -35,55 +77,169 @@ class ParquetWriter(DiskWriter):
             mode="wb",
             expand_metadata=expand_metadata,
             max_file_size=max_file_size,
+            max_file_docs=max_file_docs,
+            max_open_files=max_open_files,
         )
         self._writers = {}
         self._batches = defaultdict(list)
+        self._row_groups = defaultdict(list)
         self._file_counter = Counter()
+        # arrow bytes handed to the current file of each filename (without file counter), when async_write=True
+        self._file_sizes = Counter()
+        self._worker = None
         self.compression = compression
         self.batch_size = batch_size
         self.schema = schema
+        self.row_group_bytes = row_group_bytes
+        self.use_dictionary = use_dictionary
+        self.write_statistics = write_statistics
+        self.write_page_index = write_page_index
+        self.async_write = async_write
+
+    def _wait_for_writes(self):
+        if self._worker is not None:
+            self._worker.wait()
+
+    def _close_writer(self, original_name):
+        """
+            Finalize the parquet file of `original_name`, once all its submitted row groups have been written
+        Args:
+            original_name: name without file counter
+        """
+        self._wait_for_writes()
+        if original_name in self._writers:
+            self._writers.pop(original_name).close()
+        self._file_sizes.pop(original_name, None)
 
     def _on_file_switch(self, original_name, old_filename, new_filename):
         """
             Called when we are switching file from "old_filename" to "new_filename" (original_name is the filename
-            without 000_, 001_, etc)
+            without 000_, 001_, etc): everything pending is written to the old file
         Args:
             original_name: name without file counter
             old_filename: old full filename
             new_filename: new full filename
         """
-        self._writers.pop(original_name).close()
+        self._write_batch(original_name, flush_row_group=True, output_filename=old_filename)
+        self._close_writer(original_name)
         super()._on_file_switch(original_name, old_filename, new_filename)
 
-    def _write_batch(self, filename):
-        if not self._batches[filename]:
-            return
+    def _on_file_evicted(self, original_name, filename):
+        """
+            Called before `filename` is closed to respect `max_open_files`: the file is finalized with the row groups
+            written so far. Documents and batches not written yet are kept in memory, and will go to a new file once
+            they make a full row group (or when the writer is closed). As a file is only opened to write a full row
+            group, each file holds at least one, even if many more partitions than `max_open_files` are interleaved
+        Args:
+            original_name: name without file counter
+            filename: full filename of the file being closed
+        """
+        self._close_writer(original_name)
+        super()._on_file_evicted(original_name, filename)
+        # the pending documents now belong to the next file
+        self.file_doc_counter[self._get_current_filename(original_name)] += len(self._batches[original_name]) + sum(
+            batch.num_rows for batch in self._row_groups[original_name]
+        )
+        if self.async_write:
+            self._file_sizes[original_name] = sum(batch.nbytes for batch in self._row_groups[original_name])
+
+    def _get_file_handler(self, output_filename: str):
+        # files are opened in `_write_batch`, when a row group is ready to be written
+        return None
+
+    def _get_file_size(self, original_name: str, output_filename: str) -> int:
+        if self.async_write:
+            return self._file_sizes[original_name]
+        if original_name not in self._writers:
+            # nothing written to this file yet
+            return 0
+        return super()._get_file_size(original_name, output_filename)
+
+    def _write_row_group(self, writer, row_group: list):
+        """
+            Write `row_group` (a list of arrow RecordBatches) as a single row group. Runs in the background thread
+            when `async_write=True`
+        Args:
+            writer: the ParquetWriter of the file
+            row_group: the batches to write
+        """
         import pyarrow as pa
 
-        # prepare batch
-        batch = pa.RecordBatch.from_pylist(self._batches.pop(filename), schema=self.schema)
-        # write batch
-        self._writers[filename].write_batch(batch)
+        if len(row_group) == 1:
+            writer.write_batch(row_group[0], row_group_size=row_group[0].num_rows)
+        else:
+            table = pa.Table.from_batches(row_group)
+            writer.write_table(table, row_group_size=table.num_rows)
 
-    def _write(self, document: dict, file_handler: IO, filename: str):
+    def _write_batch(self, filename, flush_row_group: bool = False, output_filename: str | None = None):
+        """
+            Convert the pending documents of `filename` to arrow and write them, either directly as a row group or
+            accumulated until `row_group_bytes` is reached. The file is opened when a row group is ready
+        Args:
+            filename: name without file counter
+            flush_row_group: write the accumulated batches even if they did not reach `row_group_bytes`
+            output_filename: full filename to write to. Defaults to the current file of `filename`
+        """
         import pyarrow as pa
         import pyarrow.parquet as pq
 
+        documents = self._batches.pop(filename, [])
+        if documents:
+            # prepare batch
+            batch = pa.RecordBatch.from_pylist(documents, schema=self.schema)
+            self._row_groups[filename].append(batch)
+            if self.async_write:
+                self._file_sizes[filename] += batch.nbytes
+        row_group = self._row_groups[filename]
+        if not row_group or not (
+            flush_row_group
+            or self.row_group_bytes <= 0
+            or sum(batch.nbytes for batch in row_group) >= self.row_group_bytes
+        ):
+            return
+        row_group = self._row_groups.pop(filename)
+        output_filename = output_filename or self._get_current_filename(filename)
+        if self.max_open_files > 0:
+            # pending documents can be written to a file that no new document was assigned to
+            self._original_names[output_filename] = filename
+        # opens the file if needed, and marks it as recently used
+        file_handler = self.output_mg.get_file(output_filename)
         if filename not in self._writers:
             self._writers[filename] = pq.ParquetWriter(
                 file_handler,
-                schema=self.schema if self.schema is not None else pa.RecordBatch.from_pylist([document]).schema,
+                schema=self.schema if self.schema is not None else row_group[0].schema,
                 compression=self.compression,
+                use_dictionary=self.use_dictionary,
+                write_statistics=self.write_statistics,
+                write_page_index=self.write_page_index,
             )
+        if not self.async_write:
+            self._write_row_group(self._writers[filename], row_group)
+            return
+        # the worker is created lazily so that the writer can still be pickled before running
+        if self._worker is None:
+            self._worker = BackgroundWorker()
+        self._worker.submit(self._write_row_group, self._writers[filename], row_group)
+
+    def _write(self, document: dict, file_handler: IO, filename: str):
         self._batches[filename].append(document)
         if len(self._batches[filename]) == self.batch_size:
             self._write_batch(filename)
 
-    def close(self):
-        for filename in list(self._batches.keys()):
-            self._write_batch(filename)
+    def _flush(self):
+        """Write out everything pending and finalize all the parquet files (the file handles are left open)"""
+        for filename in list(self._batches.keys() | self._row_groups.keys()):
+            self._write_batch(filename, flush_row_group=True)
+        if self._worker is not None:
+            self._worker.shutdown()
+            self._worker = None
         for writer in self._writers.values():
             writer.close()
         self._batches.clear()
+        self._row_groups.clear()
         self._writers.clear()
+        self._file_sizes.clear()
+
+    def close(self):
+        self._flush()
         super().close()
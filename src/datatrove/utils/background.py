@@ -0,0 +1,46 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+
+class BackgroundWorker:
+    """Runs submitted callables in order on a single background thread.
+        At most `max_pending` tasks can be waiting at any time: `submit` blocks on the oldest task when this limit is
+        reached, which bounds the memory held by queued data. Exceptions raised in the background thread are re-raised
+        in the calling thread on the next `submit`/`wait`.
+        Typically used to overlap compression and disk writes (which release the GIL) with document processing.
+
+    Args:
+        max_pending: maximum number of queued tasks
+    """
+
+    def __init__(self, max_pending: int = 4):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending: deque[Future] = deque()
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        """
+            Queue `fn(*args, **kwargs)` to run after all previously submitted tasks.
+        Args:
+            fn: the callable to run in the background
+        """
+        while len(self._pending) >= self.max_pending:
+            self._pending.popleft().result()
+        self._pending.append(self._executor.submit(fn, *args, **kwargs))
+
+    def wait(self):
+        """
+        Block until all submitted tasks have completed.
+        """
+        while self._pending:
+            self._pending.popleft().result()
+
+    def shutdown(self):
+        """
+        Wait for the remaining tasks and stop the background thread.
+        """
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown()
@@ -1,7 +1,7 @@
 import os
 import struct
 from functools import cache
-from typing import BinaryIO
+from typing import BinaryIO, Generator
 
 import numpy as np
 from fsspec.spec import AbstractBufferedFile
@@ -51,6 +51,57 @@ def read_np_from_file(
             return np.frombuffer(file.read(), dtype=dtype)
 
 
+def read_sorted_blocks(
+    files: list[BinaryIO], dtypes: list[np.dtype], key: str = "hash", lines_to_buffer: int = -1
+) -> Generator[list[np.ndarray], None, None]:
+    """
+    Reads several files of numpy records, each sorted by the `key` field, in aligned blocks: all the records with
+        the same `key` value (from all the files) are in the same block, and the blocks are in `key` order.
+        Used to merge sorted files with vectorized operations, without loading them entirely in memory.
+    Args:
+        files: the (opened) files to read from
+        dtypes: dtype of the records of each file. All of them must have a `key` field
+        key: field the files are sorted by
+        lines_to_buffer: number of records to read from each file at a time. -1 to read everything at once
+
+    Returns: generator of lists with the (possibly empty) records taken from each file for the block
+    """
+    if lines_to_buffer != -1 and lines_to_buffer < 1:
+        raise ValueError("lines_to_buffer must be >= 1 or -1 (for unlimited)")
+    buffers = [np.empty(0, dtype=dtype) for dtype in dtypes]
+    exhausted = [False] * len(files)
+
+    def fill(file_i: int):
+        dtype = dtypes[file_i]
+        data = files[file_i].read(lines_to_buffer * dtype.itemsize if lines_to_buffer != -1 else -1)
+        assert len(data) % dtype.itemsize == 0, "file size not divisible by line size"
+        block = np.frombuffer(data, dtype=dtype)
+        if lines_to_buffer == -1 or len(block) < lines_to_buffer:
+            exhausted[file_i] = True
+        assert (block[key][1:] >= block[key][:-1]).all(), f"{key} order error"
+        buffers[file_i] = np.concatenate((buffers[file_i], block)) if len(buffers[file_i]) else block
+
+    while True:
+        for file_i in range(len(files)):
+            if not exhausted[file_i] and len(buffers[file_i]) == 0:
+                fill(file_i)
+        # values smaller than the last one read from each (unfinished) file are complete
+        bound = min((buffers[i][key][-1] for i in range(len(files)) if not exhausted[i]), default=None)
+        blocks = []
+        for file_i, buffer in enumerate(buffers):
+            end = len(buffer) if bound is None else int(np.searchsorted(buffer[key], bound, side="left"))
+            blocks.append(buffer[:end])
+            buffers[file_i] = buffer[end:]
+        if any(len(block) for block in blocks):
+            yield blocks
+        if bound is None:
+            break
+        for file_i in range(len(files)):
+            # only values equal to `bound` are left: read more
+            if not exhausted[file_i] and buffers[file_i][key][-1] == bound:
+                fill(file_i)
+
+
 def seek_to_start(f: AbstractBufferedFile, start_hash: int, line_format: str, hash_format: str):
     if start_hash == 0:
         return
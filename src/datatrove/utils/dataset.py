@@ -1,25 +1,32 @@
+import json
+import os
 from bisect import bisect
 
 import numpy as np
-import torch
 from fsspec import AbstractFileSystem
 from fsspec.core import url_to_fs
+from fsspec.implementations.local import LocalFileSystem
 
 from datatrove.utils._import_utils import is_torch_available
+from datatrove.utils.logging import logger
 
 
 if is_torch_available():
+    import torch
     from torch.utils.data import Dataset
 
     class DatatroveFileDataset(Dataset):
         """Dataset for a single .ds file created by datatrove
         We loop on the dataset if asking for an index larger than the dataset size
+        Local files are memory mapped, other files are read through fsspec. Files are opened lazily in each process, so
+        the dataset can be used by DataLoader workers (forked or spawned) without sharing file handles.
 
         Args:
             file_path (str): path to file on s3, locally, or some other fsspec supported path
             seq_len (int): sequence length
             token_size (int): size of a single token, in bytes. Usually 2 for vocab sizes < 65k and 4 for larger
             max_tokens (int): only read at most this number of tokens
+            file_size (int): size of the file, in bytes. Fetched from the filesystem if not provided
         """
 
         def __init__(
@@ -28,38 +35,89 @@ if is_torch_available():
             seq_len: int,
             token_size: int = 2,
             max_tokens: int | None = None,
+            file_size: int | None = None,
         ):
             self.file_path: str = file_path
             self.seq_len = seq_len
             self.token_size = token_size
+            self.token_dtype = np.dtype("<u2" if self.token_size == 2 else "<u4")
 
             self.fs: AbstractFileSystem
             self.fs, self.file_path = url_to_fs(file_path)
-            fsize = self.fs.size(self.file_path)
+            fsize = file_size if file_size is not None else self.fs.size(self.file_path)
             # total number of full contexts in this file
             num_tokens = fsize // self.token_size
             self._len = (min(max_tokens, num_tokens) if max_tokens else num_tokens) // (seq_len + 1)
+            # opened lazily, by the process using them
+            self._pid = None
             self._f = None
+            self._tokens = None
 
-        def __getitem__(self, item):
-            if self._f is None:
-                self._f = self.fs.open(self.file_path, "rb")
-            chunk_size = self.token_size * (self.seq_len + 1)
-            self._f.seek(item * chunk_size)
-            return {
-                "input_ids": torch.as_tensor(
-                    np.frombuffer(self._f.read(chunk_size), np.uint16 if self.token_size == 2 else np.uint32).astype(
-                        np.int64
-                    ),
-                    dtype=torch.long,
+        def _open(self):
+            if self._pid == os.getpid():
+                return
+            # handles inherited from a parent process are not reused, as their position would be shared
+            self._f, self._tokens = None, None
+            if isinstance(self.fs, LocalFileSystem):
+                self._tokens = (
+                    np.memmap(self.file_path, dtype=self.token_dtype, mode="r", shape=(self._len, self.seq_len + 1))
+                    if self._len > 0
+                    else np.empty((0, self.seq_len + 1), dtype=self.token_dtype)
                 )
-            }
+            else:
+                self._f = self.fs.open(self.file_path, "rb")
+            self._pid = os.getpid()
+
+        def __getitem__(self, item):
+            self._open()
+            if self._tokens is not None:
+                tokens = self._tokens[item]
+            else:
+                chunk_size = self.token_size * (self.seq_len + 1)
+                self._f.seek(item * chunk_size)
+                tokens = np.frombuffer(self._f.read(chunk_size), self.token_dtype)
+            return {"input_ids": torch.from_numpy(tokens.astype(np.int64))}
+
+        def __getitems__(self, items: list[int]) -> list[dict]:
+            """
+                Get several samples at once: they are gathered into a single array (consecutive samples of remote
+                files are fetched with a single read) and converted with a single call.
+            Args:
+                items: the indices of the samples
+
+            Returns:
+                list[dict]: one sample per index. Used by DataLoader instead of calling __getitem__ for each index
+            """
+            self._open()
+            items = np.asarray(items, dtype=np.int64)
+            if self._tokens is not None:
+                tokens = self._tokens[items]
+            else:
+                chunk_size = self.token_size * (self.seq_len + 1)
+                unique_items, inverse = np.unique(items, return_inverse=True)
+                # runs of consecutive samples
+                run_firsts = np.flatnonzero(np.diff(unique_items, prepend=-2) != 1)
+                run_ends = np.append(run_firsts[1:], len(unique_items))
+                samples = np.empty((len(unique_items), self.seq_len + 1), dtype=self.token_dtype)
+                for first, end in zip(run_firsts.tolist(), run_ends.tolist()):
+                    self._f.seek(int(unique_items[first]) * chunk_size)
+                    samples[first:end] = np.frombuffer(
+                        self._f.read((end - first) * chunk_size), self.token_dtype
+                    ).reshape(end - first, self.seq_len + 1)
+                tokens = samples[inverse.reshape(-1)]
+            return [{"input_ids": input_ids} for input_ids in torch.from_numpy(tokens.astype(np.int64))]
 
         def __len__(self):
             return self._len
 
+        def __getstate__(self):
+            # file handles and memory maps are not pickled: they are opened again when needed
+            state = self.__dict__.copy()
+            state["_pid"], state["_f"], state["_tokens"] = None, None, None
+            return state
+
         def __del__(self):
-            if self._f:
+            if self._f and self._pid == os.getpid():
                 self._f.close()
 
     class DatatroveFolderDataset(Dataset):
@@ -76,6 +134,9 @@ if is_torch_available():
             max_tokens (int): only read at most this number of tokens
             shuffle (bool, optional): shuffle the files in the folder. Defaults to False.
             seed (int, optional): seed for shuffling. Defaults to 42.
+            manifest_file (str, optional): path to a json file caching the list of files and their sizes. It is created
+                on the first run and reused afterwards, skipping the (slow on remote filesystems) listing. Delete it if
+                the folder changes. Defaults to None (always list the folder).
         """
 
         def __init__(
@@ -88,26 +149,38 @@ if is_torch_available():
             max_tokens: int | None = None,
             shuffle: bool = False,
             seed: int = 42,
+            manifest_file: str | None = None,
         ):
             self.folder_path = folder_path
             self.filename_pattern = filename_pattern
             fs, folder_path = url_to_fs(folder_path)
-            matched_files = (
-                fs.find(folder_path, detail=False, maxdepth=1 if not recursive else None)
-                if not filename_pattern
-                else fs.glob(filename_pattern, maxdepth=1 if not recursive else None)
-            )
+            matched_files = self._load_manifest(manifest_file, recursive)
+            if matched_files is None:
+                # detail=True gives us the file sizes without an extra request per file
+                matched_files = (
+                    fs.find(folder_path, detail=True, maxdepth=1 if not recursive else None)
+                    if not filename_pattern
+                    else fs.glob(filename_pattern, detail=True, maxdepth=1 if not recursive else None)
+                )
+                matched_files = [
+                    (path, info["size"])
+                    for path, info in sorted(matched_files.items())
+                    if info.get("type", "file") == "file"
+                ]
+                if matched_files and manifest_file:
+                    self._save_manifest(manifest_file, recursive, matched_files)
             if not matched_files:
                 raise FileNotFoundError(f'No files matching "{filename_pattern}" found in {folder_path}')
 
             self.files = []
             remaining_tokens = max_tokens
-            for path in matched_files:
+            for path, size in matched_files:
                 file_data = DatatroveFileDataset(
                     fs.unstrip_protocol(path),
                     seq_len,
                     token_size=token_size,
                     max_tokens=remaining_tokens,
+                    file_size=size,
                 )
                 self.files.append(file_data)
                 if remaining_tokens is not None:
@@ -124,6 +197,37 @@ if is_torch_available():
 
             self.current_file = 0
 
+        def _load_manifest(self, manifest_file: str | None, recursive: bool) -> list[tuple[str, int]] | None:
+            if not manifest_file:
+                return None
+            fs, path = url_to_fs(manifest_file)
+            if not fs.exists(path):
+                return None
+            with fs.open(path, "rt") as f:
+                manifest = json.load(f)
+            if (manifest["folder_path"], manifest["filename_pattern"], manifest["recursive"]) != (
+                self.folder_path,
+                self.filename_pattern,
+                recursive,
+            ):
+                logger.warning(f"Manifest {manifest_file} was created for different arguments, listing files again.")
+                return None
+            return [(path, size) for path, size in manifest["files"]]
+
+        def _save_manifest(self, manifest_file: str, recursive: bool, files: list[tuple[str, int]]):
+            manifest = {
+                "folder_path": self.folder_path,
+                "filename_pattern": self.filename_pattern,
+                "recursive": recursive,
+                "files": files,
+            }
+            try:
+                fs, path = url_to_fs(manifest_file)
+                with fs.open(path, "wt") as f:
+                    json.dump(manifest, f)
+            except OSError as e:
+                logger.warning(f"Could not save manifest {manifest_file}: {e}")
+
         def __getitem__(self, item):
             # check if we are in the same file as before
             if not (self.lens[self.current_file] <= item < self.lens[self.current_file + 1]):
@@ -132,6 +236,25 @@ if is_torch_available():
             # subtract file starting offset
             return self.files[self.current_file][item - self.lens[self.current_file]]
 
+        def __getitems__(self, items: list[int]) -> list[dict]:
+            """
+                Get several samples at once, with a single batched read per file.
+            Args:
+                items: the indices of the samples
+
+            Returns:
+                list[dict]: one sample per index, in the order of `items`
+            """
+            items = np.asarray(items, dtype=np.int64)
+            file_ids = np.searchsorted(self.lens, items, side="right") - 1
+            samples = [None] * len(items)
+            for file_id in np.unique(file_ids).tolist():
+                positions = np.flatnonzero(file_ids == file_id)
+                file_samples = self.files[file_id].__getitems__((items[positions] - self.lens[file_id]).tolist())
+                for position, sample in zip(positions.tolist(), file_samples):
+                    samples[position] = sample
+            return samples
+
         def __len__(self):
             return self.lens[-1] if self.lens else 0
 else:
@@ -50,3 +50,77 @@ def create_hash_func(config: HashConfig) -> Callable[[str], int]:
         return xxhash32 if config.precision == 32 else xxhash64
     else:
         raise ValueError(f"Unknown {config.hash_fc=}")
+
+
+# odd 64-bit constant (2**64 / golden ratio) used to combine token hashes
+_NGRAM_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def hash_ngrams(token_hashes: np.ndarray, n: int, precision: Literal[32, 64] = 64) -> np.ndarray:
+    """Vectorized hashing of all the n-grams of a sequence of tokens.
+        Instead of joining the tokens of each n-gram into a string and hashing it, the (64-bit) hashes of the
+        `n` tokens of each window are combined with a polynomial rolling hash over the whole array at once, and then
+        mixed with the murmur3 finalizer. Hashes are NOT the same as hashing the joined n-gram strings.
+
+    Args:
+        token_hashes: uint64 array with one hash per token
+        n: n-gram size
+        precision: 32 or 64. 32-bit hashes keep the upper 32 bits of the 64-bit hash
+
+    Returns:
+        uint64 array of size max(0, len(token_hashes) - n + 1) with the hash of each n-gram
+    """
+    token_hashes = np.asarray(token_hashes, dtype=np.uint64)
+    if len(token_hashes) < n:
+        return np.empty(0, dtype=np.uint64)
+    windows = np.lib.stride_tricks.sliding_window_view(token_hashes, n)
+    # uint64 arithmetic wraps around, which is what we want here
+    h = windows[:, 0].copy()
+    for i in range(1, n):
+        h *= _NGRAM_HASH_MULTIPLIER
+        h += windows[:, i]
+    _fmix64(h)
+    if precision == 32:
+        h >>= np.uint64(32)
+    return h
+
+
+def _fmix64(h: np.ndarray):
+    # murmur3 64-bit finalizer (in place)
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xFF51AFD7ED558CCD)
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xC4CEB9FE1A85EC53)
+    h ^= h >> np.uint64(33)
+
+
+def hash_chars(text: str) -> np.ndarray:
+    """Vectorized 64-bit hashing of each character of a string, ignoring whitespace.
+        Used to build character n-grams without any word tokenization (for instance for languages that do not
+        separate words with spaces, such as Chinese or Japanese) with `hash_ngrams`.
+
+    Args:
+        text: input text
+
+    Returns:
+        uint64 array with one hash per non whitespace character
+    """
+    h = np.frombuffer("".join(text.split()).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    # codepoints are small: spread them over the 64 bits
+    h *= _NGRAM_HASH_MULTIPLIER
+    _fmix64(h)
+    return h
+
+
+def hash_char_ngrams(text: str, n: int, precision: Literal[32, 64] = 64) -> np.ndarray:
+    """Vectorized hashing of all the character n-grams of a string, ignoring whitespace. See `hash_chars`
+
+    Args:
+        text: input text
+        n: n-gram size (in characters)
+        precision: 32 or 64
+
+    Returns:
+        uint64 array with the hash of each n-gram
+    """
+    return hash_ngrams(hash_chars(text), n, precision)
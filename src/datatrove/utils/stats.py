@@ -238,6 +238,28 @@ class MetricStats:
         if self.n > 1:
             self._running_variance += delta * (x - self.mean)
 
+    @classmethod
+    def from_values(cls, values, unit: str = None) -> "MetricStats":
+        """
+            Stats equivalent to calling `update` once for each value, for values in a numpy array
+        Args:
+          values: 1D numpy array
+          unit: str:  (Default value = None)
+
+        Returns:
+
+        """
+        stats = cls(unit=unit) if unit else cls()
+        if len(values) == 0:
+            return stats
+        stats.total = values.sum().item()
+        stats.n = len(values)
+        stats.mean = float(values.mean())
+        stats.min = values.min().item()
+        stats.max = values.max().item()
+        stats._running_variance = float(((values - stats.mean) ** 2).sum())
+        return stats
+
     @property
     def variance(self):
         return self._running_variance / (self.n - 1) if self.n > 1 else 0.0
@@ -267,6 +267,33 @@ def ngrams(sequence: Iterable, n: int):
     return zip(*iterables)  # Unpack and flattens the iterables.
 
 
+# terminal punctuation (including full-width CJK marks) followed by closing quotes/brackets, or line breaks
+SENTENCE_END_PATTERN = re.compile(r"[.!?。！？…]+[\"'”’」』）)\]]*|\n")
+
+
+def split_sentence_spans(text: str) -> list[tuple[int, int]]:
+    """Tokenizer-free sentence splitting: sentences end with terminal punctuation (including the full-width CJK marks)
+        or line breaks. Cheaper than the word tokenizers' sentence splitting, and works the same for all languages
+
+    Args:
+        text: input text
+
+    Returns:
+        list of (start, end) spans of each sentence, without the surrounding whitespace (same format as
+        `span_tokenize`)
+    """
+    spans = []
+    start = 0
+    for end in [match.end() for match in SENTENCE_END_PATTERN.finditer(text)] + [len(text)]:
+        sentence = text[start:end]
+        if sentence.strip():
+            spans.append(
+                (start + len(sentence) - len(sentence.lstrip()), end - len(sentence) + len(sentence.rstrip()))
+            )
+        start = end
+    return spans
+
+
 SPLIT_TEXT_DOCUMENTS = "DOCUMENT"
 SPLIT_TEXT_SENTENCES = "SENTENCE"
 SPLIT_TEXT_PARAGRAPHS = "PARAGRAPH"
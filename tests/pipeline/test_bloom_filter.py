@@ -1,3 +1,4 @@
+import os
 import shutil
 import tempfile
 import unittest
@@ -107,3 +108,45 @@ class BloomFilter(unittest.TestCase):
         # print(f"False probability = {fp:.3}")
         # print(f"Optimal K given total shingles = {get_optimal_k(bloom_filter.m_bytes, bloom_filter.total_shingles)}")
         # print(f"{bloom_filter.total_shingles=}")
+
+    @use_hash_configs(precision=[32])
+    def test_char_shingles(self, hash_config):
+        bloom_filter = SingleBloomFilter(
+            output_folder=self.tmp_dir,
+            config=BloomFilterConfig(
+                m_bytes=2**12 - 1, k=7, expected_elements=300, tokenization="char", hash_config=hash_config
+            ),
+        )
+        text = "今天天气很好，我们一起去公园散步吧。公园里有很多人在跑步，孩子们在草地上玩耍。"
+        docs = [Document(text=text, id="0"), Document(text="这是一个完全不同的句子，和前面的内容没有关系。", id="1")]
+        docs.append(Document(text=text[:-1] + "。", id="2"))
+        self.assertEqual([bloom_filter.step(doc) for doc in docs], [True, True, False])
+
+    @use_hash_configs(precision=[32])
+    def test_shared(self, hash_config):
+        config = BloomFilterConfig(m_bytes=2**10 - 1, k=7, expected_elements=866, hash_config=hash_config)
+        shared_path = os.path.join(self.tmp_dir, "shared", "bloom_filter.bloom")
+        bloom_filters = [
+            SingleBloomFilter(
+                output_folder=self.tmp_dir,
+                config=config,
+                save_bloom_filter=True,
+                shared_path=shared_path,
+                lock_stripes=3,
+            )
+            for _ in range(2)
+        ]
+        # the shared file is the saved filter: tasks do not overwrite each other's output
+        self.assertFalse(any(bloom_filter.save_bloom_filter for bloom_filter in bloom_filters))
+        # alternating between the two tasks gives the same result as a single filter
+        for doc_idx, doc in enumerate(DOCS):
+            self.assertEqual(bloom_filters[doc_idx % 2].step(doc), TARGETS[doc_idx])
+
+        # every task sees the same bits, stored in the shared file
+        reference = SingleBloomFilter(output_folder=self.tmp_dir, config=config)
+        for doc in DOCS:
+            reference.step(doc)
+        for bloom_filter in bloom_filters:
+            bloom_filter._close_bit_vector()
+        with open(shared_path, "rb") as f:
+            self.assertEqual(f.read(), reference.bit_vector.tobytes())
@@ -0,0 +1,76 @@
+import copy
+import shutil
+import tempfile
+import unittest
+
+from datatrove.data import Document
+from datatrove.pipeline.dedup.exact_dedup import (
+    ExactDedupConfig,
+    ExactDedupFilter,
+    ExactDedupSignature,
+    ExactFindDedups,
+)
+from tests.utils import require_xxhash, use_hash_configs
+
+
+DOCS = [
+    Document(text="今天天气很好，我们去公园吧。", metadata={"date": "2024-01-02T00:00:00Z"}, id="0"),
+    Document(text="A completely different document.", id="1"),
+    Document(text="今天天气很好，我们去公园吧。\n\n更多内容，请关注我们。", metadata={"date": "2023-05-01"}, id="2"),
+    Document(text="  今天天气很好，我们去公园吧。 ", metadata={"date": "2024-03-01T12:00:00+00:00"}, id="3"),
+    Document(text="a completely   different document", id="4"),
+    Document(text="今天天气很好，我们去公园吧。\n\n更多内容，请关注我们。", metadata={"date": "2024-06-01"}, id="5"),
+]
+
+
+@require_xxhash
+class ExactDedup(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def dedup(self, config, finder_workers=1, world_size=1, **finder_kwargs):
+        signature_creation = ExactDedupSignature(
+            output_folder=self.tmp_dir + "/sigs", finder_workers=finder_workers, config=config
+        )
+        find_duplicates = ExactFindDedups(
+            data_folder=self.tmp_dir + "/sigs", output_folder=self.tmp_dir + "/dups", config=config, **finder_kwargs
+        )
+        dedup_filter = ExactDedupFilter(data_folder=self.tmp_dir + "/dups", config=config)
+
+        shards = [DOCS[rank::world_size] for rank in range(world_size)]
+        for rank, shard in enumerate(shards):
+            signature_creation(data=shard, rank=rank, world_size=world_size)
+        for rank in range(finder_workers):
+            find_duplicates(rank=rank, world_size=finder_workers)
+        return sorted(
+            doc.id
+            for rank, shard in enumerate(shards)
+            for doc in dedup_filter(data=copy.deepcopy(shard), rank=rank, world_size=world_size)
+        )
+
+    @use_hash_configs()
+    def test_exact_deduplication(self, hash_config):
+        self.assertEqual(self.dedup(ExactDedupConfig(hash_config=hash_config)), ["0", "1", "2"])
+
+    def test_keep(self):
+        # length of the original text. Ties are kept in order (lowest rank, then lowest document index)
+        self.assertEqual(self.dedup(ExactDedupConfig(keep="longest")), ["2", "3", "4"])
+        shutil.rmtree(self.tmp_dir)
+        self.assertEqual(self.dedup(ExactDedupConfig(keep="longest"), world_size=2), ["2", "3", "4"])
+        shutil.rmtree(self.tmp_dir)
+        self.assertEqual(self.dedup(ExactDedupConfig(keep="newest")), ["1", "3", "5"])
+
+    def test_distributed_find_dups(self):
+        # several signature tasks and finder workers, small buffers to merge the files block by block
+        for finder_workers in (1, 3):
+            shutil.rmtree(self.tmp_dir)
+            ids = self.dedup(
+                ExactDedupConfig(keep="newest"),
+                finder_workers=finder_workers,
+                world_size=3,
+                lines_to_buffer=1,
+                max_memory_size=0,
+            )
+            self.assertEqual(ids, ["1", "3", "5"])
@@ -0,0 +1,86 @@
+import shutil
+import tempfile
+import unittest
+
+from datatrove.data import Document
+from datatrove.pipeline.readers.ipc import IpcReader
+from datatrove.pipeline.writers.ipc import IpcWriter
+
+from ..utils import require_pyarrow
+
+
+@require_pyarrow
+class TestIpcWriter(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.data = [
+            Document(text=text, id=str(i), metadata={"somedata": 2 * i, "somefloat": i * 0.4, "somestring": "hello"})
+            for i, text in enumerate(["hello", "text2", "more text"])
+        ]
+
+    def check_roundtrip(self, reader):
+        c = 0
+        for read_doc, original in zip(reader(), self.data):
+            read_doc.metadata.pop("file_path", None)
+            assert read_doc == original
+            c += 1
+        assert c == len(self.data)
+
+    def test_write(self):
+        with IpcWriter(output_folder=self.tmp_dir, batch_size=2) as w:
+            for doc in self.data:
+                w.write(doc)
+        self.check_roundtrip(IpcReader(self.tmp_dir))
+
+    def test_write_compressed_stream(self):
+        for compression in ("lz4", "zstd"):
+            with self.subTest(compression):
+                with IpcWriter(output_folder=self.tmp_dir, batch_size=2, compression=compression, stream=True) as w:
+                    for doc in self.data:
+                        w.write(doc)
+                self.check_roundtrip(IpcReader(self.tmp_dir, stream=True))
+
+    def test_max_file_size(self):
+        with IpcWriter(output_folder=self.tmp_dir, batch_size=1, max_file_size=1) as w:
+            for doc in self.data:
+                w.write(doc)
+        self.assertEqual(len(w.output_folder.list_files()), len(self.data))
+        self.check_roundtrip(IpcReader(self.tmp_dir))
+
+    def test_max_file_docs(self):
+        import pyarrow as pa
+
+        data = [Document(text=f"document number {i}", id=str(i)) for i in range(10)]
+        with IpcWriter(output_folder=self.tmp_dir, max_file_docs=3) as w:
+            for doc in data:
+                w.write(doc)
+        files = sorted(w.output_folder.list_files())
+        # documents pending in the batch go to the file they were assigned to
+        self.assertEqual(
+            [pa.ipc.open_file(w.output_folder.resolve_paths(file)).read_all().num_rows for file in files],
+            [3, 3, 3, 1],
+        )
+
+    def test_max_open_files_interleaved(self):
+        import pyarrow as pa
+
+        # more partitions than open files, interleaved: each eviction must not create a tiny file
+        data = [Document(text=f"document number {i}", id=str(i), metadata={"bucket": i % 7}) for i in range(700)]
+        with IpcWriter(
+            output_folder=self.tmp_dir, output_filename="${bucket}/${rank}.arrow", batch_size=10, max_open_files=3
+        ) as w:
+            for doc in data:
+                w.write(doc)
+                self.assertLessEqual(len(w.output_mg.get_open_files()), 3)
+        files = w.output_folder.list_files()
+        # files are only opened to write full batches
+        self.assertTrue(
+            all(pa.ipc.open_file(w.output_folder.resolve_paths(file)).read_all().num_rows >= 10 for file in files)
+        )
+        self.assertLessEqual(len(files), 70)
+        read_docs = list(IpcReader(self.tmp_dir)())
+        for read_doc in read_docs:
+            read_doc.metadata.pop("file_path", None)
+        self.assertEqual(sorted(read_docs, key=lambda doc: int(doc.id)), data)
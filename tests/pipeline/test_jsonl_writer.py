@@ -0,0 +1,107 @@
+import shutil
+import tempfile
+import unittest
+
+from datatrove.data import Document
+from datatrove.pipeline.readers.jsonl import JsonlReader
+from datatrove.pipeline.writers.disk_base import DiskWriter
+from datatrove.pipeline.writers.jsonl import JsonlWriter
+
+
+class TestJsonlWriter(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.data = [
+            Document(text=f"document number {i}", id=str(i), metadata={"somedata": 2 * i, "somestring": "hello"})
+            for i in range(50)
+        ]
+
+    def check_roundtrip(self, output_folder, compression):
+        reader = JsonlReader(output_folder, compression=compression)
+        read_docs = list(reader())
+        for read_doc in read_docs:
+            read_doc.metadata.pop("file_path", None)
+        self.assertEqual(sorted(read_docs, key=lambda doc: int(doc.id)), self.data)
+
+    def test_buffered(self):
+        for compression in ("gzip", "zstd", None):
+            with self.subTest(compression):
+                output_folder = f"{self.tmp_dir}/{compression}"
+                with JsonlWriter(output_folder, compression=compression, buffered=True, buffer_size=100) as w:
+                    for doc in self.data:
+                        w.write(doc)
+                self.check_roundtrip(output_folder, compression)
+
+    def test_buffered_max_file_size(self):
+        # the uncompressed size is tracked when writing, so files are switched at the same documents regardless of
+        # the progress of the background thread: one file per document here
+        with JsonlWriter(self.tmp_dir, compression="gzip", buffered=True, buffer_size=2**20, max_file_size=1) as w:
+            for doc in self.data:
+                w.write(doc)
+        self.assertEqual(len(w.output_folder.list_files()), len(self.data))
+        self.check_roundtrip(self.tmp_dir, "gzip")
+
+    def test_buffered_unsupported_compression(self):
+        with self.assertRaises(ValueError):
+            JsonlWriter(self.tmp_dir, compression="bz2", buffered=True)
+
+    def test_max_file_docs(self):
+        for buffered in (False, True):
+            with self.subTest(buffered=buffered):
+                output_folder = f"{self.tmp_dir}/{buffered}"
+                with JsonlWriter(output_folder, buffered=buffered, max_file_docs=20) as w:
+                    for doc in self.data:
+                        w.write(doc)
+                self.assertEqual(
+                    w.output_folder.list_files(), ["000_00000.jsonl.gz", "001_00000.jsonl.gz", "002_00000.jsonl.gz"]
+                )
+                self.check_roundtrip(output_folder, "gzip")
+
+    def test_max_file_size_compressed(self):
+        with JsonlWriter(self.tmp_dir, compression="gzip", max_file_size=1) as w:
+            for doc in self.data:
+                w.write(doc)
+                # flush the compressed stream so that its size can be measured
+                w.output_mg.get_open_files()[w._get_filename_with_file_id("00000.jsonl.gz")].flush()
+        self.assertEqual(len(w.output_folder.list_files()), len(self.data))
+        self.check_roundtrip(self.tmp_dir, "gzip")
+
+    def test_text_mode_max_file_docs(self):
+        class TextWriter(DiskWriter):
+            default_output_filename = "${rank}.txt"
+
+            def _write(self, document: dict, file_handler, filename: str):
+                file_handler.write(document["text"] + "\n")
+
+        with TextWriter(self.tmp_dir, compression=None, mode="wt", max_file_docs=30) as w:
+            for doc in self.data:
+                w.write(doc)
+        files = w.output_folder.list_files()
+        self.assertEqual(files, ["000_00000.txt", "001_00000.txt"])
+        lines = [line for file in files for line in w.output_folder.open(file, "rt").read().splitlines()]
+        self.assertEqual(lines, [doc.text for doc in self.data])
+
+    def test_max_open_files(self):
+        data = [
+            Document(text=f"document number {i}", id=str(i), metadata={"bucket": i % 7}) for i in range(len(self.data))
+        ]
+        for compression, buffered in (("gzip", False), ("zstd", True), (None, False)):
+            with self.subTest(compression=compression, buffered=buffered):
+                output_folder = f"{self.tmp_dir}/{compression}"
+                with JsonlWriter(
+                    output_folder,
+                    output_filename="${bucket}/${rank}.jsonl",
+                    compression=compression,
+                    buffered=buffered,
+                    max_open_files=3,
+                ) as w:
+                    for doc in data:
+                        w.write(doc)
+                        self.assertLessEqual(len(w.output_mg.get_open_files()), 3)
+                self.assertEqual(len(w.output_folder.list_files()), 7)
+                read_docs = list(JsonlReader(output_folder, compression=compression)())
+                for read_doc in read_docs:
+                    read_doc.metadata.pop("file_path", None)
+                self.assertEqual(sorted(read_docs, key=lambda doc: int(doc.id)), data)
@@ -6,19 +6,26 @@ import tempfile
 import unittest
 from collections import defaultdict, deque
 from math import floor
+from unittest import mock
 
 import numpy as np
 
 from datatrove.data import Document
 from datatrove.io import get_datafolder
 from datatrove.pipeline.dedup.minhash import (
+    MinhashBuildIndex,
+    MinhashCompactIndex,
     MinhashConfig,
     MinhashDedupBuckets,
     MinhashDedupCluster,
     MinhashDedupFilter,
     MinhashDedupSignature,
+    SigBlockReader,
+    connected_components,
+    plan_index_compaction,
     read_sigs,
 )
+from datatrove.utils.text import simplify_text
 
 from ..utils import require_nltk, require_xxhash, use_hash_configs
 
@@ -86,6 +93,78 @@ class TestMinhash(unittest.TestCase):
                     doc_ids.add(doc_id)
                 assert len(doc_ids) == 100
 
+    @use_hash_configs()
+    def test_signature_batching(self, hash_config):
+        config = MinhashConfig(hash_config=hash_config)
+        samples = [Document(f"sample {i}, {lorem_ipsum[i::10]}" if i % 7 else "", id="test") for i in range(100)]
+        outputs = []
+        # one doc at a time and spilling to disk / batched and sorted in memory
+        for batch_size, sig_buffer_docs in ((1, 9), (32, 100_000)):
+            output_folder = os.path.join(self.tmp_dir, f"signatures_{batch_size}")
+            minhash = MinhashDedupSignature(
+                output_folder=output_folder, config=config, batch_size=batch_size, sig_buffer_docs=sig_buffer_docs
+            )
+            minhash(samples)
+            outputs.append(
+                [
+                    minhash.output_folder.open(f"bucket_{bi:03d}/00000.minhash.sig", "rb").read()
+                    for bi in range(config.num_buckets)
+                ]
+            )
+        assert outputs[0] == outputs[1]
+        # batched signatures match the single document ones
+        shingles = [minhash.get_shingles(sample.text) for sample in samples[1:10] if sample.text]
+        sigs = minhash.get_signatures_batch(shingles)
+        for shingle, sig in zip(shingles, sigs):
+            assert sig.tolist() == sum(minhash.get_signature(shingle), [])
+        # hashed in several groups when they don't fit in MAX_SIGNATURE_BATCH_BYTES
+        max_batch_bytes = 100 * minhash.num_hashes * 8
+        with mock.patch("datatrove.pipeline.dedup.minhash.MAX_SIGNATURE_BATCH_BYTES", max_batch_bytes):
+            assert minhash.get_signatures_batch(shingles).tolist() == sigs.tolist()
+
+    @use_hash_configs()
+    def test_rolling_shingles(self, hash_config):
+        legacy = MinhashDedupSignature(output_folder=self.tmp_dir, config=MinhashConfig(hash_config=hash_config))
+        config = MinhashConfig(hash_config=hash_config, shingle_hashing="rolling")
+        minhash = MinhashDedupSignature(output_folder=self.tmp_dir, config=config)
+        texts = [lorem_ipsum[i * 300 : i * 300 + 600] for i in range(10)] + ["too short", ""]
+
+        # batched shingling matches shingling each text separately, and the legacy number of shingles
+        batch_shingles = minhash.get_shingles_batch(texts)
+        for text, shingles in zip(texts, batch_shingles):
+            assert shingles.dtype == np.uint64
+            assert np.array_equal(shingles, minhash.get_shingles(text))
+            assert shingles.shape == legacy.get_shingles(text).shape
+            assert np.all(shingles <= hash_config.max)
+
+        # check similarity approximation
+        sig = minhash.get_signature(minhash.get_shingles(lorem_ipsum))
+        for pctd in range(0, 100, 10):
+            dec = pctd / 100
+            endp = floor(len(lorem_ipsum) * dec)
+            textd = lorem_ipsum[:endp] + lorem_ipsum[len(lorem_ipsum) - 1 : endp : -1]
+            sigd = minhash.get_signature(minhash.get_shingles(textd))
+            simil = sum([1 if a == b else 0 for ba, bb in zip(sig, sigd) for a, b in zip(ba, bb)]) / minhash.num_hashes
+            assert dec - 0.21 < simil < dec + 0.21
+
+    @use_hash_configs()
+    def test_char_shingles(self, hash_config):
+        config = MinhashConfig(hash_config=hash_config, tokenization="char", n_grams=3)
+        minhash = MinhashDedupSignature(output_folder=self.tmp_dir, config=config)
+        text = "今天天气很好，我们一起去公园散步吧。公园里有很多人在跑步，孩子们在草地上玩耍。"
+        texts = [text, text[:20] + " 晚上我们去吃饭 " + text[20:], "有点短", "太短"]
+
+        batch_shingles = minhash.get_shingles_batch(texts)
+        for t, shingles in zip(texts, batch_shingles):
+            assert np.array_equal(shingles, minhash.get_shingles(t))
+        # whitespace (and punctuation, removed by the normalization) is ignored: one shingle per character trigram
+        assert len(batch_shingles[0]) == len(simplify_text(text, config.norm_config).replace(" ", "")) - 2
+        assert len(batch_shingles[2]) == 1 and len(batch_shingles[3]) == 0
+
+        sig, sigd = (minhash.get_signature(shingles) for shingles in batch_shingles[:2])
+        simil = sum([1 if a == b else 0 for ba, bb in zip(sig, sigd) for a, b in zip(ba, bb)]) / minhash.num_hashes
+        assert simil > 0.6
+
     @use_hash_configs()
     def test_buckets_and_cluster(self, hash_config):
         sigs_folder = os.path.join(self.tmp_dir, "b_signatures")
@@ -214,6 +293,166 @@ class TestMinhash(unittest.TestCase):
             cluster_ids.add(doc.metadata["minhash_cluster_id"])
         assert len(cluster_ids) == 5  # number of clusters with > 1 element + 1 (empty cluster has id -1)
 
+    def test_connected_components(self):
+        # 0-3-5, 1-4, 2, 6-7-8
+        a, b = np.array([5, 4, 3, 8, 7]), np.array([3, 1, 0, 7, 6])
+        assert connected_components(a, b, 9).tolist() == [0, 1, 2, 0, 1, 0, 6, 6, 6]
+
+    @use_hash_configs()
+    def test_cluster_workers(self, hash_config):
+        sigs_folder = os.path.join(self.tmp_dir, "b_signatures")
+        buckets_folder = os.path.join(self.tmp_dir, "b_buckets")
+        config = MinhashConfig(hash_config=hash_config)
+
+        signatures_block = MinhashDedupSignature(output_folder=sigs_folder, config=config)
+        samples = [Document(text=lorem_ipsum[x : x + 300], id="?") for x in range(0, len(lorem_ipsum) - 300, 15)]
+        for rank in range(2):
+            signatures_block(samples[rank::2], rank=rank)
+        buckets_block = MinhashDedupBuckets(input_folder=sigs_folder, output_folder=buckets_folder, config=config)
+        for b in range(config.num_buckets):
+            buckets_block(None, rank=b, world_size=config.num_buckets)
+
+        outputs = []
+        for workers in (1, 3):
+            cluster_block = MinhashDedupCluster(
+                buckets_folder,
+                os.path.join(self.tmp_dir, f"clusters_{workers}"),
+                config=config,
+                save_cluster_id=True,
+                save_cluster_size=True,
+                workers=workers,
+            )
+            cluster_block(None)
+            outputs.append(
+                {
+                    file: cluster_block.output_folder.open(file, "rb").read()
+                    for file in cluster_block.output_folder.list_files()
+                }
+            )
+        assert outputs[0] == outputs[1]
+        # the first document of each cluster is kept
+        kept, members = defaultdict(list), defaultdict(list)
+        for file in ("000000", "000001"):
+            removed = set(np.frombuffer(outputs[0][f"{file}.remove"], dtype="<u4").tolist())
+            for doc, cluster_id in np.frombuffer(outputs[0][f"{file}.clusters"], dtype="<u4").reshape(-1, 2):
+                members[cluster_id].append((file, doc))
+                if doc not in removed:
+                    kept[cluster_id].append((file, doc))
+        assert len(kept) == cluster_block.stats["clusters"].total
+        assert all(kept[cluster_id] == [min(docs)] for cluster_id, docs in members.items())
+
+    @use_hash_configs()
+    def test_block_merge(self, hash_config):
+        sigs_folder = os.path.join(self.tmp_dir, "b_signatures")
+        config = MinhashConfig(hash_config=hash_config)
+
+        signatures_block = MinhashDedupSignature(output_folder=sigs_folder, config=config)
+        samples = [Document(text=lorem_ipsum[x : x + 200], id="?") for x in range(0, len(lorem_ipsum) - 200, 10)]
+        # 3 signature files per bucket, with duplicates across files
+        for rank in range(3):
+            signatures_block(samples[rank * 50 : rank * 50 + 200], rank=rank)
+
+        outputs = []
+        # everything loaded and sorted at once / merged reading 2 signatures at a time from each file
+        for name, kwargs in (("in_memory", {}), ("blocks", {"lines_to_buffer": 2, "max_memory_size": 0})):
+            buckets_block = MinhashDedupBuckets(
+                input_folder=sigs_folder, output_folder=os.path.join(self.tmp_dir, name), config=config, **kwargs
+            )
+            for b in range(config.num_buckets * 2):
+                buckets_block(None, rank=b, world_size=config.num_buckets * 2)
+            outputs.append(
+                [
+                    buckets_block.output_folder.open(file, "rb").read()
+                    for file in buckets_block.output_folder.list_files()
+                ]
+            )
+        assert outputs[0] == outputs[1]
+        assert any(len(dups) > 0 for dups in outputs[0])
+        assert buckets_block.stats["total_matches"].total == sum(len(dups) for dups in outputs[1]) // 16
+
+    @use_hash_configs()
+    def test_sig_block_reader_range(self, hash_config):
+        config = MinhashConfig(hash_config=hash_config)
+        hash_format = hash_config.struct_format
+        dtype = np.dtype(
+            [(f"field{i + 1}", f"<{hash_format}") for i in range(config.hashes_per_bucket)] + [("doc", "<I")]
+        )
+        records = np.zeros(1000, dtype=dtype)
+        for i in range(config.hashes_per_bucket):
+            records[f"field{i + 1}"] = np.arange(1000) * 7 + i
+        records["doc"] = np.arange(1000)
+        folder = get_datafolder(self.tmp_dir)
+        with folder.open("0.minhash.sig", "wb") as f:
+            f.write(records.tobytes())
+
+        for lines_to_buffer in (-1, 3):
+            with self.subTest(lines_to_buffer=lines_to_buffer), folder.open("0.minhash.sig", "rb") as f:
+                reader = SigBlockReader(f, config, min_hash=700, max_hash=1400, lines_to_buffer=lines_to_buffer)
+                sigs, doc_ids = [], []
+                while not reader.exhausted:
+                    reader.fill()
+                    block_sigs, block_doc_ids = reader.take()
+                    sigs.append(block_sigs)
+                    doc_ids.append(block_doc_ids)
+                # only the records of the hash range were read
+                self.assertEqual(f.tell(), 200 * dtype.itemsize)
+                self.assertEqual(np.concatenate(doc_ids).tolist(), list(range(100, 200)))
+                self.assertEqual(np.concatenate(sigs)[:, 0].tolist(), list(range(700, 1400, 7)))
+
+    def test_plan_index_compaction(self):
+        # 4 similar small segments are merged, the big one is left alone
+        merges = plan_index_compaction({"a": 10, "b": 12, "c": 11, "d": 30, "big": 1000}, fanout=4, max_segments=16)
+        assert len(merges) == 1 and sorted(merges[0][0]) == ["a", "b", "c", "d"]
+        # merges cascade: the result of the first merge is merged with 3 other segments of its size
+        merges = plan_index_compaction(
+            {"a": 1, "b": 1, "c": 1, "d": 1, "e": 5, "f": 5, "g": 5}, fanout=4, max_segments=16
+        )
+        assert len(merges) == 2 and merges[0][1] in merges[1][0] and len(merges[1][0]) == 4
+        # max_segments: the smallest segments are merged
+        merges = plan_index_compaction({"a": 1, "b": 100, "c": 10000}, fanout=4, max_segments=2)
+        assert [sorted(segments) for segments, _ in merges] == [["a", "b"]]
+        assert plan_index_compaction({"a": 1, "b": 1, "c": 1}, fanout=4, max_segments=3) == []
+
+    @use_hash_configs()
+    def test_compact_index(self, hash_config):
+        index_folder = os.path.join(self.tmp_dir, "index")
+        config = MinhashConfig(hash_config=hash_config)
+        samples = [Document(text=lorem_ipsum[x : x + 200], id="?") for x in range(0, len(lorem_ipsum) - 200, 10)]
+
+        # one index segment per "crawl", with overlapping documents
+        for crawl in range(5):
+            sigs_folder = os.path.join(self.tmp_dir, f"signatures_{crawl}")
+            MinhashDedupSignature(output_folder=sigs_folder, config=config)(samples[crawl * 20 : crawl * 20 + 60])
+            for bucket in range(config.num_buckets):
+                MinhashBuildIndex(sigs_folder, index_folder, f"crawl_{crawl}", config=config).run(
+                    bucket=bucket, world_size=config.num_buckets
+                )
+
+        sigs_folder = os.path.join(self.tmp_dir, "signatures")
+        MinhashDedupSignature(output_folder=sigs_folder, config=config)(samples)
+
+        def find_dups(output_folder):
+            buckets_block = MinhashDedupBuckets(sigs_folder, output_folder, index_folder=index_folder, config=config)
+            for bucket in range(config.num_buckets):
+                buckets_block(None, rank=bucket, world_size=config.num_buckets)
+            return [
+                buckets_block.output_folder.open(file, "rb").read()
+                for file in buckets_block.output_folder.list_files()
+            ]
+
+        dups = find_dups(os.path.join(self.tmp_dir, "dups_before"))
+        assert any(dups)
+
+        compact_block = MinhashCompactIndex(index_folder, config=config, fanout=3, max_segments=2)
+        for bucket in range(config.num_buckets):
+            compact_block.run(bucket=bucket, world_size=config.num_buckets)
+        index_df = get_datafolder(index_folder)
+        for bucket in range(config.num_buckets):
+            index_files = index_df.list_files(subdirectory=f"bucket_{bucket:03d}")
+            assert 1 <= len(index_files) <= 2
+            assert all(file.endswith(".minhash.index") for file in index_files)
+        assert find_dups(os.path.join(self.tmp_dir, "dups_after")) == dups
+
     @use_hash_configs()
     def test_multiprocess_s2(self, hash_config):
         sigs_folder = os.path.join(self.tmp_dir, "b_signatures")
@@ -1,10 +1,14 @@
 import copy
+import os
 import shutil
 import tempfile
 import unittest
 
+import numpy as np
+
 from datatrove.data import Document
 from datatrove.pipeline.decont import NGramsDecontConfig, NGramsDecontFilter, NGramsDecontIndexer
+from datatrove.utils.text import ngrams, simplify_text
 from tests.utils import require_xxhash, use_hash_configs
 
 
@@ -64,3 +68,32 @@ class TestNGramDecont(unittest.TestCase):
             self.get_test_results(NGramsDecontConfig(find_query_ngrams=False, find_overlap_ngrams=True)),
             (0, 3, 4, 5, 6),
         )
+
+    @use_hash_configs()
+    def test_filter_index(self, hash_config):
+        config = NGramsDecontConfig(n_grams=4, hash_config=hash_config)
+        nfilter = NGramsDecontFilter(self.tmp_dir, config=config)
+
+        def save_index(task_name, texts):
+            hashes = [
+                nfilter.hash_func(" ".join(n_gram))
+                for text in texts
+                for n_gram in ngrams(nfilter.tokenizer.word_tokenize(simplify_text(text)), config.n_grams)
+            ]
+            np.array(hashes, dtype=hash_config.np_descr).tofile(
+                os.path.join(self.tmp_dir, f"{task_name}.index.hashes")
+            )
+
+        save_index("suite:task_a", [TEXTS[1], TEXTS[4]])
+        save_index("suite:task_b", [TEXTS[4]])
+        save_index("suite:task_c", [])
+
+        docs = copy.deepcopy(DOCS)
+        self.assertEqual(tuple(int(doc.id) for doc in nfilter(docs)), (0, 2, 3, 5))
+        # the merged index is memory mapped from a local cache
+        self.assertIsInstance(nfilter._index_hashes, np.memmap)
+        self.assertEqual(docs[1].metadata["contaminated_task"], "suite:task_a")
+        self.assertEqual(docs[1].metadata["contaminated_ngram"], "get into formation then")
+        # found in both tasks: the last one is reported
+        self.assertEqual(docs[4].metadata["contaminated_task"], "suite:task_b")
+        self.assertEqual(nfilter.stats["contaminated_tg_suite"].total, 3)
@@ -31,3 +31,91 @@ class TestParquetWriter(unittest.TestCase):
             assert read_doc == original
             c += 1
         assert c == len(data)
+
+    def test_max_open_files(self):
+        data = [Document(text=f"document number {i}", id=str(i), metadata={"bucket": i % 5}) for i in range(40)]
+        with ParquetWriter(
+            output_folder=self.tmp_dir, output_filename="${bucket}/${rank}.parquet", batch_size=3, max_open_files=2
+        ) as w:
+            for doc in data:
+                w.write(doc)
+                assert len(w.output_mg.get_open_files()) <= 2
+        # evicted files are finalized and the following row groups are written to a new file
+        assert len(w.output_folder.list_files()) > 5
+        reader = ParquetReader(self.tmp_dir)
+        read_docs = list(reader())
+        for read_doc in read_docs:
+            read_doc.metadata.pop("file_path", None)
+        assert sorted(read_docs, key=lambda doc: int(doc.id)) == data
+
+    def test_max_open_files_interleaved(self):
+        import pyarrow.parquet as pq
+
+        # many more partitions than open files, interleaved: each eviction must not create a tiny file
+        data = [Document(text=f"document number {i}", id=str(i), metadata={"bucket": i % 20}) for i in range(400)]
+        for async_write in (False, True):
+            output_folder = f"{self.tmp_dir}/{async_write}"
+            with ParquetWriter(
+                output_folder=output_folder,
+                output_filename="${bucket}/${rank}.parquet",
+                batch_size=5,
+                max_open_files=2,
+                async_write=async_write,
+            ) as w:
+                for doc in data:
+                    w.write(doc)
+                    assert len(w.output_mg.get_open_files()) <= 2
+            files = w.output_folder.list_files()
+            # files are only opened to write full batches
+            assert all(pq.ParquetFile(w.output_folder.resolve_paths(file)).metadata.num_rows >= 5 for file in files)
+            assert len(files) <= 20 * 4
+            read_docs = list(ParquetReader(output_folder)())
+            for read_doc in read_docs:
+                read_doc.metadata.pop("file_path", None)
+            assert sorted(read_docs, key=lambda doc: int(doc.id)) == data
+
+    def test_row_groups(self):
+        import pyarrow.parquet as pq
+
+        data = [
+            Document(text=f"document number {i}", id=str(i), metadata={"bucket": str(i % 3), "score": i / 10})
+            for i in range(100)
+        ]
+        for row_group_bytes, async_write, expected_row_groups in ((-1, False, 10), (2**20, True, 1), (1, True, 10)):
+            with ParquetWriter(
+                output_folder=self.tmp_dir,
+                batch_size=10,
+                expand_metadata=True,
+                row_group_bytes=row_group_bytes,
+                use_dictionary=["bucket"],
+                write_statistics=["score"],
+                write_page_index=True,
+                async_write=async_write,
+            ) as w:
+                for doc in data:
+                    w.write(doc)
+            metadata = pq.ParquetFile(w.output_folder.resolve_paths(w.output_folder.list_files()[0])).metadata
+            assert metadata.num_rows == len(data)
+            assert metadata.num_row_groups == expected_row_groups
+            columns = {metadata.schema.column(i).name: i for i in range(metadata.num_columns)}
+            row_group = metadata.row_group(0)
+            assert row_group.column(columns["score"]).is_stats_set
+            assert not row_group.column(columns["text"]).is_stats_set
+            assert "RLE_DICTIONARY" in row_group.column(columns["bucket"]).encodings
+            assert "RLE_DICTIONARY" not in row_group.column(columns["text"]).encodings
+            assert row_group.column(columns["score"]).has_offset_index
+
+    def test_async_max_file_size(self):
+        import pyarrow.parquet as pq
+
+        data = [Document(text=f"document number {i}", id=str(i)) for i in range(100)]
+        # the size of the batches handed to the background thread is tracked when writing: files are switched after
+        # each batch, even if nothing was written to disk yet
+        with ParquetWriter(
+            output_folder=self.tmp_dir, batch_size=10, max_file_size=1, row_group_bytes=2**20, async_write=True
+        ) as w:
+            for doc in data:
+                w.write(doc)
+        files = w.output_folder.list_files()
+        assert len(files) == 10
+        assert all(pq.ParquetFile(w.output_folder.resolve_paths(file)).metadata.num_rows == 10 for file in files)
@@ -169,6 +169,27 @@ class SentenceDedup(unittest.TestCase):
         for i, doc in enumerate(dedup_filter(data=copy.deepcopy(DOCS))):
             self.assertEqual(doc.text, TARGETS[i])
 
+    def test_sd_bounded_memory(self):
+        # signatures spilled to disk in sorted runs and merged, finder reading the files in small blocks
+        config = SentDedupConfig(min_doc_words=0, min_num_sentences=0)
+        signature_creation = SentenceDedupSignature(
+            output_folder=self.tmp_dir + "/sigs", config=config, sig_buffer_size=4
+        )
+        find_duplicates = SentenceFindDedups(
+            data_folder=self.tmp_dir + "/sigs",
+            output_folder=self.tmp_dir + "/dups",
+            config=config,
+            lines_to_buffer=2,
+            max_memory_size=0,
+        )
+        dedup_filter = SentenceDedupFilter(data_folder=self.tmp_dir + "/dups", config=config)
+
+        signature_creation(data=DOCS)
+        self.assertEqual(signature_creation.output_folder.list_files(subdirectory="runs"), [])
+        find_duplicates()
+        for i, doc in enumerate(dedup_filter(data=copy.deepcopy(DOCS))):
+            self.assertEqual(doc.text, TARGETS[i])
+
     def test_sd_with_index(self):
         config = SentDedupConfig(min_doc_words=0, min_num_sentences=0)
         signature_creation = SentenceDedupSignature(output_folder=self.tmp_dir + "/sigs", config=config)
@@ -234,3 +255,23 @@ class SentenceDedup(unittest.TestCase):
 
         for i, doc in enumerate(dedup_filter(data=copy.deepcopy(DOCS_2), rank=1, world_size=2)):
             self.assertEqual(doc.text, TARGETS_WS2_1[i])
+
+    def test_sd_char(self):
+        config = SentDedupConfig(min_doc_words=0, min_num_sentences=0, tokenization="char")
+        signature_creation = SentenceDedupSignature(output_folder=self.tmp_dir + "/sigs", config=config)
+        find_duplicates = SentenceFindDedups(
+            data_folder=self.tmp_dir + "/sigs", output_folder=self.tmp_dir + "/dups", config=config
+        )
+        dedup_filter = SentenceDedupFilter(data_folder=self.tmp_dir + "/dups", config=config)
+
+        sentences = ["今天天气很好。", "我们一起去公园散步吧！", "公园里有很多人在跑步。", "孩子们在草地上玩耍？"]
+        docs = [
+            Document(text="".join(sentences), id="0"),
+            Document(text="这是一个新的开头。" + "".join(sentences[:3]) + "最后我们回家了。", id="1"),
+        ]
+        signature_creation(data=docs)
+        find_duplicates()
+        self.assertEqual(
+            [doc.text for doc in dedup_filter(data=copy.deepcopy(docs))],
+            ["".join(sentences), "这是一个新的开头。最后我们回家了。"],
+        )
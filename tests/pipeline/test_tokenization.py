@@ -1,15 +1,29 @@
+import io
 import os
 import shutil
 import struct
 import tempfile
 import unittest
+from functools import partial
+from unittest import mock
 
 import numpy as np
+from fsspec.implementations.memory import MemoryFile
 
 from datatrove.data import Document
 from datatrove.io import DataFolder, get_datafolder
+from datatrove.pipeline.tokens.context_shuffler import DocumentTokenizerContextShuffler
+from datatrove.pipeline.tokens.counter import TokensCounter
+from datatrove.pipeline.tokens.megatron_tokenizer import MegatronTokenizedFile
 from datatrove.pipeline.tokens.merger import DocumentTokenizerMerger
-from datatrove.pipeline.tokens.tokenizer import DocumentTokenizer
+from datatrove.pipeline.tokens.mixer import DocumentTokenizerMixer
+from datatrove.pipeline.tokens.packer import DocumentTokenizerPacker, best_fit_decreasing
+from datatrove.pipeline.tokens.tokenizer import (
+    DocumentTokenizer,
+    TokenizedFile,
+    get_document_bounds,
+    read_documents,
+)
 from datatrove.tools.check_dataset import check_dataset, load_doc_ends
 from datatrove.utils._import_utils import is_tokenizers_available
 
@@ -106,3 +120,343 @@ class TestTokenization(unittest.TestCase):
 
                 # check order/reconstruction
                 self.check_order_reconstruction(input_folder, merge_mapping)
+
+    def test_pipelined(self):
+        from tokenizers import models, pre_tokenizers
+
+        # small local tokenizer, so that no download is needed
+        vocab = {word: i for i, word in enumerate(sorted({word for text in TEXTS for word in text.split()}))}
+        vocab["<unk>"], vocab["<|endoftext|>"] = len(vocab), len(vocab) + 1
+        tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+        tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+        tokenizer_path = os.path.join(self.tmp_dir, "tokenizer.json")
+        tokenizer.save(tokenizer_path)
+
+        outputs = []
+        for pipelined in (False, True):
+            tokens_dir = os.path.join(self.tmp_dir, f"pipelined_{pipelined}")
+            document_tokenizer = DocumentTokenizer(
+                tokens_dir,
+                tokenizer_name_or_path=tokenizer_path,
+                shuffle=False,
+                batch_size=3,
+                save_loss_metadata=True,
+                pipelined=pipelined,
+                tokenizer_threads=1,
+            )
+            for worker, worker_data in enumerate(DATA):
+                document_tokenizer(worker_data, rank=worker, world_size=WORKERS)
+            input_folder = get_datafolder(tokens_dir)
+            check_dataset(input_folder, tokenizer=tokenizer_path)
+            outputs.append(
+                {file: input_folder.open(file, "rb").read() for file in input_folder.list_files(glob_pattern="*.ds*")}
+            )
+        self.assertEqual(len(outputs[0]), 4 * WORKERS)
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_estimated_token_counts(self):
+        from tokenizers import models, pre_tokenizers
+
+        vocab = {word: i for i, word in enumerate(sorted({word for text in TEXTS for word in text.split()}))}
+        vocab["<unk>"] = len(vocab)
+        tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+        tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+        tokenizer_path = os.path.join(self.tmp_dir, "tokenizer.json")
+        tokenizer.save(tokenizer_path)
+
+        def get_documents():
+            return [
+                Document(text=text, id=f"{i}_{j}", metadata={"language": ["en", "fr"][i % 2]})
+                for i in range(20)
+                for j, text in enumerate(TEXTS)
+            ]
+
+        exact_counts = [
+            document.metadata["token_count"]
+            for document in TokensCounter(tokenizer_path, batch_size=16).run(get_documents())
+        ]
+        counter = TokensCounter(
+            tokenizer_path,
+            batch_size=16,
+            estimate=True,
+            max_relative_error=0.5,
+            min_calibration_docs=16,
+        )
+        documents = list(counter.run(get_documents()))
+        estimated = [document.metadata.get("token_count_estimated", False) for document in documents]
+        # the first batch is tokenized, and the ratios of both languages are calibrated after the second one
+        self.assertFalse(any(estimated[:32]))
+        self.assertTrue(all(estimated[32:]))
+        self.assertEqual([document.metadata["token_count"] for document in documents[:32]], exact_counts[:32])
+        total = sum(document.metadata["token_count"] for document in documents)
+        self.assertAlmostEqual(total / sum(exact_counts), 1, delta=0.1)
+        for language in ("en", "fr"):
+            self.assertLessEqual(counter.stats[f"{language}_relative_error"].mean, 0.5)
+            self.assertGreater(counter.stats[f"{language}_tokens_per_chars"].mean, 0)
+
+
+class TestTokenizedFile(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def test_write_batch(self):
+        docs = [[1, 2, 3], [], [65535, 0], [7] * 2000]
+        loss_values = [np.array([1.0, 0.0, 1.0]), np.ones(0), np.array([0.0, 1.0]), np.ones(2000)]
+        for token_size, token_format in ((2, "H"), (4, "I")):
+            with self.subTest(token_size=token_size):
+                tokenized_file = TokenizedFile(
+                    self.tmp_dir, f"batch_{token_size}.ds", save_loss_metadata=True, token_size=token_size
+                )
+                tokenized_file.write(docs[0], loss_values[0])
+                tokenized_file.write_batch(docs[1:], loss_values[1:])
+                tokenized_file.close()
+                self.assertEqual(len(tokenized_file), 2005)
+
+                doc_ends = [3, 3, 5, 2005]
+                folder = get_datafolder(self.tmp_dir)
+                self.assertEqual(load_doc_ends(folder.open(f"batch_{token_size}.ds.index", "rb")), doc_ends)
+                with folder.open(f"batch_{token_size}.ds", "rb") as f:
+                    self.assertEqual(
+                        f.read(), struct.pack(f"<%s{token_format}" % doc_ends[-1], *[t for doc in docs for t in doc])
+                    )
+                with folder.open(f"batch_{token_size}.ds.loss", "rb") as f:
+                    self.assertEqual(f.read(), bytes([1, 0, 1, 0, 1] + [1] * 2000))
+
+    def test_megatron_index(self):
+        docs = [[1, 2, 3], [], [65535, 0], [7] * 20, [4, 5]]
+        # a small index chunk size, so that sequence lengths are spilled to disk
+        tokenized_file = MegatronTokenizedFile(self.tmp_dir, "megatron", index_chunk_size=2)
+        tokenized_file.write(docs[0])
+        tokenized_file.write_batch(docs[1:])
+        tokenized_file.close()
+        self.assertEqual(len(tokenized_file), 27)
+
+        folder = get_datafolder(self.tmp_dir)
+        with folder.open("megatron.bin", "rb") as f:
+            self.assertEqual(f.read(), struct.pack("<27H", *[t for doc in docs for t in doc]))
+        with folder.open("megatron.idx", "rb") as f:
+            self.assertEqual(f.read(18), b"MMIDIDX\x00\x00" + struct.pack("<QB", 1, 8))
+            self.assertEqual(struct.unpack("<QQ", f.read(16)), (5, 6))
+            self.assertEqual(list(struct.unpack("<5i", f.read(20))), [3, 0, 2, 20, 2])
+            self.assertEqual(list(struct.unpack("<5q", f.read(40))), [0, 6, 6, 10, 50])
+            self.assertEqual(list(struct.unpack("<6q", f.read(48))), [0, 1, 2, 3, 4, 5])
+            self.assertEqual(f.read(), b"")
+
+    def test_read_documents(self):
+        rng = np.random.default_rng(0)
+        files_doc_ends = [np.cumsum(rng.integers(0, 50, size=200)) for _ in range(3)]
+        files_data = [rng.integers(0, 2**16, size=doc_ends[-1], dtype="<u2").tobytes() for doc_ends in files_doc_ends]
+        file_ids = rng.permutation(np.repeat(np.arange(3), 200))
+        doc_ids = np.concatenate([rng.permutation(200) for _ in range(3)])
+        starts, ends = get_document_bounds(files_doc_ends, file_ids, doc_ids)
+        expected = b"".join(files_data[f][s * 2 : e * 2] for f, s, e in zip(file_ids, starts, ends))
+        for chunk_size, max_read_gap in ((1, 0), (1000, 0), (1000, 100), (2**20, 2**20)):
+            with self.subTest(chunk_size=chunk_size, max_read_gap=max_read_gap):
+                chunks = list(
+                    read_documents(
+                        [io.BytesIO(data) for data in files_data],
+                        file_ids,
+                        starts,
+                        ends,
+                        item_size=2,
+                        chunk_size=chunk_size,
+                        max_read_gap=max_read_gap,
+                    )
+                )
+                self.assertEqual(b"".join(data for data, _ in chunks), expected)
+                self.assertEqual(sum(len(doc_ends) for _, doc_ends in chunks), len(file_ids))
+                self.assertEqual(
+                    np.concatenate(
+                        [doc_ends - np.concatenate(([0], doc_ends[:-1])) for _, doc_ends in chunks]
+                    ).tolist(),
+                    (ends - starts).tolist(),
+                )
+
+    def test_read_documents_bytes_read(self):
+        class CountingBytesIO(io.BytesIO):
+            bytes_read = 0
+
+            def read(self, size=-1):
+                data = super().read(size)
+                self.bytes_read += len(data)
+                return data
+
+        rng = np.random.default_rng(0)
+        doc_ends = np.cumsum(rng.integers(1, 50, size=2000))
+        data = rng.integers(0, 2**16, size=doc_ends[-1], dtype="<u2").tobytes()
+        doc_ids = rng.permutation(len(doc_ends))
+        file_ids = np.zeros_like(doc_ids)
+        starts, ends = get_document_bounds([doc_ends], file_ids, doc_ids)
+        # randomly ordered documents: each chunk is spread over the whole file
+        file = CountingBytesIO(data)
+        chunks = list(
+            read_documents([file], file_ids, starts, ends, item_size=2, chunk_size=len(data) // 16, max_read_gap=2**20)
+        )
+        self.assertEqual(
+            b"".join(data for data, _ in chunks), b"".join(data[s * 2 : e * 2] for s, e in zip(starts, ends))
+        )
+        self.assertLessEqual(file.bytes_read, 2 * len(data))
+
+    def test_merger_multiple_ranks(self):
+        rng = np.random.default_rng(0)
+        input_dir = os.path.join(self.tmp_dir, "input")
+        for file_id in range(3):
+            tokenized_file = TokenizedFile(input_dir, f"{file_id:05d}_shuffled.ds", save_loss_metadata=True)
+            docs = [rng.integers(0, 2**16, size=rng.integers(1, 100)).tolist() for _ in range(50)]
+            tokenized_file.write_batch(docs, [rng.random(len(doc)) > 0.5 for doc in docs])
+            tokenized_file.close()
+
+        outputs = []
+        for world_size in (1, 3):
+            output_dir = os.path.join(self.tmp_dir, f"merged_{world_size}")
+            for rank in range(world_size):
+                DocumentTokenizerMerger(
+                    input_dir,
+                    output_dir,
+                    save_filename="merged",
+                    max_tokens_per_file=1000,
+                    seed=42,
+                    save_loss_metadata=True,
+                    progress=False,
+                )(None, rank=rank, world_size=world_size)
+            output_folder = get_datafolder(output_dir)
+            outputs.append({file: output_folder.open(file, "rb").read() for file in output_folder.list_files()})
+        self.assertGreater(len(outputs[0]), 3 * 4)
+        self.assertEqual(outputs[0], outputs[1])
+
+        with self.assertRaises(ValueError):
+            DocumentTokenizerMerger(input_dir, output_dir, save_filename="merged").run(rank=0, world_size=2)
+
+    def test_mixer(self):
+        rng = np.random.default_rng(0)
+        sources, source_sizes = [os.path.join(self.tmp_dir, f"source_{source}") for source in range(2)], [0, 0]
+        # tokens of the first source are < 1000, tokens of the second one are >= 1000
+        for source, (nb_files, first_token) in enumerate(((2, 0), (1, 1000))):
+            for file_id in range(nb_files):
+                tokenized_file = TokenizedFile(sources[source], f"{file_id:05d}.ds")
+                tokenized_file.write_batch(
+                    [(first_token + rng.integers(0, 1000, size=rng.integers(1, 50))).tolist() for _ in range(100)]
+                )
+                tokenized_file.close()
+                source_sizes[source] += len(tokenized_file)
+
+        for sub_test, kwargs, expected_tokens in (
+            ("weights", {"weights": [3, 1], "max_tokens": 3001}, (2251, 750)),
+            ("epochs", {"weights": [1, 1], "epochs": [1, 3]}, (source_sizes[0], source_sizes[0])),
+            ("all", {}, tuple(source_sizes)),
+        ):
+            with self.subTest(sub_test):
+                output_dir = os.path.join(self.tmp_dir, f"mixed_{sub_test}")
+                for rank in range(2):
+                    DocumentTokenizerMixer(
+                        sources,
+                        output_dir,
+                        save_filename="mixed",
+                        max_tokens_per_file=1000,
+                        seed=1,
+                        progress=False,
+                        **kwargs,
+                    )(None, rank=rank, world_size=2)
+                output_folder = get_datafolder(output_dir)
+                tokens = np.concatenate(
+                    [
+                        np.frombuffer(output_folder.open(file, "rb").read(), dtype="<u2")
+                        for file in output_folder.list_files(glob_pattern="*.ds")
+                    ]
+                )
+                self.assertEqual(((tokens < 1000).sum(), (tokens >= 1000).sum()), expected_tokens)
+
+        with self.assertRaises(ValueError):
+            DocumentTokenizerMixer(sources, self.tmp_dir, save_filename="mixed", weights=[1, 1], max_tokens=10**6)(
+                None
+            )
+
+    def test_best_fit_decreasing(self):
+        lengths = np.array([5, 7, 3, 2, 4, 6, 1, 4])
+        bin_ids = best_fit_decreasing(lengths, 8)
+        self.assertEqual(bin_ids.tolist(), [2, 0, 2, 1, 3, 1, 0, 3])
+        self.assertTrue((np.bincount(bin_ids, weights=lengths) <= 8).all())
+
+    def test_packer(self):
+        rng = np.random.default_rng(0)
+        sequence_length = 32
+        docs = [rng.integers(1, 2**16, size=rng.integers(1, 80 if i % 10 == 0 else 20)).tolist() for i in range(200)]
+        tokenized_file = TokenizedFile(os.path.join(self.tmp_dir, "input"), "00000.ds", save_loss_metadata=True)
+        tokenized_file.write_batch(docs, [np.ones(len(doc)) for doc in docs])
+        tokenized_file.close()
+
+        DocumentTokenizerPacker(
+            os.path.join(self.tmp_dir, "input"),
+            os.path.join(self.tmp_dir, "packed"),
+            sequence_length=sequence_length,
+            seed=0,
+            save_loss_metadata=True,
+        )(None)
+        folder = get_datafolder(os.path.join(self.tmp_dir, "packed"))
+        tokens = np.frombuffer(folder.open("00000.ds", "rb").read(), dtype="<u2")
+        loss = np.frombuffer(folder.open("00000.ds.loss", "rb").read(), dtype=bool)
+        doc_ends = load_doc_ends(folder.open("00000.ds.index", "rb"))
+        self.assertEqual(len(tokens) % sequence_length, 0)
+        self.assertEqual(doc_ends[-1], len(tokens))
+        # sequences end on document boundaries, and only the padding has no loss
+        self.assertLessEqual(set(range(sequence_length, len(tokens) + 1, sequence_length)), set(doc_ends))
+        self.assertEqual((tokens == 0).tolist(), (~loss).tolist())
+        self.assertEqual(loss.sum(), sum(len(doc) for doc in docs))
+        # documents that fit are never cut
+        sequences = [sequence.tobytes() for sequence in tokens.reshape(-1, sequence_length)]
+        for doc in docs:
+            if len(doc) <= sequence_length:
+                self.assertTrue(any(np.array(doc, dtype="<u2").tobytes() in sequence for sequence in sequences))
+
+    def test_context_shuffler(self):
+        rng = np.random.default_rng(0)
+        tokens = rng.integers(0, 2**16, size=1000, dtype="<u2")
+        window_size = 30
+        # a local folder (memory mapped) and a remote one
+        for input_dir in (os.path.join(self.tmp_dir, "input"), f"memory://{self.tmp_dir}/input"):
+            with self.subTest(input_dir=input_dir):
+                output_dir = f"{input_dir}_shuffled"
+                tokenized_file = TokenizedFile(input_dir, "00000.ds")
+                tokenized_file.write_bytes(tokens.tobytes())
+                tokenized_file.close()
+                DocumentTokenizerContextShuffler(input_dir, output_dir, window_size=window_size, seed=0)(None)
+                shuffled = np.frombuffer(get_datafolder(output_dir).open("00000.ds", "rb").read(), dtype="<u2")
+                windows = tokens[: len(tokens) // window_size * window_size].reshape(-1, window_size)
+                shuffled_windows = shuffled.reshape(-1, window_size)
+                self.assertEqual(len(shuffled_windows), len(windows))
+                self.assertFalse(np.array_equal(shuffled_windows, windows))
+                self.assertEqual(sorted(map(bytes, shuffled_windows)), sorted(map(bytes, windows)))
+
+    def test_context_shuffler_bytes_read(self):
+        rng = np.random.default_rng(0)
+        tokens = rng.integers(0, 2**16, size=32000, dtype="<u2")
+        input_dir = f"memory://{self.tmp_dir}/input"
+        tokenized_file = TokenizedFile(input_dir, "00000.ds")
+        tokenized_file.write_bytes(tokens.tobytes())
+        tokenized_file.close()
+
+        bytes_read = []
+
+        def counting_read(file, size=-1):
+            data = io.BytesIO.read(file, size)
+            bytes_read.append(len(data))
+            return data
+
+        # remote files are not memory mapped: each chunk of windows must not read the whole file
+        with (
+            mock.patch.object(MemoryFile, "read", counting_read),
+            mock.patch(
+                "datatrove.pipeline.tokens.context_shuffler.read_documents",
+                partial(read_documents, chunk_size=tokens.nbytes // 16),
+            ),
+        ):
+            DocumentTokenizerContextShuffler(input_dir, f"{input_dir}_shuffled", window_size=16, seed=0)(None)
+        shuffled = get_datafolder(f"{input_dir}_shuffled").open("00000.ds", "rb").read()
+        self.assertEqual(
+            sorted(map(bytes, np.frombuffer(shuffled, dtype="<u2").reshape(-1, 16))),
+            sorted(map(bytes, tokens.reshape(-1, 16))),
+        )
+        # the index file is read too
+        self.assertLessEqual(sum(bytes_read), 2 * tokens.nbytes + 64)
@@ -0,0 +1,63 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import fsspec
+import numpy as np
+
+from datatrove.utils.dataset import DatatroveFolderDataset
+
+from .utils import require_torch
+
+
+SEQ_LEN = 9
+FILE_TOKENS = (1000, 1037, 1074)
+
+
+@require_torch
+class TestDatatroveFolderDataset(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        rng = np.random.default_rng(0)
+        os.makedirs(os.path.join(self.tmp_dir, "data"))
+        samples = []
+        for i, nb_tokens in enumerate(FILE_TOKENS):
+            tokens = rng.integers(0, 2**16, size=nb_tokens, dtype=np.uint16)
+            tokens.tofile(os.path.join(self.tmp_dir, "data", f"{i:03d}.ds"))
+            samples.append(tokens[: nb_tokens // (SEQ_LEN + 1) * (SEQ_LEN + 1)].reshape(-1, SEQ_LEN + 1))
+        self.samples = np.concatenate(samples)
+
+    def check_dataset(self, dataset):
+        self.assertEqual(len(dataset), len(self.samples))
+        for i in (0, 1, 99, 100, len(dataset) - 1):
+            self.assertEqual(dataset[i]["input_ids"].tolist(), self.samples[i].tolist())
+        items = [5, 6, 7, 7, 250, 3, 99, 100, len(dataset) - 1]
+        for item, sample in zip(items, dataset.__getitems__(items)):
+            self.assertEqual(sample["input_ids"].tolist(), self.samples[item].tolist())
+
+    def test_local(self):
+        dataset = DatatroveFolderDataset(os.path.join(self.tmp_dir, "data"), SEQ_LEN)
+        self.check_dataset(dataset)
+        # file handles are not pickled, and are reopened when needed
+        self.check_dataset(pickle.loads(pickle.dumps(dataset)))
+
+    def test_remote(self):
+        fs = fsspec.filesystem("memory")
+        fs.put(os.path.join(self.tmp_dir, "data"), f"{self.tmp_dir}/data", recursive=True)
+        self.addCleanup(fs.rm, f"{self.tmp_dir}/data", recursive=True)
+        self.check_dataset(DatatroveFolderDataset(f"memory://{self.tmp_dir}/data", SEQ_LEN))
+
+    def test_manifest(self):
+        manifest_file = os.path.join(self.tmp_dir, "manifest.json")
+        self.check_dataset(
+            DatatroveFolderDataset(os.path.join(self.tmp_dir, "data"), SEQ_LEN, manifest_file=manifest_file)
+        )
+        self.assertTrue(os.path.isfile(manifest_file))
+        # files added after the manifest was created are not listed
+        shutil.copy(os.path.join(self.tmp_dir, "data", "000.ds"), os.path.join(self.tmp_dir, "data", "003.ds"))
+        self.check_dataset(
+            DatatroveFolderDataset(os.path.join(self.tmp_dir, "data"), SEQ_LEN, manifest_file=manifest_file)
+        )
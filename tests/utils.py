@@ -141,3 +141,11 @@ def require_lighteval(test_case):
     except ImportError:
         test_case = unittest.skip("test requires lighteval")(test_case)
     return test_case
+
+
+def require_torch(test_case):
+    try:
+        import torch  # noqa: F401
+    except ImportError:
+        test_case = unittest.skip("test requires torch")(test_case)
+    return test_case